@@ -1,2 +1,2 @@
-from .codegen import PinDefs, CodeGenerationException, maybe_generate_code, SpeedFormats
-from .profiles import read_profiles, save_profile, read_profile, profile_names, overwrite_profiles, MicrocontrollerProfile, AutoGeneratedProfile, InvalidProfileException
\ No newline at end of file
+from .codegen import PinDefs, CodeGenerationException, maybe_generate_code, SpeedFormats, TachoModes
+from .profiles import read_profiles, save_profile, read_profile, profile_names, overwrite_profiles, MicrocontrollerProfile, AutoGeneratedProfile, MultiPortProfile, InvalidProfileException
\ No newline at end of file
@@ -0,0 +1,10 @@
+#define ackChar '!'
+
+void acknowledgeCommand(PumpConnection& pmp){
+  // tell the computer that the duty has been applied, in the format !name,duty
+  Serial.print(ackChar);
+  Serial.print(pmp.name);
+  Serial.print(',');
+  Serial.print(pmp.duty);
+  Serial.print('\n');
+}
@@ -0,0 +1,5 @@
+void acknowledgeCommand(PumpConnection& pmp){
+  // tell the computer that the duty has been applied, in an ack frame containing the pump name and duty
+  uint8_t payload[2] = {(uint8_t) pmp.name, (uint8_t) pmp.duty};
+  sendFrame(ackFrame,payload,2);
+}
@@ -0,0 +1,40 @@
+// Binary command reader: duty frames are assembled byte by byte across calls, so back-to-back frames and frames split across several loop iterations are all applied
+#define maxRxPayload 8
+// type, sequence, length, payload and CRC of the frame being received (the sync byte is not stored)
+uint8_t rxFrame[3+maxRxPayload+2];
+uint8_t rxCount = 0;
+bool inFrame = false;
+
+void readOneCommand(){
+  // consume bytes until one frame is complete or the serial buffer is empty
+  while (Serial.available() > 0){
+    uint8_t nextByte = (uint8_t) Serial.read();
+    if (!inFrame){
+      // ignore anything until the start of a frame, apart from a request for the banner
+      if (nextByte == syncByte){
+        inFrame = true;
+        rxCount = 0;
+      }else if (nextByte == queryChar){
+        sendBanner();
+      }
+      continue;
+    }
+    rxFrame[rxCount++] = nextByte;
+    if (rxCount == 3 && rxFrame[2] > maxRxPayload){
+      // no command is this long: the sync byte was noise
+      inFrame = false;
+    }else if (rxCount >= 3 && rxCount == 3 + rxFrame[2] + 2){
+      inFrame = false;
+      uint16_t crc = 0xFFFF;
+      for (int i=0;i<rxCount-2;i++){
+        crc = crc16Update(crc,rxFrame[i]);
+      }
+      uint16_t receivedCrc = (((uint16_t) rxFrame[rxCount-2]) << 8) | rxFrame[rxCount-1];
+      // corrupted frames are discarded
+      if (crc == receivedCrc && rxFrame[0] == dutyFrame && rxFrame[2] == 2 && checkName((char) rxFrame[3])){
+        applyDuty((char) rxFrame[3],rxFrame[4]);
+      }
+      return;
+    }
+  }
+}
@@ -0,0 +1,38 @@
+// Binary frames: syncByte | type | sequence | payload length | payload | CRC-16/CCITT-FALSE (high byte first)
+// The CRC covers the type, sequence, length and payload bytes
+#define syncByte 0xA5
+#define speedFrame 'S'
+#define dutyFrame 'D'
+#define ackFrame 'A'
+
+uint8_t txSequence = 0;
+
+uint16_t crc16Update(uint16_t crc, uint8_t data){
+  crc ^= ((uint16_t) data) << 8;
+  for (int i=0;i<8;i++){
+    if (crc & 0x8000){
+      crc = (crc << 1) ^ 0x1021;
+    }else{
+      crc = crc << 1;
+    }
+  }
+  return crc;
+}
+
+void sendFrame(uint8_t type, const uint8_t* payload, uint8_t length){
+  uint8_t header[3] = {type, txSequence, length};
+  uint16_t crc = 0xFFFF;
+  for (int i=0;i<3;i++){
+    crc = crc16Update(crc,header[i]);
+  }
+  for (int i=0;i<length;i++){
+    crc = crc16Update(crc,payload[i]);
+  }
+  Serial.write((uint8_t) syncByte);
+  Serial.write(header,3);
+  Serial.write(payload,length);
+  Serial.write((uint8_t) (crc >> 8));
+  Serial.write((uint8_t) (crc & 0xFF));
+  // the sequence number lets the computer count frames that were lost or rejected
+  txSequence++;
+}
@@ -0,0 +1,13 @@
+// this is the binary method! Speeds are collected, then sent together as one frame of little endian uint16 rpm values
+uint8_t speedPayload[2*numPumps];
+
+void sendSpeed(int i, long rpm){
+  // saturate rather than wrap around if the rpm does not fit
+  unsigned int clamped = (rpm > 65535) ? 65535 : rpm;
+  speedPayload[2*i] = clamped & 0xFF;
+  speedPayload[2*i+1] = clamped >> 8;
+}
+
+void endSpeeds(){
+  sendFrame(speedFrame,speedPayload,2*numPumps);
+}
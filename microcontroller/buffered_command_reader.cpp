@@ -0,0 +1,51 @@
+// Stateful command reader: the partially parsed command is kept between calls, so commands that arrive
+// back-to-back in one frame (<a,100><b,120>...) or split across several loop iterations are all applied
+char commandName = '\0';
+unsigned int commandDuty = 0;
+bool inCommand = false;
+bool readingDuty = false;
+bool commandValid = false;
+
+void readOneCommand(){
+  // consume characters until one command is complete or the serial buffer is empty
+  while (Serial.available() > 0){
+    char nextChar = (char) Serial.read();
+    if (nextChar == startChar){
+      // a new command starts here - anything partially read before it is abandoned
+      inCommand = true;
+      readingDuty = false;
+      commandValid = false;
+      commandName = '\0';
+      commandDuty = 0;
+    }else if (!inCommand){
+      // ignore anything between commands, apart from a request for the banner
+      if (nextChar == queryChar){
+        sendBanner();
+      }
+    }else if (nextChar == endChar){
+      inCommand = false;
+      if (readingDuty && commandValid){
+        // command complete, save the duty to the pump (or pumps) and mark it as modified
+        applyDuty(commandName,(commandDuty > 255) ? 255 : commandDuty);
+      }
+      return;
+    }else if (nextChar == ','){
+      // "," separates name and duty, so next section of the serial command is the duty
+      readingDuty = true;
+      commandValid = checkName(commandName);
+    }else if (readingDuty){
+      if (isDigit(nextChar)){
+        // stop accumulating once the value is out of range, so that it cannot overflow. It is clamped to 255 when applied
+        if (commandDuty < 1000){
+          commandDuty = commandDuty*10 + (nextChar - '0');
+        }
+      }else{
+        // malformed command: discard it
+        inCommand = false;
+      }
+    }else{
+      // for now, the name is only a single char
+      commandName = nextChar;
+    }
+  }
+}
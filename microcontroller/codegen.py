@@ -1,16 +1,35 @@
 from dataclasses import dataclass
 from pathlib import Path
 from support_classes import open_local, get_path, PumpConfig
+from serial_interface.capabilities import FirmwareCapabilities, SpeedFormat, BANNER_VERSION
 from enum import Enum
+from typing import Any
+import inspect
 import os
 
 PREAMBLE_PATH = Path(__file__).parent/"preamble.cpp"
 MAIN_CODE_PATH = Path(__file__).parent/"main_code.cpp"
 NAME_VALUE_FUNCTION_PATH = Path(__file__).parent/"name_value_speeds.cpp"
 COMMA_SEPARATED_FUNCTION_PATH = Path(__file__).parent/"comma_separated_speeds.cpp"
+BUFFERED_READER_PATH = Path(__file__).parent/"buffered_command_reader.cpp"
+SINGLE_READER_PATH = Path(__file__).parent/"single_command_reader.cpp"
+ACKNOWLEDGED_COMMANDS_PATH = Path(__file__).parent/"acknowledged_commands.cpp"
+UNACKNOWLEDGED_COMMANDS_PATH = Path(__file__).parent/"unacknowledged_commands.cpp"
+BINARY_FRAMING_PATH = Path(__file__).parent/"binary_framing.cpp"
+BINARY_SPEEDS_FUNCTION_PATH = Path(__file__).parent/"binary_speeds.cpp"
+BINARY_READER_PATH = Path(__file__).parent/"binary_command_reader.cpp"
+BINARY_ACKNOWLEDGED_COMMANDS_PATH = Path(__file__).parent/"binary_acknowledged_commands.cpp"
+PULSE_COUNT_TACHOMETER_PATH = Path(__file__).parent/"pulse_count_tachometer.cpp"
+PERIOD_TACHOMETER_PATH = Path(__file__).parent/"period_tachometer.cpp"
 CODEGEN_PATH = Path("codegen")
 SUPPORTED_EXTENSIONS = ["ino","cpp"]
 
+DEFAULT_BAUDRATE = 9600
+DEFAULT_REPORT_PERIOD = 1.0
+"""Seconds between speed reports sent by the microcontroller"""
+DEFAULT_TACHO_AVERAGE = 4
+"""Number of edge periods averaged by the period tachometer"""
+
 class SpeedFormats(Enum):
     COMMA_SEPARATED = "comma_separated"
     """Speeds are sent in the format a_speed,b_speed,c_speed,...
@@ -19,6 +38,13 @@ class SpeedFormats(Enum):
     """Speeds are sent in the format <pump_name,pump_speed><pump_name,pump_speed>...
     Requires more processing but is robust to discrepancies in list ordering between computer and microcontroller"""
 
+class TachoModes(Enum):
+    PULSE_COUNT = "pulse_count"
+    """Tachometer edges are counted over each report period.
+    Resolution is one edge per report period (60 rpm at 1 s), and edges are missed while the counts are read"""
+    PERIOD = "period"
+    """The time between tachometer edges is measured with micros(), and averaged over the last few edges.
+    Resolution does not depend on the report period, so speeds can be reported far more often, and no edge is missed"""
 
 @dataclass
 class PinDefs:
@@ -31,7 +57,14 @@ class PinDefs:
     def as_tuple(self) -> tuple[int,int]:
         return [self.tacho_pin,self.pwm_pin]
 
-def generate_code(name: str, pump_list: list[PinDefs], spd_format: SpeedFormats = SpeedFormats.COMMA_SEPARATED) -> Path:
+def generate_code(name: str, pump_list: list[PinDefs], spd_format: SpeedFormats = SpeedFormats.COMMA_SEPARATED, batch_commands: bool = True, acknowledge_commands: bool = True, binary_protocol: bool = False, baudrate: int = DEFAULT_BAUDRATE, report_period: float = DEFAULT_REPORT_PERIOD, tacho_mode: TachoModes = TachoModes.PULSE_COUNT, tacho_average: int = DEFAULT_TACHO_AVERAGE) -> Path:
+    """Generate microcontroller code for the given pin assignments.
+    If batch_commands is True, the code uses a stateful command reader that applies every command in a frame of back-to-back commands (<a,100><b,120>...).
+    Otherwise, the original reader that expects one command per write is used.
+    If acknowledge_commands is True, the code sends a line !name,duty each time it applies a duty, so the computer can send the next command straight away.
+    If binary_protocol is True, speeds, commands and acknowledgements are all exchanged as binary frames with a sequence number and CRC instead of text. spd_format and batch_commands are then ignored: the binary reader always accepts back-to-back frames.
+    The code opens its serial port at baudrate and sends speeds every report_period seconds, measured as set by tacho_mode (averaging tacho_average edges in TachoModes.PERIOD).
+    It describes all of these options in a banner (see serial_interface.capabilities), sent when it starts and whenever it is asked, so that the computer can match them."""
     
     # Pump array initialisation line
     pump_cpp_arr = f"PumpConnection pumps[{len(pump_list)}] = "+"{"
@@ -42,7 +75,7 @@ def generate_code(name: str, pump_list: list[PinDefs], spd_format: SpeedFormats
     # ISR function names and definition lines
     ISR_funs: dict[str,str] = {}
     for i in range(0,len(pump_list)):
-        ISR_funs = {**ISR_funs,f"ISR_{i}":f"void ISR_{i}(){{ pumps[{i}].isr(); }}"}
+        ISR_funs = {**ISR_funs,f"ISR_{i}":f"void ISR_{i}(){{ recordEdge({i}); }}"}
     ISR_defs = "\n".join(ISR_funs.values())
     ISR_array_inner = "*"+",*".join(ISR_funs.keys())
     ISR_array = f"ISRPointer isrFuns[numPumps] = {{{ISR_array_inner}}};"
@@ -60,8 +93,32 @@ def generate_code(name: str, pump_list: list[PinDefs], spd_format: SpeedFormats
         case SpeedFormats.NAME_VALUE:
             spd_filename = NAME_VALUE_FUNCTION_PATH
     
+    reader_filename = BUFFERED_READER_PATH if batch_commands else SINGLE_READER_PATH
+    ack_filename = ACKNOWLEDGED_COMMANDS_PATH if acknowledge_commands else UNACKNOWLEDGED_COMMANDS_PATH
+
+    framing_code = ""
+    if binary_protocol:
+        # every pump has a fixed slot in the speed frame, so pumps without a tachometer need no special treatment
+        spd_filename = BINARY_SPEEDS_FUNCTION_PATH
+        reader_filename = BINARY_READER_PATH
+        ack_filename = BINARY_ACKNOWLEDGED_COMMANDS_PATH if acknowledge_commands else UNACKNOWLEDGED_COMMANDS_PATH
+        with open(BINARY_FRAMING_PATH,"r") as f:
+            framing_code = f.read()
+    
+    # the generated code always understands the broadcast name (see preamble.cpp)
+    banner = FirmwareCapabilities(BANNER_VERSION,len(pump_list),SpeedFormat.BINARY if binary_protocol else spd_format.value,batch_commands or binary_protocol,acknowledge_commands,binary_protocol,True,baudrate,report_period,tacho_mode.value).to_banner()
+
+    tacho_filename = PERIOD_TACHOMETER_PATH if tacho_mode == TachoModes.PERIOD else PULSE_COUNT_TACHOMETER_PATH
+    tacho_constants = f"const uint8_t tachoAverage = {max(tacho_average,1)};" if tacho_mode == TachoModes.PERIOD else ""
+
     with open(spd_filename,"r") as f:
         spd_function = f.read()
+    with open(reader_filename,"r") as f:
+        command_reader = f.read()
+    with open(ack_filename,"r") as f:
+        ack_function = f.read()
+    with open(tacho_filename,"r") as f:
+        tachometer = f.read()
     with open(PREAMBLE_PATH,"r") as f:
         preamble = f.read()
     with open(MAIN_CODE_PATH,"r") as f:
@@ -70,15 +127,27 @@ def generate_code(name: str, pump_list: list[PinDefs], spd_format: SpeedFormats
     code_out = f"""
 {preamble}
 const unsigned int numPumps = {len(pump_list)};
+const unsigned long serialWritePeriod = {max(int(round(report_period*1000)),1)};
+const unsigned long baudRate = {baudrate};
+const char capabilityBanner[] = "{banner}";
+{tacho_constants}
 {pump_cpp_arr}
 
 {ISR_defs}
 
 {ISR_array}
 
+{framing_code}
+
 {spd_function}
 
+{ack_function}
+
+{tachometer}
+
 {main_code}
+
+{command_reader}
 """
     return _save_code(name,code_out)
 
@@ -108,7 +177,13 @@ def _save_code(filename: str, code: str):
     return get_path(pwd_test)
     
 
-def maybe_generate_code(name: str, pump_list: list[PinDefs], compare_to: list[PinDefs] = None, silent=False) -> Path|None:
+def _resolve_options(codegen_options: dict[str,Any]) -> dict[str,Any]:
+    """Every option of generate_code, taking its default where it is not given"""
+    defaults = {param.name: param.default for param in inspect.signature(generate_code).parameters.values() if param.default is not inspect.Parameter.empty}
+    return {**defaults, **codegen_options}
+
+def maybe_generate_code(name: str, pump_list: list[PinDefs], compare_to: list[PinDefs] = None, silent=False, compare_options: dict[str,Any]|None = None, **codegen_options) -> Path|None:
+    """Generate code (see generate_code), unless it would be identical to the existing code for the pin assignments in compare_to, generated with compare_options (or the default options, if they are not given)"""
     if len(pump_list)<1:
         ## no pin assignments - code can't be generated
         if silent:
@@ -116,14 +191,17 @@ def maybe_generate_code(name: str, pump_list: list[PinDefs], compare_to: list[Pi
         raise CodeGenerationException("Codegen failed - pump list is empty")
     if compare_to is None:
         ## nothing to check against for modifications - always generate
-        return generate_code(name,pump_list)
+        return generate_code(name,pump_list,**codegen_options)
     ## check for modifications and only re-generate if they exist
 
     if len(pump_list) != len(compare_to):
-        return generate_code()
+        return generate_code(name,pump_list,**codegen_options)
     for (new,original) in zip(pump_list,compare_to):
         if new.pwm_pin != original.pwm_pin or new.tacho_pin != original.tacho_pin:
-            return generate_code()
+            return generate_code(name,pump_list,**codegen_options)
+    # the same pins with e.g. a different baud rate, report period, protocol or tachometer mode still need new code
+    if _resolve_options(codegen_options) != _resolve_options(compare_options or {}):
+        return generate_code(name,pump_list,**codegen_options)
     if silent:
         return
     raise CodeGenerationException("Generated code is identical to already existing code")
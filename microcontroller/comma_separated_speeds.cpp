@@ -5,4 +5,8 @@ void sendSpeed(int i, long rpm){
   if (i<numPumps-1){
     Serial.print(',');
   }
+}
+
+void endSpeeds(){
+  Serial.print('\n');
 }
\ No newline at end of file
@@ -0,0 +1,368 @@
+from .codegen import PinDefs, SpeedFormats, TachoModes, DEFAULT_BAUDRATE, DEFAULT_REPORT_PERIOD, DEFAULT_TACHO_AVERAGE
+from serial_interface.protocols import SerialProtocol, TextProtocol, BinaryProtocol
+from serial_interface.GenericInterface import BROADCAST_PUMP
+from serial_interface.framing import SYNC_BYTE, FrameType, crc16
+from serial_interface.capabilities import FirmwareCapabilities, SpeedFormat, CAPABILITY_QUERY, BANNER_VERSION
+from support_classes import PumpConfig
+from collections import deque
+import threading
+import time
+import math
+import os
+import tty
+
+# Python model of the code produced by codegen.generate_code, attached to a pseudo terminal so that the application (or SerialInterface on its own) can talk to it exactly as it would to a real board.
+# The model follows main_code.cpp: every pass of loop() reads commands with readOneCommand, waits loopdelay, applies (and acknowledges) modified duties and sends speeds every serialWritePeriod.
+# The emulated clock runs clock_speed times faster than real time, so hours of operation can be exercised in minutes.
+
+LOOP_DELAY = 10
+"""loopdelay of preamble.cpp, in emulated milliseconds"""
+SERIAL_BUFFER_SIZE = 64
+"""Size of the receive and transmit buffers of the Arduino serial library. Bytes that arrive while the receive buffer is full are lost"""
+MAX_PUMP_RPM = 12300
+"""Speed of a pump at full duty"""
+PUMP_TIME_CONSTANT = 0.5
+"""Emulated seconds for a pump to cover 63% of a change in speed"""
+TACHO_TIMEOUT = 1.0
+"""tachoTimeout of period_tachometer.cpp, in emulated seconds"""
+
+class _EmulatedPump:
+    """A PumpConnection, with a first order model of the pump's speed driving its tachometer count (or, for the period tachometer, its edge periods)"""
+
+    def __init__(self, name: str, has_tacho: bool, int_mask: int, tacho_average: int = DEFAULT_TACHO_AVERAGE) -> None:
+        self.name = name
+        self.__int_mask = int_mask
+        self.has_tacho = has_tacho
+        self.duty = 0
+        self.modified = False
+        self.rpm = 0.0
+        self.rotation_count = 0
+        self.__rotations = 0.0
+        self.edge_periods: deque[float] = deque(maxlen=tacho_average)
+        self.last_edge: float|None = None
+
+    def advance(self, seconds: float, now: float):
+        # analogWrite saturates at 255
+        target = min(self.duty,255)/255*MAX_PUMP_RPM
+        previous = self.rpm
+        self.rpm = target + (previous - target)*math.exp(-seconds/PUMP_TIME_CONSTANT)
+        if not self.has_tacho:
+            return
+        # one tachometer pulse per rotation, counted in an unsigned int
+        start = self.__rotations
+        rotated = (previous + self.rpm)/2/60*seconds
+        self.__rotations += rotated
+        pulses = int(self.__rotations)
+        self.__rotations -= pulses
+        self.rotation_count = (self.rotation_count + pulses) & self.__int_mask
+        for k in range(1,pulses+1):
+            # recordEdge, at the time within the step that the rotation was completed
+            edge = now - seconds + seconds*(k - start)/rotated
+            if self.last_edge is not None:
+                self.edge_periods.append(edge - self.last_edge)
+            self.last_edge = edge
+
+    def period_rpm(self, now: float) -> int:
+        # periodRpm of period_tachometer.cpp
+        if self.last_edge is None:
+            return 0
+        since_edge = now - self.last_edge
+        if since_edge > TACHO_TIMEOUT:
+            self.edge_periods.clear()
+            self.last_edge = None
+            return 0
+        if len(self.edge_periods) == 0:
+            return 0
+        period = max(sum(self.edge_periods)/len(self.edge_periods),since_edge)
+        return int(60/period)
+
+class FirmwareEmulator:
+    """Emulates a microcontroller running the generated code on a pseudo terminal. Open `port` with SerialInterface (or any Serial) to talk to it.
+    The options are those of codegen.generate_code. int_bits is the width of an unsigned int on the board, which holds the rotation count of the pulse count tachometer: 16 on AVR boards such as the Uno, or 32 on ARM boards.
+    Only available on platforms with pseudo terminals (Linux, macOS)."""
+
+    def __init__(self, pump_list: list[PinDefs], spd_format: SpeedFormats = SpeedFormats.COMMA_SEPARATED, batch_commands: bool = True, acknowledge_commands: bool = True, binary_protocol: bool = False, baudrate: int = DEFAULT_BAUDRATE, report_period: float = DEFAULT_REPORT_PERIOD, clock_speed: float = 1.0, int_bits: int = 16, tacho_mode: TachoModes = TachoModes.PULSE_COUNT, tacho_average: int = DEFAULT_TACHO_AVERAGE) -> None:
+        if clock_speed <= 0:
+            raise ValueError("The clock speed must be positive")
+        if spd_format == SpeedFormats.COMMA_SEPARATED and any(pindef.tacho_pin<0 for pindef in pump_list):
+            # as in generate_code
+            spd_format = SpeedFormats.NAME_VALUE
+        self.__int_mask = (1 << int_bits) - 1
+        self.pumps = [_EmulatedPump(PumpConfig.allowable_values[i],pindef.tacho_pin>=0,self.__int_mask,max(tacho_average,1)) for i, pindef in enumerate(pump_list)]
+        self.spd_format = spd_format
+        self.tacho_mode = tacho_mode
+        self.batch_commands = batch_commands
+        self.acknowledge_commands = acknowledge_commands
+        self.binary_protocol = binary_protocol
+        self.protocol: SerialProtocol = BinaryProtocol() if binary_protocol else TextProtocol()
+        self.serial_write_period = max(int(round(report_period*1000)),1)
+        self.__baudrate = baudrate
+        self.clock_speed = clock_speed
+        self.__byte_time = 10/baudrate # start bit, 8 data bits and stop bit
+
+        self.dropped_bytes = 0
+        """Bytes lost because they arrived while the receive buffer was full"""
+        self.applied_commands = 0
+        """Number of duties applied by performCommands"""
+
+        self.__master, self.__slave = os.openpty()
+        tty.setraw(self.__master)
+        tty.setraw(self.__slave)
+        os.set_blocking(self.__master,False)
+        self.__port = os.ttyname(self.__slave)
+        self.__rx = bytearray()
+        self.__rx_line = bytearray()
+        self.__rx_line_start = 0.0
+        self.__tx_busy_until = 0.0
+        self.__start = time.monotonic()
+        self.__recent_millis = 0
+        self.__stop_event = threading.Event()
+        self.__thread: threading.Thread|None = None
+        # command reader state, kept between calls as in the stateful readers
+        self.__in_command = False
+        self.__reading_duty = False
+        self.__command_valid = False
+        self.__command_name = ""
+        self.__command_duty = 0
+        self.__frame = bytearray()
+
+    @property
+    def port(self) -> str:
+        return self.__port
+
+    @property
+    def capabilities(self) -> FirmwareCapabilities:
+        """As described by the banner of the generated code"""
+        return FirmwareCapabilities(BANNER_VERSION,len(self.pumps),SpeedFormat.BINARY if self.binary_protocol else self.spd_format.value,self.batch_commands or self.binary_protocol,self.acknowledge_commands,self.binary_protocol,True,self.__baudrate,self.serial_write_period/1000,self.tacho_mode.value)
+
+    def millis(self) -> int:
+        return int(self.__seconds()*1000)
+
+    def __seconds(self) -> float:
+        """Emulated time since setup()"""
+        return (time.monotonic() - self.__start)*self.clock_speed
+
+    def start(self):
+        """Run the firmware in a background thread"""
+        self.__thread = threading.Thread(target=self.run,daemon=True)
+        self.__thread.start()
+
+    def stop(self):
+        self.__stop_event.set()
+        if self.__thread is not None:
+            self.__thread.join()
+            self.__thread = None
+        os.close(self.__master)
+        os.close(self.__slave)
+
+    def run(self):
+        """setup() followed by loop() until stop is called"""
+        self.__start = time.monotonic()
+        self.__recent_millis = 0
+        last_millis = 0
+        self.__send_banner()
+        while not self.__stop_event.is_set():
+            while self.__available() > 0:
+                self.__read_one_command()
+            self.__delay(LOOP_DELAY)
+            now = self.millis()
+            for pump in self.pumps:
+                pump.advance((now - last_millis)/1000,now/1000)
+            last_millis = now
+            self.__perform_commands()
+            self.__write_speeds()
+
+    ## SERIAL
+    def __available(self) -> int:
+        now = self.__seconds()
+        try:
+            data = os.read(self.__master,4096)
+        except (BlockingIOError, OSError):
+            data = b""
+        if len(data) > 0:
+            if len(self.__rx_line) == 0:
+                self.__rx_line_start = now
+            self.__rx_line += data
+        # the pseudo terminal delivers a write all at once, but on a real line the bytes arrive one at a time at the baud rate
+        arrived = min(len(self.__rx_line),int((now - self.__rx_line_start)/self.__byte_time))
+        if arrived > 0:
+            # the receive interrupt moves each byte into the buffer, unless it is full
+            space = SERIAL_BUFFER_SIZE - len(self.__rx)
+            self.__rx += self.__rx_line[:min(arrived,space)]
+            self.dropped_bytes += max(arrived - space,0)
+            del self.__rx_line[:arrived]
+            self.__rx_line_start += arrived*self.__byte_time
+        return len(self.__rx)
+
+    def __read(self) -> int:
+        if len(self.__rx) == 0:
+            return -1
+        return self.__rx.pop(0)
+
+    def __write(self, data: bytes):
+        # bytes leave at the baud rate. Serial.write only blocks once the transmit buffer is full
+        now = self.__seconds()
+        self.__tx_busy_until = max(self.__tx_busy_until,now) + len(data)*self.__byte_time
+        blocked = self.__tx_busy_until - SERIAL_BUFFER_SIZE*self.__byte_time - now
+        try:
+            os.write(self.__master,data)
+        except OSError:
+            # nothing has the port open, and the output buffer of the pseudo terminal is full
+            pass
+        if blocked > 0:
+            time.sleep(blocked/self.clock_speed)
+
+    def __delay(self, ms: float):
+        time.sleep(ms/1000/self.clock_speed)
+
+    ## FIRMWARE
+    def __send_banner(self):
+        # sendBanner
+        self.__write((self.capabilities.to_banner()+"\n").encode())
+
+    def __check_name(self, name: str) -> bool:
+        # checkName: the broadcast name addresses every pump
+        return name == BROADCAST_PUMP or any(pump.name == name for pump in self.pumps)
+
+    def __apply_duty(self, name: str, duty: int):
+        # applyDuty
+        for pump in self.pumps:
+            if name == BROADCAST_PUMP or pump.name == name:
+                pump.duty = duty
+                pump.modified = True
+
+    def __read_one_command(self):
+        if self.binary_protocol:
+            self.__read_binary_command()
+        elif self.batch_commands:
+            self.__read_buffered_command()
+        else:
+            self.__read_single_command()
+
+    def __read_buffered_command(self):
+        # buffered_command_reader.cpp: the partial command is kept when the buffer runs out, and a "<" abandons it
+        while self.__available() > 0:
+            char = chr(self.__read())
+            if char == "<":
+                self.__in_command = True
+                self.__reading_duty = False
+                self.__command_valid = False
+                self.__command_name = ""
+                self.__command_duty = 0
+            elif not self.__in_command:
+                if char == CAPABILITY_QUERY.decode():
+                    self.__send_banner()
+            elif char == ">":
+                self.__in_command = False
+                if self.__reading_duty and self.__command_valid:
+                    self.__apply_duty(self.__command_name,min(self.__command_duty,255))
+                return
+            elif char == ",":
+                self.__reading_duty = True
+                self.__command_valid = self.__check_name(self.__command_name)
+            elif self.__reading_duty:
+                if char.isdigit():
+                    # digits stop accumulating once the value reaches 1000
+                    if self.__command_duty < 1000:
+                        self.__command_duty = self.__command_duty*10 + int(char)
+                else:
+                    self.__in_command = False
+            else:
+                self.__command_name = char
+
+    def __read_single_command(self):
+        # single_command_reader.cpp: a command that is only partly in the buffer is lost, and the duty is not clamped
+        if len(self.__rx) > 0 and self.__rx[0] == CAPABILITY_QUERY[0]:
+            self.__read()
+            self.__send_banner()
+            return
+        name = ""
+        duty = ""
+        read_duty = False
+        char = ""
+        while self.__available() > 0 and char != ">":
+            if char == ",":
+                read_duty = True
+                if not self.__check_name(name):
+                    return
+            elif read_duty:
+                if not char.isdigit():
+                    return
+                duty += char
+            elif char != "":
+                name = char
+            char = chr(self.__read())
+        if char == ">" and self.__check_name(name):
+            self.__apply_duty(name,int(duty) if len(duty) > 0 else 0)
+
+    def __read_binary_command(self):
+        # binary_command_reader.cpp: frames are assembled across calls and checked against their CRC
+        max_payload = 8
+        while self.__available() > 0:
+            byte = self.__read()
+            if not self.__in_command:
+                if byte == SYNC_BYTE:
+                    self.__in_command = True
+                    self.__frame = bytearray()
+                elif byte == CAPABILITY_QUERY[0]:
+                    self.__send_banner()
+                continue
+            self.__frame.append(byte)
+            frame = self.__frame
+            if len(frame) == 3 and frame[2] > max_payload:
+                self.__in_command = False
+            elif len(frame) >= 3 and len(frame) == 3 + frame[2] + 2:
+                self.__in_command = False
+                valid = crc16(bytes(frame[:-2])) == int.from_bytes(frame[-2:],"big")
+                if valid and frame[0] == FrameType.DUTY and frame[2] == 2 and self.__check_name(chr(frame[3])):
+                    self.__apply_duty(chr(frame[3]),frame[4])
+                return
+
+    def __perform_commands(self):
+        for pump in self.pumps:
+            if pump.modified:
+                pump.modified = False
+                self.applied_commands += 1
+                if self.acknowledge_commands:
+                    self.__write(self.protocol.encode_ack(pump.name,pump.duty))
+
+    def __write_speeds(self):
+        current = self.millis()
+        elapsed = current - self.__recent_millis
+        if elapsed < self.serial_write_period:
+            return
+        self.__recent_millis = current
+        if self.tacho_mode == TachoModes.PERIOD:
+            rpms = [pump.period_rpm(current/1000) if pump.has_tacho else 0 for pump in self.pumps]
+        else:
+            rpms = [(pump.rotation_count*60000)//elapsed for pump in self.pumps]
+            for pump in self.pumps:
+                pump.rotation_count = 0
+        match (self.binary_protocol, self.spd_format):
+            case (True, _):
+                self.__write(self.protocol.encode_speeds(rpms))
+            case (False, SpeedFormats.NAME_VALUE):
+                self.__write(("".join(f"<{pump.name},{rpm}>" for pump, rpm in zip(self.pumps,rpms))+"\n").encode())
+            case _:
+                self.__write(self.protocol.encode_speeds(rpms))
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Emulate a microcontroller running the generated code on a pseudo terminal")
+    parser.add_argument("--pumps",type=int,default=6)
+    parser.add_argument("--clock-speed",type=float,default=1.0)
+    parser.add_argument("--report-period",type=float,default=DEFAULT_REPORT_PERIOD)
+    parser.add_argument("--baudrate",type=int,default=DEFAULT_BAUDRATE)
+    parser.add_argument("--binary",action="store_true")
+    parser.add_argument("--no-ack",action="store_true")
+    parser.add_argument("--single-commands",action="store_true")
+    parser.add_argument("--int-bits",type=int,default=16)
+    parser.add_argument("--period-tacho",action="store_true")
+    args = parser.parse_args()
+    emulator = FirmwareEmulator([PinDefs(2*i+2,2*i+3) for i in range(args.pumps)],batch_commands=not args.single_commands,acknowledge_commands=not args.no_ack,binary_protocol=args.binary,baudrate=args.baudrate,report_period=args.report_period,clock_speed=args.clock_speed,int_bits=args.int_bits,tacho_mode=TachoModes.PERIOD if args.period_tacho else TachoModes.PULSE_COUNT)
+    print(emulator.port,flush=True)
+    try:
+        emulator.run()
+    except KeyboardInterrupt:
+        pass
@@ -5,4 +5,8 @@ void sendSpeed(int i, long rpm){
     Serial.print(',');
     Serial.print(rpm);
     Serial.print(endChar);
+  }
+
+void endSpeeds(){
+    Serial.print('\n');
   }
\ No newline at end of file
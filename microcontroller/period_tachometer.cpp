@@ -0,0 +1,64 @@
+// Period tachometer: every edge records the micros() since the previous edge, and the speed is worked out from the mean of the last tachoAverage periods.
+// The interrupts are never detached, so no edge is missed while the speeds are sent, and each report reflects the most recent edges rather than a whole report period
+#define tachoTimeout 1000000UL // a pump with no edge for this many microseconds is stationary (below 60 rpm)
+
+volatile unsigned long lastEdge[numPumps];
+volatile unsigned long edgePeriods[numPumps][tachoAverage];
+volatile uint8_t periodIndex[numPumps];
+volatile uint8_t periodCount[numPumps]; // number of periods in edgePeriods, up to tachoAverage
+volatile bool edgeSeen[numPumps];
+
+void recordEdge(int i){
+  unsigned long now = micros();
+  if (edgeSeen[i]){
+    // unsigned subtraction gives the right period even when micros() wraps around
+    edgePeriods[i][periodIndex[i]] = now - lastEdge[i];
+    periodIndex[i] = (periodIndex[i] + 1) % tachoAverage;
+    if (periodCount[i] < tachoAverage){
+      periodCount[i]++;
+    }
+  }
+  lastEdge[i] = now;
+  edgeSeen[i] = true;
+}
+
+unsigned long periodRpm(int i){
+  // copy the state of the ISR with interrupts off, so that an edge cannot change it half way through
+  // the time is read here too: read any earlier, an edge recorded in between would be in the future and the pump would look stopped
+  noInterrupts();
+  unsigned long now = micros();
+  uint8_t count = periodCount[i];
+  unsigned long sinceEdge = now - lastEdge[i];
+  unsigned long total = 0;
+  for (uint8_t k=0;k<count;k++){
+    total += edgePeriods[i][k];
+  }
+  if (sinceEdge > tachoTimeout){
+    // the pump has stopped: start again from its next edge
+    periodCount[i] = 0;
+    edgeSeen[i] = false;
+    count = 0;
+  }
+  interrupts();
+  if (count == 0){
+    return 0;
+  }
+  unsigned long period = total/count;
+  if (sinceEdge > period){
+    // the pump is slowing down: the current period is at least as long as the time since the last edge
+    period = sinceEdge;
+  }
+  return 60000000UL/period;
+}
+
+void writeSpeeds(){
+  unsigned long currentTime = millis();
+  // unsigned subtraction handles millis() overflowing
+  if (currentTime - recentMillis >= serialWritePeriod){
+    recentMillis = currentTime;
+    for (int j=0;j<numPumps;j++){
+      sendSpeed(j,pumps[j].hasTacho() ? periodRpm(j) : 0);
+    }
+    endSpeeds();
+  }
+}
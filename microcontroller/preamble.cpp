@@ -1,7 +1,10 @@
 #include <math.h>
 #define startChar '<'
 #define endChar '>'
-#define serialWritePeriod 1000
+// a command for this name applies to every pump, e.g. <*,0> stops them all at once
+#define broadcastName '*'
+// sent on its own, outside any command, to ask for capabilityBanner
+#define queryChar '?'
 #define loopdelay 10
 
 typedef void (*ISRPointer)();
@@ -49,4 +52,8 @@ class PumpConnection{
     }
 };
 
-unsigned long recentMillis = 0;
\ No newline at end of file
+unsigned long recentMillis = 0;
+
+// records a tachometer edge of pump i, and sends the speeds once per report period. Defined by the tachometer code that codegen places after this code
+void recordEdge(int i);
+void writeSpeeds();
\ No newline at end of file
@@ -3,9 +3,9 @@ from serial.tools.list_ports import comports
 from pathlib import Path
 import os.path
 from dataclasses import dataclass, asdict
-from support_classes import open_local, get_path
+from support_classes import open_local, get_path, PumpConfig
 import json
-from .codegen import PinDefs, maybe_generate_code, generate_code
+from .codegen import PinDefs, TachoModes, maybe_generate_code, generate_code, DEFAULT_BAUDRATE, DEFAULT_REPORT_PERIOD
 
 class InvalidProfileException(BaseException):
     pass
@@ -14,12 +14,30 @@ _SUPPORTED_EXTENSIONS = ["cpp",".ino"]
 
 _PROFILES_PATH = "microcontroller_profiles.json"
 
+_MINIMUM_REPORT_PERIOD = 0.01
+"""Shortest report period in seconds. The microcontroller code waits this long between loops, so it cannot report any faster"""
+
 @dataclass
 class MicrocontrollerProfile:
     profile_name: str
     serial_port: str
     num_pumps: int
     debug_only: bool
+    batch_writes: bool = False
+    """If True, the microcontroller code accepts several back-to-back commands in one write, so pending commands are sent together"""
+    acknowledge_writes: bool = False
+    """If True, the microcontroller code confirms each duty it applies, so the next command is sent as soon as the confirmation arrives instead of after a fixed pause"""
+    binary_protocol: bool = False
+    """If True, the microcontroller code exchanges speeds, commands and acknowledgements as binary frames with a CRC instead of text"""
+    baudrate: int = DEFAULT_BAUDRATE
+    report_period: float = DEFAULT_REPORT_PERIOD
+    """Seconds between speed reports sent by the microcontroller"""
+    async_transport: bool = False
+    """If True, the serial port is serviced by the pump controller's event loop (AsyncSerialInterface) instead of a dedicated thread"""
+    broadcast_stop: bool = False
+    """If True, the microcontroller code understands commands for every pump at once (<*,0>), so all pumps are stopped with a single command instead of one per pump"""
+    period_tachometer: bool = False
+    """If True, the generated code measures speeds from the time between tachometer edges instead of counting edges over each report period, so short report periods keep their resolution"""
 
 
     @staticmethod
@@ -31,6 +49,10 @@ class MicrocontrollerProfile:
                 microcontroller_dict.pop("num_pumps")
                 microcontroller_dict["pin_assignments"] = [PinDefs(**pd) for pd in microcontroller_dict["pin_assignments"]]
                 out[i] = AutoGeneratedProfile(**microcontroller_dict)
+            elif "ports" in microcontroller_dict.keys():
+                microcontroller_dict.pop("num_pumps")
+                microcontroller_dict.pop("serial_port")
+                out[i] = MultiPortProfile(**microcontroller_dict)
             else:
                 out[i] = MicrocontrollerProfile(**microcontroller_dict)
         return out
@@ -41,6 +63,12 @@ class MicrocontrollerProfile:
     @classmethod
     def from_dict(cls,dict_in: dict[str,Any]):
         return MicrocontrollerProfile(**dict_in)
+
+    def codegen_options(self) -> dict[str,Any]:
+        """Options of generate_code (see codegen.py) for microcontroller code that matches this profile"""
+        # generated code always accepts batched and broadcast commands and acknowledges them, whether or not this profile makes use of it
+        # the protocol, baud rate, report period and tachometer mode have to match, however, as the computer relies on them
+        return dict(batch_commands=True, acknowledge_commands=True, binary_protocol=self.binary_protocol, baudrate=self.baudrate, report_period=self.report_period, tacho_mode=TachoModes.PERIOD if self.period_tachometer else TachoModes.PULSE_COUNT)
     
     @staticmethod
     def to_json(profiles: list["MicrocontrollerProfile"]) -> list[dict[str,Any]]:
@@ -49,18 +77,31 @@ class MicrocontrollerProfile:
     def validate(self):
         if self.num_pumps<1:
             raise InvalidProfileException("Number of pumps must be positive integer")
+        if self.baudrate<1:
+            raise InvalidProfileException("Baud rate must be a positive integer")
+        if self.report_period<_MINIMUM_REPORT_PERIOD:
+            raise InvalidProfileException(f"Report period must be at least {_MINIMUM_REPORT_PERIOD} s")
+        # each byte takes 10 bits (start, 8 data, stop). If a report takes longer to send than the report period, the microcontroller's transmit buffer fills up and it stalls
+        for num_pumps in self._reported_pump_counts():
+            report_time = _max_report_bytes(num_pumps,self.binary_protocol)*10/self.baudrate
+            if report_time>self.report_period:
+                raise InvalidProfileException(f"A speed report for {num_pumps} pumps takes up to {report_time:.3f} s to send at {self.baudrate} baud, which is longer than the report period")
         # all_serial_ports = comports()
         # if self.serial_port not in [port.device for port in all_serial_ports]:
         #     raise InvalidProfileException(f"Serial port not found: {self.serial_port}")
 
+    def _reported_pump_counts(self) -> list[int]:
+        """Number of pumps in the speed reports of each microcontroller"""
+        return [self.num_pumps]
+
 @dataclass(init=False)
 class AutoGeneratedProfile(MicrocontrollerProfile):
     pin_assignments: list[PinDefs]
     code_location: Path|None = None
     device_name: str | None = None
 
-    def __init__(self, profile_name: str, serial_port: str, debug_only: bool, pin_assignments: list[PinDefs], code_location: Path|str|None = None, device_name: str|None = None):
-        super().__init__(profile_name,serial_port,len(pin_assignments),debug_only)
+    def __init__(self, profile_name: str, serial_port: str, debug_only: bool, pin_assignments: list[PinDefs], code_location: Path|str|None = None, device_name: str|None = None, batch_writes: bool = False, acknowledge_writes: bool = False, binary_protocol: bool = False, baudrate: int = DEFAULT_BAUDRATE, report_period: float = DEFAULT_REPORT_PERIOD, async_transport: bool = False, broadcast_stop: bool = False, period_tachometer: bool = False):
+        super().__init__(profile_name,serial_port,len(pin_assignments),debug_only,batch_writes=batch_writes,acknowledge_writes=acknowledge_writes,binary_protocol=binary_protocol,baudrate=baudrate,report_period=report_period,async_transport=async_transport,broadcast_stop=broadcast_stop,period_tachometer=period_tachometer)
         self.device_name = device_name
         if isinstance(code_location,str):
             code_location = Path(code_location)
@@ -91,16 +132,63 @@ class AutoGeneratedProfile(MicrocontrollerProfile):
         return AutoGeneratedProfile(**dict_in)
     
     def generate(self, compare_to: Union["AutoGeneratedProfile",list[PinDefs],None] = None):
+        """Generate code for this profile, unless the code for compare_to (a profile, or pin assignments generated with the default options) would be identical"""
+        compare_options = None
         if isinstance(compare_to,AutoGeneratedProfile):
+            compare_options = compare_to.codegen_options()
             compare_to = compare_to.pin_assignments
         filename = self.profile_name + "_(codegen).cpp"
-        return maybe_generate_code(filename,self.pin_assignments, compare_to=compare_to)
+        return maybe_generate_code(filename,self.pin_assignments, compare_to=compare_to, compare_options=compare_options, **self.codegen_options())
     
     # def upload(self):
     #     arduino = pdc.Arduino()
     #     arduino.upload
 
 
+@dataclass(init=False)
+class MultiPortProfile(MicrocontrollerProfile):
+    """Several microcontrollers, each on its own serial port, driven together as one controller (see MultiSerialInterface).
+    Pumps are numbered across the ports in order, so num_pumps is the total. Every port shares the other settings of the profile"""
+    ports: list[str]
+    pump_counts: list[int]
+    """Number of pumps on each port, in the same order as ports"""
+
+    def __init__(self, profile_name: str, ports: list[str], pump_counts: list[int], debug_only: bool = False, batch_writes: bool = False, acknowledge_writes: bool = False, binary_protocol: bool = False, baudrate: int = DEFAULT_BAUDRATE, report_period: float = DEFAULT_REPORT_PERIOD, async_transport: bool = False, broadcast_stop: bool = False, period_tachometer: bool = False):
+        super().__init__(profile_name,",".join(ports),sum(pump_counts),debug_only,batch_writes=batch_writes,acknowledge_writes=acknowledge_writes,binary_protocol=binary_protocol,baudrate=baudrate,report_period=report_period,async_transport=async_transport,broadcast_stop=broadcast_stop,period_tachometer=period_tachometer)
+        self.ports = list(ports)
+        self.pump_counts = list(pump_counts)
+
+    @classmethod
+    def from_dict(cls, dict_in: dict[str,Any]):
+        dict_in.pop("num_pumps",None)
+        dict_in.pop("serial_port",None)
+        return MultiPortProfile(**dict_in)
+
+    def validate(self):
+        if len(self.ports)<1 or len(self.ports) != len(self.pump_counts):
+            raise InvalidProfileException("Every port needs a number of pumps")
+        if len(set(self.ports)) != len(self.ports):
+            raise InvalidProfileException("A port can only be used once")
+        if min(self.pump_counts)<1:
+            raise InvalidProfileException("Number of pumps must be positive integer")
+        if self.num_pumps>PumpConfig.max_pumps:
+            raise InvalidProfileException(f"There can be at most {PumpConfig.max_pumps} pumps across every port")
+        if self.async_transport:
+            raise InvalidProfileException("Several ports cannot use the event loop transport")
+        return super().validate()
+
+    def _reported_pump_counts(self) -> list[int]:
+        # each microcontroller only reports its own pumps
+        return list(self.pump_counts)
+
+
+def _max_report_bytes(num_pumps: int, binary_protocol: bool) -> int:
+    if binary_protocol:
+        # frame header and CRC, plus a uint16 per pump
+        return 6 + 2*num_pumps
+    # worst case text report: <a,65535> for every pump, and a line terminator
+    return 9*num_pumps + 1
+
 def save_profile(profile: MicrocontrollerProfile):
     all_profiles = read_profiles(debug=True)
     new_profile = True
@@ -0,0 +1,49 @@
+// Pulse count tachometer: edges are counted over each report period, and the count is converted to rpm when the speeds are sent.
+// The counts are paused while they are read and reset, so edges in that gap are missed, and the resolution is one edge per report period (60 rpm at a 1 s period)
+void recordEdge(int i){
+  pumps[i].isr();
+}
+
+void writeSpeeds(){
+  // read the current time and calculate
+  uint32_t currentTime = millis();
+  unsigned long elapsedTime;
+  if (currentTime>=recentMillis){
+    elapsedTime = currentTime - recentMillis;
+  }else{
+    // millis() has overflowed!!
+    recentMillis = currentTime;
+    elapsedTime = 0;
+    // reset all counts
+    for (int i=0;i<numPumps;i++){
+      pumps[i].detach_isr();
+      pumps[i].resetCount();
+    }
+    for (int j=0;j<numPumps;j++){
+      pumps[j].attach_isr();
+    }
+  }  
+
+  // check if enough time has passed since last speed calc
+  if (elapsedTime >= serialWritePeriod){
+    
+    // set the most recent reading time to the current time
+    recentMillis = currentTime;
+
+    for (int i=0;i<numPumps;i++){
+      // pause isr rotation counts while sending
+      pumps[i].detach_isr();
+    }
+    // output the speeds for each pump to serial
+    for (int j=0;j<numPumps;j++){
+      // calculate speed in rpm. The count is widened first, as count * 60000 overflows a 16 bit int
+      unsigned long rpm = (((unsigned long) pumps[j].rotationCount()) * 60000UL)/elapsedTime;
+      sendSpeed(j,rpm);
+    }
+    endSpeeds();
+    for (int k=0;k<numPumps;k++){
+      pumps[k].resetCount();
+      pumps[k].attach_isr();
+    }
+  }
+}
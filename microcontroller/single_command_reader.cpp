@@ -0,0 +1,44 @@
+void readOneCommand(){
+  // read from the serial until ">" and set the duty of the corresponding pump
+  if (Serial.peek() == queryChar){
+    // a request for the banner, rather than a command
+    Serial.read();
+    sendBanner();
+    return;
+  }
+
+  char nextChar = '\0';
+  int nextInt = (int) nextChar;
+  char name = '\0';
+  bool readDuty = false;
+  String command = "";
+  while (Serial.available() > 0 && nextChar != endChar){
+    if (nextChar == ','){
+      // "," separates name and duty, so next section of the serial command is the duty
+      readDuty = true;
+      // check if name is in the list of names!
+      if (!checkName(name)){
+        return;
+      }
+    }else if (readDuty){
+      // ensure the next characters are digits
+      if (isDigit(nextInt)){
+        command += nextChar;
+      }else{
+        return;
+      }
+    }else if (nextChar != '\0'){
+      // for now, the name is only a single char, so if not reading duty or ',', then the char is the name
+      name = nextChar;
+    }
+    // read the serial buffer, both as an int and cast to char
+    nextInt = Serial.read();
+    nextChar = (char) nextInt;
+  }
+  // loop exited: either command is complete or the serial buffer is empty
+  if (nextChar == endChar){
+    // command complete, save the duty to the pump (or pumps) and mark it as modified
+    applyDuty(name,command.toInt());
+  }
+  return;
+}
@@ -0,0 +1,3 @@
+void acknowledgeCommand(PumpConnection& pmp){
+  // legacy behaviour: applied duties are not reported back to the computer
+}
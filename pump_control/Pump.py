@@ -1,12 +1,14 @@
 import queue
 from typing import Any, Coroutine, Iterable
-from serial_interface import GenericInterface, InterfaceException, WriteCommand
-from support_classes import AsyncRunner, Teardown, SharedState, GeneratorException, Settings, read_settings, PID_SETTINGS, PumpNames, PumpConfig, CAMERA_SETTINGS, LEVEL_SETTINGS,LOGGING_SETTINGS, PID_PUMPS
+from serial_interface import GenericInterface, InterfaceException, WriteCommand, WritePriority, InterlockRule, InterlockTrip, OverspeedRule, StallRule, TelemetryTimeoutRule
+from support_classes import AsyncRunner, Teardown, SharedState, GeneratorException, Settings, read_settings, PID_SETTINGS, PumpNames, PumpConfig, CAMERA_SETTINGS, LEVEL_SETTINGS,LOGGING_SETTINGS, PID_PUMPS, SPEED_SETTINGS, INTERLOCK_SETTINGS, ScheduleStatistics
 from concurrent.futures import Future
 from support_classes.camera_interface import Capture
 from .async_levelsensor import LevelSensor, LevelOutput, Rect
 from .async_pidcontrol import PIDRunner, Duties
+from .actuator import Actuation
 from .async_serialreader import SerialReader, SpeedReading
+from .speed_statistics import SpeedStatistics
 from .async_logger import DataLogger
 from abc import ABC
 import copy
@@ -66,6 +68,8 @@ class Pump(AsyncRunner,Teardown):
 
         self.queue: queue.Queue[PumpState] = queue.Queue()
         self.serial_writes = self.__serial_interface.written_duties
+        self.interlock_trips = self.__serial_interface.interlock_trips
+        self.link_degraded = self.__serial_interface.degraded # True while the serial connection is being re-established. Every process keeps running meanwhile
         
 
 
@@ -117,6 +121,16 @@ class Pump(AsyncRunner,Teardown):
         finally:
             self.stop_pid()
 
+    @_inform_attrerror
+    def speed_statistics(self) -> SharedState[SpeedStatistics]:
+        """Rolling speed statistics of every pump, including stalled pumps and pumps whose speed does not match their duty. Published while polling"""
+        return self.__poller.statistics
+
+    @_inform_attrerror
+    def schedule_statistics(self) -> dict[str,SharedState[ScheduleStatistics]]:
+        """Jitter and missed deadlines of the periodic processes (speed polling, level sensing and logging), published every time each one runs"""
+        return {"polling": self.__poller.schedule_statistics, "levels": self.__level.schedule_statistics, "logging": self.__logger.schedule_statistics}
+
     @_ignore_attrerror
     def stop_polling(self):
         self.__poller.stop()
@@ -126,6 +140,11 @@ class Pump(AsyncRunner,Teardown):
         self.run_async(self.__pid.generate(), callback = self.__pid_check_error)
         return (self.__pid.is_running, self.__pid.state)
     
+    @_inform_attrerror
+    def pid_actuation(self) -> SharedState[Actuation]:
+        """The duties changed by the PID controller's most recent cycle, and how long the interface took to apply them. Published while the controller runs"""
+        return self.__pid.actuation
+
     def __pid_check_error(self,future:Future):
         try:
             future.result()
@@ -214,6 +233,18 @@ class Pump(AsyncRunner,Teardown):
         level_args = (level_mods,new_capture) if new_capture else (level_mods,)
         self.run_sync(self.__level.set_parameters,args = level_args)
 
+        # ----------------- Speed settings ------------------
+        if _contains_any(SPEED_SETTINGS,modifications):
+            speed_mods = {key:modifications[key] for key in modified_keys if key in SPEED_SETTINGS}
+            self.run_sync(self.__poller.set_parameters,args=(speed_mods,))
+
+        # ----------------- Interlock settings ------------------
+        # the rules are checked by the serial interface itself, which accepts them from any thread
+        if _contains_any(INTERLOCK_SETTINGS,modifications):
+            interlock_settings = read_settings(*INTERLOCK_SETTINGS)
+            interlock_settings.update({key:modifications[key] for key in modified_keys if key in INTERLOCK_SETTINGS})
+            self.__serial_interface.set_interlock_rules(_interlock_rules(interlock_settings))
+
         # ----------------- Logging settings ------------------
         LOGGING_MODS = set([*LOGGING_SETTINGS,*PID_PUMPS])
         if _contains_any(LOGGING_MODS,modifications):
@@ -243,9 +274,18 @@ class Pump(AsyncRunner,Teardown):
         self.stop_polling()
         self.stop_event_loop()
 
+    @_ignore_attrerror
+    def interlock_tripped(self,trip: InterlockTrip):
+        """The serial interface has already stopped the pumps. Stop the PID controller too if it drives any of them, so that it does not restart them"""
+        pid_pumps = [pmp for pmp in self.__pid.get_pumps().values() if pmp is not None]
+        if any(pmp.value in trip.pumps for pmp in pid_pumps):
+            self.stop_pid()
+
     @_ignore_attrerror
     def emergency_stop(self,pumps: list[PumpNames]):
-        """Stop all pumps. Since there is a mandatory delay between writes to the serial port, it is important to stop the pumps in the optimal order to minimise damage to the flow system. Pumps with high speeds are prioritised first. Within the high speed pumps, any pumps responsible for refilling the electrolyte reservoirs are handled first, followed by any electrolyte pumps. The low speed pumps are then handled in the same hierarchy"""
+        """Stop the given pumps, ahead of any queued commands and without waiting for the pause between writes.
+        If every pump is to be stopped, the interface stops them all at once (with a single broadcast command, where the microcontroller supports it).
+        Otherwise the stops are sent together, in the order that minimises damage to the flow system should the microcontroller apply them one by one. Pumps with high speeds are prioritised first. Within the high speed pumps, any pumps responsible for refilling the electrolyte reservoirs are handled first, followed by any electrolyte pumps. The low speed pumps are then handled in the same hierarchy"""
         
         try:
             pid_pumps = [pmp for pmp in self.__pid.get_pumps().values() if pmp in pumps]
@@ -253,10 +293,18 @@ class Pump(AsyncRunner,Teardown):
                 self.__pid.stop()
         except AttributeError:
             pass
+
+        if set(PumpConfig().pumps) <= set(pumps):
+            try:
+                self.__serial_interface.stop_all()
+            except InterfaceException:
+                pass
+            return
         
         LOW_PRIORITY_SPEED = 900
-        # find the pumps that are low priority
-        all_speeds = self.__poller.state.force_value()
+        # find the pumps that are low priority. The rolling mean is used where available, so one noisy reading cannot demote a fast pump
+        statistics = self.__poller.statistics.force_value()
+        all_speeds = statistics.mean if statistics is not None else self.__poller.state.force_value()
         if all_speeds is not None:
             current_speeds = {key:all_speeds[key] for key in all_speeds if key in pumps}
             low_priority = []
@@ -271,11 +319,10 @@ class Pump(AsyncRunner,Teardown):
             high_priority = []
         
         # now stop these pumps with order determined by pid system importance
-        self.__stop_with_hierarchy(high_priority)
-        self.__stop_with_hierarchy(low_priority)
+        self.__close_without_error(self.__stop_with_hierarchy(high_priority)+self.__stop_with_hierarchy(low_priority))
         # self.state.set_value(ActiveState({pmpname:0 for pmpname in pumps}))
 
-    def __stop_with_hierarchy(self,pumps: list[PumpNames]):
+    def __stop_with_hierarchy(self,pumps: list[PumpNames]) -> list[PumpNames]:
         HIERARCHY = [Settings.ANOLYTE_REFILL_PUMP,Settings.CATHOLYTE_REFILL_PUMP,Settings.ANOLYTE_PUMP,Settings.CATHOLYTE_PUMP]
         important_pumps = self.__pid.get_pumps()
         high_priority: list[PumpNames] = []
@@ -286,13 +333,8 @@ class Pump(AsyncRunner,Teardown):
                 high_priority.append(current_pump)
                 low_priority.remove(current_pump)
         
-        # first loop through the high priority pumps (in their order of hierarchy):
-        for hpp in high_priority:
-            self.__close_without_error(hpp)
-        
-        # then do the low(er) priority pumps in any order
-        for lpp in low_priority:
-            self.__close_without_error(lpp)
+        # first the high priority pumps (in their order of hierarchy), then the low(er) priority pumps in any order
+        return high_priority + low_priority
 
     def _async_teardowns(self) -> Iterable[Coroutine[None, None, None]]:
         setout: set[Coroutine[None,None,None]] = set()
@@ -306,12 +348,23 @@ class Pump(AsyncRunner,Teardown):
         self.emergency_stop(list(PumpConfig().pumps))
         self.__serial_interface.close()
 
-    def __close_without_error(self,pmp: PumpNames):
+    def __close_without_error(self,pumps: list[PumpNames]):
         try:
-            self.__serial_interface.write(WriteCommand(pmp.value,0))
+            # stops jump ahead of any duty changes that are still waiting to be sent, and go out together in the order given
+            self.__serial_interface.write_batch([WriteCommand(pmp.value,0) for pmp in pumps],WritePriority.EMERGENCY)
         except InterfaceException:
             pass
 
+def _interlock_rules(settings: dict[Settings,Any]) -> list[InterlockRule]:
+    rules: list[InterlockRule] = []
+    if settings[Settings.INTERLOCK_MAX_SPEED] is not None:
+        rules.append(OverspeedRule(float(settings[Settings.INTERLOCK_MAX_SPEED])))
+    if settings[Settings.INTERLOCK_STALL_TIME] is not None:
+        rules.append(StallRule(float(settings[Settings.INTERLOCK_STALL_TIME])))
+    if settings[Settings.INTERLOCK_TELEMETRY_TIMEOUT] is not None:
+        rules.append(TelemetryTimeoutRule(float(settings[Settings.INTERLOCK_TELEMETRY_TIMEOUT])))
+    return rules
+
 def is_duty(duty: int):
     if isinstance(duty,int) and duty >= 0 and duty <= 255:
         return True
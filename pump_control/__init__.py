@@ -1 +1,3 @@
-from .Pump import Pump, PumpState, ErrorState, ReadyState, PIDException, LevelException, ReadException, LoadingState
\ No newline at end of file
+from .Pump import Pump, PumpState, ErrorState, ReadyState, PIDException, LevelException, ReadException, LoadingState
+from .speed_statistics import SpeedStatistics
+from .actuator import Actuation
@@ -0,0 +1,59 @@
+from dataclasses import dataclass
+from typing import Callable
+from serial_interface import GenericInterface, WriteCommand, WritePriority
+from support_classes import SharedState, PumpNames
+import asyncio
+import time
+
+Duties = dict[PumpNames,int]
+
+ACTUATION_TIMEOUT = 10.0
+"""Seconds to wait for a cycle's duties to be confirmed by the interface before the controller carries on regardless"""
+_CONFIRMATION_POLL_PERIOD = 0.02
+
+@dataclass(frozen=True)
+class Actuation:
+    """The duties one control cycle changed, and how long the interface took to apply them"""
+    duties: Duties
+    """Only the pumps whose duty changed in this cycle"""
+    issued: float
+    """time.monotonic() when the duties were handed to the interface"""
+    latency: float|None
+    """Seconds from issuing the duties until every one of them was confirmed. None if they were not all confirmed within the timeout (e.g. a manual write or emergency stop overtook them)"""
+
+class Actuator:
+    """Output stage of the PID controller. Each cycle's duties are written as one batch, so the interface paces, coalesces and sends them together, and the cycle then waits only until the interface confirms them.
+    Duties that have not changed since they were last issued are not written again"""
+
+    def __init__(self, serial_interface: GenericInterface, timeout: float = ACTUATION_TIMEOUT) -> None:
+        self.__serial_interface = serial_interface
+        self.__timeout = timeout
+        self.__issued: Duties = {}
+        self.state = SharedState[Actuation]()
+        """The most recent cycle that changed any duty"""
+
+    def reset(self, duties: Duties):
+        """Assume the pumps are running at the given duties, e.g. when the controller starts"""
+        self.__issued = dict(duties)
+
+    async def actuate(self, duties: Duties, keep_waiting: Callable[[],bool] = lambda: True) -> Actuation|None:
+        """Issue the duties that changed and wait for the interface to confirm them, until the timeout or until keep_waiting returns False.
+        Returns None if no duty changed, or if keep_waiting already returns False: once the controller is stopped (e.g. by an emergency stop), a cycle that was still in flight must not restart the pumps"""
+        changed = {pmp:duty for pmp,duty in duties.items() if self.__issued.get(pmp) != duty}
+        if len(changed) == 0 or not keep_waiting():
+            return None
+        issued = time.monotonic()
+        self.__serial_interface.write_batch([WriteCommand(pmp.value,duty) for pmp,duty in changed.items()],WritePriority.NORMAL)
+        self.__issued.update(changed)
+
+        latency: float|None = None
+        while keep_waiting() and time.monotonic()-issued < self.__timeout:
+            applied = self.__serial_interface.applied_duties()
+            if all(applied.get(pmp.value) == duty for pmp,duty in changed.items()):
+                latency = time.monotonic()-issued
+                break
+            await asyncio.sleep(_CONFIRMATION_POLL_PERIOD)
+
+        actuation = Actuation(changed,issued,latency)
+        self.state.set_value(actuation)
+        return actuation
@@ -44,6 +44,7 @@ class LevelSensor(Generator[LevelOutput]):
         self.__stabilisation_period = stabilisation_period
         self.__average_window_length = average_window_length
         self.__sense_period = sense_period
+        self._set_period(sense_period)
 
         self.__indexAn: tuple[slice|slice]|None = None
         self.__indexCath: tuple[slice|slice]|None = None
@@ -69,6 +70,7 @@ class LevelSensor(Generator[LevelOutput]):
             self._vc = capture_device
         if Settings.SENSING_PERIOD in new_parameters.keys():
             self.__sense_period = new_parameters[Settings.SENSING_PERIOD]
+            self._set_period(self.__sense_period)
         if Settings.AVERAGE_WINDOW_WIDTH in new_parameters.keys():
             self.__average_window_length = new_parameters[Settings.AVERAGE_WINDOW_WIDTH]
             old_buffer = self.__readings_buffer
@@ -100,16 +102,12 @@ class LevelSensor(Generator[LevelOutput]):
         self.__vol_init = None
         self.__readings_buffer = TimeAvg(self.__average_window_length,data_size=4)
         self._filter.setup()
-        # set an initial sleep time. this is recalculated at each iteration of the loop
-        self.__sleep_time = 0.5
 
     async def _loop(self) -> tuple[LevelReading|None,np.ndarray]|None:
 
-        # wait until next reading is due
-        await self._wait_while_checking(self.__sleep_time,check_interval=0.5)
-
-        # begin performance benchmarking
-        start_time = time.perf_counter()
+        # wait until next reading is due. Readings are a fixed period apart however long the computer vision takes
+        if not await self._wait_for_deadline():
+            return None
 
         #-----------CAPTURE-------------
         # take the frame and record its time
@@ -153,11 +151,8 @@ class LevelSensor(Generator[LevelOutput]):
 
         #--------------UPDATE---------------
         # update the logging state
-        # reading is now finished, increment reading counter and record performance time
-        end_time = time.perf_counter()
-        perftime = (end_time-start_time)/1000 # time in seconds for computer vision
+        # reading is now finished, increment reading counter
         self.__i += 1
-        self.__sleep_time = max(self.__sense_period - perftime,0)
 
         # save reading
         data = [avg_an, avg_cath, avg_diff,avg_change]
@@ -79,6 +79,7 @@ class DataLogger(Generator[None]):
             _DataType.LEVELS: log_lvls
         }
         self.period = data_logging_period
+        self._set_period(data_logging_period)
         self.img_period = image_logging_period
         self.__base_filename: str = ""
         self.img_timer = 0.0
@@ -99,6 +100,7 @@ class DataLogger(Generator[None]):
             except NotImplementedError:
                 if key == Settings.LOGGING_PERIOD:
                     self.period = settings[key]
+                    self._set_period(self.period)
                 elif key == Settings.IMAGE_SAVE_PERIOD:
                     self.img_period = settings[key]
         pump_settings = {key:settings[key] for key in settings if key in _DUTY_HEADER_MAP.keys()}
@@ -161,7 +163,9 @@ class DataLogger(Generator[None]):
         return valid_keys[0]
 
     async def _loop(self) -> None:
-        perftimer = time.time()
+        # rows are a fixed period apart however long writing them takes
+        if not await self._wait_for_deadline():
+            return
 
         duties = self.duty_state.force_value()
         ordered_duties_list = None
@@ -192,11 +196,6 @@ class DataLogger(Generator[None]):
         if lvl_data is not None:
             self._save_one(t,_DataType.LEVELS,lvl_data.levels)
             self._maybe_save_image(lvl_data.original_image)
-
-        log_time = time.time() - perftimer
-        wait_time = self.period-log_time
-        # await asyncio.sleep(wait_time)
-        await self._wait_while_checking(wait_time,check_interval=0.5)
     
     def _save_one(self,elapsed_seconds: float, dtype: _DataType ,data:Iterable[Any]|None):
         if data is None:
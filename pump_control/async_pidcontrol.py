@@ -1,16 +1,14 @@
 from typing import Any, Iterable
 from simple_pid import PID
-from serial_interface.SerialInterface import SERIAL_WRITE_PAUSE
 from .async_levelsensor import LevelReading, LevelOutput
-from serial_interface import GenericInterface, WriteCommand
+from .actuator import Actuator, Actuation, Duties
+from serial_interface import GenericInterface
 import asyncio
 from support_classes import Generator,SharedState, DEFAULT_SETTINGS, Settings, PumpNames, PumpConfig
+from .control_logic import PID_STARTING_OUTPUT, pid_tunings, pid_output_limits, split_control, refill_conditions
 import time
+import math
 
-Duties = dict[PumpNames,int]
-
-PID_PAUSE_MARGIN = 1.5
-"""Factor of the *SERIAL_WRITE_PAUSE* that will be awaited to send new duties"""
 PID_DATA_TIMEOUT = 1.0
 """Seconds that the PID controller will wait for new data before checking loop conditions. Essentially only determines how long it will take to kill the PID process once level process is killed. Other than that, if this is set too low then it could hinder performance: polling would require a larger fraction of event loop time."""
 
@@ -46,8 +44,8 @@ class PIDRunner(Generator[Duties]):
             Settings.CATHOLYTE_REFILL_PUMP: catholyte_refill_pump
         }
 
-        # self.__prev_duties = {pmp:0 for pmp in PumpConfig().pumps}
-        self.__prev_duties = {}
+        # duties the controller wants, which the actuator issues once per cycle
+        self.__duties: Duties = {}
         self.__refill_time = refill_time
         self.__refill_duty = refill_duty
         self.__refill_percentage_trigger = refill_percentage
@@ -59,35 +57,30 @@ class PIDRunner(Generator[Duties]):
         self.__derivative_gain = derivative_gain
 
         self.__input_state = level_state
-        self.__serial_interface = serial_interface
+        self.__actuator = Actuator(serial_interface)
         self.__level_event = level_event
         self.__pid: PID | None = None
         self.__refill_start_time: float | None = None
         self.__refill_finish_time: float | None = None
 
     async def _setup(self):
-        self.__prev_duties = {pmp:0 for pmp in PumpConfig().pumps}
-        self.__pid = PID(Kp=-self.__proportional_gain, Ki=-self.__integral_gain, Kd=self.__derivative_gain, setpoint=0, sample_time=None, 
-        output_limits=(-(255-self.__base_duty), 255-self.__base_duty), auto_mode=True, proportional_on_measurement=False, error_map=None)
+        self.__duties = {pmp:0 for pmp in PumpConfig().pumps}
+        self.__actuator.reset(self.__duties)
+        self.__pid = PID(*pid_tunings(self.__proportional_gain,self.__integral_gain,self.__derivative_gain), setpoint=0, sample_time=None, 
+        output_limits=pid_output_limits(self.__base_duty), auto_mode=True, proportional_on_measurement=False, error_map=None)
         #TODO why on earth is this next bit necessary?
         self.__pid.set_auto_mode(False)
         await asyncio.sleep(3)
-        self.__pid.set_auto_mode(True, last_output=-.28)
+        self.__pid.set_auto_mode(True, last_output=PID_STARTING_OUTPUT)
 
     async def _loop(self) -> Duties|None:
 
-        # The outer while loop guards against reading levels faster than the mandatory serial write pause
-        # This would cause the write queue to accumulate commands faster than it can execute
+        # The write queue cannot accumulate commands faster than they are sent, since the previous cycle only ended once its duties were confirmed
         # if the wait function returns false, then it has exited because the generator has been stopped
         # in such a case, the function returns early to speed up the teardown process
-
-        initial_request_time = time.time()
-        current_time = initial_request_time
-        while current_time-initial_request_time < SERIAL_WRITE_PAUSE * PID_PAUSE_MARGIN:
-            levels_available = await self.__wait_for_levels()
-            if not levels_available:
-                return
-            current_time = time.time()
+        levels_available = await self.__wait_for_levels()
+        if not levels_available:
+            return
 
         level_state = self.__input_state.get_value()
         if level_state is not None and level_state.levels is not None:
@@ -97,9 +90,11 @@ class PIDRunner(Generator[Duties]):
             last_readings = level_state.levels
 
             # Assign new duties to refill pumps
-            (flowrate_refill_anolyte,flowRate_refill_catholyte,refill_duties) = await self.__handle_refill(last_readings)
+            (flowrate_refill_anolyte,flowRate_refill_catholyte,refill_duties) = self.__handle_refill(last_readings)
             # Assign new duties to electrolyte pumps
-            (flowrate_anolyte,flowrate_catholyte,pid_duties) = await self.__handle_pid(last_readings)
+            (flowrate_anolyte,flowrate_catholyte,pid_duties) = self.__handle_pid(last_readings)
+            # Issue every changed duty of this cycle together
+            await self.__actuator.actuate(self.__duties,self.can_generate)
 
             duties: Duties = {**pid_duties,**refill_duties}
             return duties
@@ -108,6 +103,11 @@ class PIDRunner(Generator[Duties]):
     def teardown(self):
         pass
 
+    @property
+    def actuation(self) -> SharedState[Actuation]:
+        """The duties changed by the most recent control cycle, and how long they took to be applied"""
+        return self.__actuator.state
+
     def get_pumps(self) -> dict[Settings,PumpNames|None]:
         return self.__pid_pumps
 
@@ -130,63 +130,45 @@ class PIDRunner(Generator[Duties]):
         
         if _contains_any([Settings.BASE_CONTROL_DUTY,Settings.PROPORTIONAL_GAIN,Settings.INTEGRAL_GAIN,Settings.DERIVATIVE_GAIN],new_parameters.keys()):
             self.stop()
-            self.__pid = PID(Kp=-self.__proportional_gain, Ki=-self.__integral_gain, Kd=self.__derivative_gain, setpoint=0, sample_time=None, 
-                        output_limits=(-(255-self.__base_duty), 255-self.__base_duty), auto_mode=True, proportional_on_measurement=False, error_map=None)
+            self.__pid = PID(*pid_tunings(self.__proportional_gain,self.__integral_gain,self.__derivative_gain), setpoint=0, sample_time=None, 
+                        output_limits=pid_output_limits(self.__base_duty), auto_mode=True, proportional_on_measurement=False, error_map=None)
 
         for pmpsetting in self.__pid_pumps.keys():
             if pmpsetting in new_parameters.keys():
                 new_pump: PumpNames|None = new_parameters[pmpsetting]
                 self.__pid_pumps[pmpsetting] = new_pump
 
-    async def __handle_refill(self, new_levels: LevelReading|None) -> tuple[int,int,Duties]:
-
-        # extract the volume change and initial volume from the new readings
-        if new_levels:
-            volume_change = new_levels[3]
-            initial_volume = new_levels[0] + new_levels[1] - volume_change
-        
-            # calculate the percentage change in volume from initial volume
-            percent_change = 0-volume_change/initial_volume * 100 if initial_volume != 0 else 0
-
-            # determine if volume has been depleted enough to justify a refill
-            insufficient_volume = (initial_volume>0) and (percent_change>self.__refill_percentage_trigger)
-
-            # determine if a refill is ongoing, and if the reservoir is full again, and the setting to stop filling once full is active
-            full_stop_refill = self.__refill_start_time is not None and volume_change >= 0 and self.__refill_stop_on_full
-
-        else:
-            # no new levels provided - we can neither start a refill nor end it with the "reservoir is refilled" cutoff logic. We may only determine if the time-based cutoff is reached.
-            insufficient_volume = False
-            full_stop_refill = False
+    def __handle_refill(self, new_levels: LevelReading|None) -> tuple[int,int,Duties]:
 
         current_time = time.time()
 
-        # determine if the refill cooldown is active
-        cooldown_over = (self.__refill_finish_time is None) or (current_time - self.__refill_finish_time > self.__refill_cooldown_period)
-        # determine if refilling is ongoing at the moment
-        refill_not_yet_started = self.__refill_start_time is None
-        # check conditions to stop refilling for the time-based cutoff
-        time_stop_refill = self.__refill_start_time is not None and (current_time - self.__refill_start_time) > self.__refill_time and not self.__refill_stop_on_full
+        # extract the total volume and volume change from the new readings
+        # with no new levels, we can neither start a refill nor end it with the "reservoir is refilled" cutoff logic. We may only determine if the time-based cutoff is reached.
+        (total_volume,volume_change) = (new_levels[0] + new_levels[1], new_levels[3]) if new_levels else (None,None)
+        refilling = self.__refill_start_time is not None
+        time_refilling = current_time - self.__refill_start_time if refilling else 0.0
+        time_since_refill = current_time - self.__refill_finish_time if self.__refill_finish_time is not None else math.inf
+        (start_refill,stop_refill) = refill_conditions(total_volume,volume_change,refilling,time_refilling,time_since_refill,
+                                                       self.__refill_percentage_trigger,self.__refill_cooldown_period,self.__refill_time,self.__refill_stop_on_full)
 
-        if insufficient_volume and refill_not_yet_started and cooldown_over:
+        if start_refill:
             # Start refilling if threshold is reached, the cooldown period is over, and we aren't already refilling 
-            anolyte_write = await self.__write_nullsafe(self.__pid_pumps[Settings.ANOLYTE_REFILL_PUMP],self.__refill_duty)
-            catholyte_write = await self.__write_nullsafe(self.__pid_pumps[Settings.CATHOLYTE_REFILL_PUMP],self.__refill_duty)
+            anolyte_write = self.__set_nullsafe(self.__pid_pumps[Settings.ANOLYTE_REFILL_PUMP],self.__refill_duty)
+            catholyte_write = self.__set_nullsafe(self.__pid_pumps[Settings.CATHOLYTE_REFILL_PUMP],self.__refill_duty)
             self.__refill_finish_time = None
             self.__refill_start_time = current_time if (anolyte_write or catholyte_write) else None
-        # elif self.__refill_start_time is not None and (current_time - self.__refill_start_time) > self.__refill_time and not self.__refill_stop_on_full:
-        elif time_stop_refill or full_stop_refill:
+        elif stop_refill:
             # stop the refill and reset variables
-            anolyte_write = await self.__write_nullsafe(self.__pid_pumps[Settings.ANOLYTE_REFILL_PUMP],0)
-            catholyte_write = await self.__write_nullsafe(self.__pid_pumps[Settings.CATHOLYTE_REFILL_PUMP],0)
+            anolyte_write = self.__set_nullsafe(self.__pid_pumps[Settings.ANOLYTE_REFILL_PUMP],0)
+            catholyte_write = self.__set_nullsafe(self.__pid_pumps[Settings.CATHOLYTE_REFILL_PUMP],0)
             self.__refill_start_time = None
             self.__refill_finish_time = current_time
         
         
         duties: Duties = {}
 
-        anolyte_refillrate = self.__prev_duties[self.__pid_pumps[Settings.ANOLYTE_REFILL_PUMP]] if self.__pid_pumps[Settings.ANOLYTE_REFILL_PUMP] is not None else 0
-        catholyte_refillrate = self.__prev_duties[self.__pid_pumps[Settings.CATHOLYTE_REFILL_PUMP]] if self.__pid_pumps[Settings.CATHOLYTE_REFILL_PUMP] is not None else 0
+        anolyte_refillrate = self.__duties[self.__pid_pumps[Settings.ANOLYTE_REFILL_PUMP]] if self.__pid_pumps[Settings.ANOLYTE_REFILL_PUMP] is not None else 0
+        catholyte_refillrate = self.__duties[self.__pid_pumps[Settings.CATHOLYTE_REFILL_PUMP]] if self.__pid_pumps[Settings.CATHOLYTE_REFILL_PUMP] is not None else 0
         
         # anolyte_refillrate = self.__refill_duty if (self.__refill_start_time is not None and self.__pid_pumps[Settings.ANOLYTE_REFILL_PUMP] is not None) else 0
         if self.__pid_pumps[Settings.ANOLYTE_REFILL_PUMP] is not None:
@@ -198,42 +180,33 @@ class PIDRunner(Generator[Duties]):
 
         return (anolyte_refillrate,catholyte_refillrate,duties)
 
-    async def __handle_pid(self,new_levels: LevelReading) -> tuple[int,int,Duties]:
+    def __handle_pid(self,new_levels: LevelReading) -> tuple[int,int,Duties]:
 
         # extract the difference in level from the level readings
         error = new_levels[2]
 
         control = round(self.__pid(error))
-
-        if (control > 0):
-            flowRateAn = self.__base_duty + control
-            flowRateCath = self.__base_duty
-        else:
-            flowRateAn = self.__base_duty
-            flowRateCath = self.__base_duty - control
+        (flowRateAn,flowRateCath) = map(int,split_control(control,self.__base_duty))
 
         duties: Duties = {}
         anolyte_flowrate = 0
         catholyte_flowrate = 0
 
-        anolyte_write = await self.__write_nullsafe(self.__pid_pumps[Settings.ANOLYTE_PUMP],flowRateAn)
+        anolyte_write = self.__set_nullsafe(self.__pid_pumps[Settings.ANOLYTE_PUMP],flowRateAn)
         if anolyte_write:
             anolyte_flowrate = flowRateAn
             duties = {**duties,self.__pid_pumps[Settings.ANOLYTE_PUMP]: anolyte_flowrate}
 
-        catholyte_write = await self.__write_nullsafe(self.__pid_pumps[Settings.CATHOLYTE_PUMP],flowRateCath)
+        catholyte_write = self.__set_nullsafe(self.__pid_pumps[Settings.CATHOLYTE_PUMP],flowRateCath)
         if catholyte_write:
             catholyte_flowrate = flowRateCath
             duties = {**duties,self.__pid_pumps[Settings.CATHOLYTE_PUMP]: catholyte_flowrate}
 
         return (anolyte_flowrate,catholyte_flowrate,duties)
     
-    async def __write_nullsafe(self,pmp: PumpNames,duty: int) -> bool:
-        if (pmp is not None) and (self.__prev_duties[pmp] != duty):
-            command = WriteCommand(pmp.value,duty)
-            self.__serial_interface.write(command)
-            self.__prev_duties[pmp] = duty
-            await asyncio.sleep(1.5) #TODO Why is this line here?
+    def __set_nullsafe(self,pmp: PumpNames,duty: int) -> bool:
+        if pmp is not None:
+            self.__duties[pmp] = duty
         return (pmp is not None)
  
     async def __wait_for_levels(self) -> bool:
@@ -251,7 +224,8 @@ class PIDRunner(Generator[Duties]):
                 await asyncio.wait_for(self.__level_event.wait(),timeout = PID_DATA_TIMEOUT)
                 if self.__refill_start_time is not None:
                     # system is refilling, check to end refill in the case that new levels will take too long
-                    await self.__handle_refill(None) #TODO <--- Untested line
+                    self.__handle_refill(None) #TODO <--- Untested line
+                    await self.__actuator.actuate(self.__duties,self.can_generate)
                 break
             except TimeoutError:
                 pass
@@ -1,63 +1,82 @@
-from support_classes import Generator, PumpNames, PumpConfig, Timer
+from typing import Any
+from support_classes import Generator, PumpConfig, Settings, DEFAULT_SETTINGS, SharedState
 from serial_interface import GenericInterface, InterfaceException
-from microcontroller import SpeedFormats
+from .speed_decoder import SpeedDecoder, SpeedAggregator, SpeedReading
+from .speed_statistics import SpeedStatisticsEngine, SpeedStatistics
 import asyncio
 
-MINIMUM_POLL_TIME = 0.5
-MAXIMUM_POLL_TIME = 4.0
-
-SpeedReading = dict[PumpNames,float]
 class SerialReader(Generator[SpeedReading|None]):
 
-    def __init__(self,serial_interface: GenericInterface) -> None:
+    def __init__(self,serial_interface: GenericInterface,
+                 poll_period: float = DEFAULT_SETTINGS[Settings.SPEED_POLL_PERIOD],
+                 poll_timeout: float = DEFAULT_SETTINGS[Settings.SPEED_POLL_TIMEOUT],
+                 aggregate: bool = DEFAULT_SETTINGS[Settings.AGGREGATE_SPEEDS],
+                 speed_per_duty: float = DEFAULT_SETTINGS[Settings.SPEED_PER_DUTY]) -> None:
         super().__init__()
         self.__serial_interface = serial_interface
-        self.__timer = Timer(MINIMUM_POLL_TIME)
+        self.__poll_period = poll_period
+        self.__poll_timeout = poll_timeout
+        self.__aggregate = aggregate
+        self.__speed_per_duty = speed_per_duty
+        self._set_period(poll_period)
+        self.__decoder: SpeedDecoder|None = None
+        self.__aggregator: SpeedAggregator|None = None
+        self.__statistics_engine: SpeedStatisticsEngine|None = None
+        self.statistics = SharedState[SpeedStatistics]()
+        """Rolling per-pump statistics, updated with every report and published once per poll period"""
+        self.reading_time: float|None = None
+        """time.monotonic() at which the most recent reading arrived from the microcontroller, rather than when it was read"""
 
     async def _setup(self):
-        pass
+        # the pump configuration cannot change once it is generated, so the decoder is only built once
+        if self.__decoder is None:
+            capabilities = self.__serial_interface.capabilities
+            self.__decoder = SpeedDecoder(PumpConfig().pumps,None if capabilities is None else capabilities.speed_format)
+            self.__aggregator = SpeedAggregator(self.__decoder)
+            self.__statistics_engine = SpeedStatisticsEngine(self.__decoder.index,self.__speed_per_duty)
 
     async def _loop(self) -> SpeedReading:
         try:
-            if self.__timer.check():
-                new_line = await asyncio.wait_for(self.__serial_interface.readbuffer(),MAXIMUM_POLL_TIME)
-            # ensures a minium time between polls to guard against microcontrollers that spam readings over the serial port
-            while self.can_generate() and not self.__timer.check():
-                # conversely, one can also put a timeout on buffer reading to be set, guarding against slow/no readings
-                new_line = await asyncio.wait_for(self.__serial_interface.readbuffer(),MAXIMUM_POLL_TIME)
-            self.__timer.reset()
-
-            if "<" in new_line:
-                fmt = SpeedFormats.NAME_VALUE
-            else:
-                fmt = SpeedFormats.COMMA_SEPARATED
-
-            match fmt:
-                case SpeedFormats.COMMA_SEPARATED:
-                    return _extract_comma_separated(new_line)
-                case SpeedFormats.NAME_VALUE:
-                    return _extract_name_value(new_line)
-            return None
-                        
+            # polls at a fixed period to guard against microcontrollers that spam readings over the serial port.
+            # Everything that arrives meanwhile waits in the interface's buffer, so the reader wakes once per period however fast the reports come
+            if not await self._wait_for_deadline():
+                return None
+            # conversely, a timeout on reading guards against slow/no readings
+            batch = await asyncio.wait_for(self.__serial_interface.readbatch(),self.__poll_timeout)
+            self.reading_time = batch[-1].timestamp
+            self.__statistics_engine.set_duties(self.__serial_interface.applied_duties(),self.reading_time)
+
+            # binary frames have already passed their CRC check in the serial thread
+            decoded = False
+            for message in batch:
+                try:
+                    row = self.__decoder.decode(message.message)
+                except ValueError:
+                    # a malformed report is skipped, rather than discarding the whole period
+                    continue
+                decoded = True
+                self.__statistics_engine.update(row,self.__decoder.reported,message.timestamp)
+                if self.__aggregate:
+                    self.__aggregator.add(row,self.__decoder.reported)
+            if not decoded:
+                return None
+            self.statistics.set_value(self.__statistics_engine.statistics())
+            # without aggregation, the reading is the newest well formed report
+            return self.__aggregator.aggregate() if self.__aggregate else self.__decoder.reading()
+
         except (TimeoutError,ValueError):
             return None
         except InterfaceException:
             raise
 
+    def set_parameters(self,new_parameters: dict[Settings,Any]):
+        self.__poll_period = float(new_parameters[Settings.SPEED_POLL_PERIOD]) if Settings.SPEED_POLL_PERIOD in new_parameters.keys() else self.__poll_period
+        self.__poll_timeout = float(new_parameters[Settings.SPEED_POLL_TIMEOUT]) if Settings.SPEED_POLL_TIMEOUT in new_parameters.keys() else self.__poll_timeout
+        self.__aggregate = bool(new_parameters[Settings.AGGREGATE_SPEEDS]) if Settings.AGGREGATE_SPEEDS in new_parameters.keys() else self.__aggregate
+        self.__speed_per_duty = float(new_parameters[Settings.SPEED_PER_DUTY]) if Settings.SPEED_PER_DUTY in new_parameters.keys() else self.__speed_per_duty
+        if self.__statistics_engine is not None:
+            self.__statistics_engine.speed_per_duty = self.__speed_per_duty
+        self._set_period(self.__poll_period)
+
     def teardown(self):
         pass
-
-
-def _extract_comma_separated(serial_text: str) -> SpeedReading:
-    new_speeds = list(map(float,serial_text.split(",")))
-    if len(new_speeds)<len(PumpConfig().pumps):
-        additional_speeds = [0.0]*(len(PumpConfig().pumps)-len(new_speeds))
-        new_speeds = [*new_speeds,*additional_speeds]
-    new_dict: SpeedReading = dict(zip(PumpConfig().pumps,new_speeds))
-    return new_dict
-
-def _extract_name_value(serial_text: str) -> SpeedReading:
-    serial_text.removeprefix("<")
-    serial_text.removesuffix(">")
-    dict_out = {PumpConfig().pumps(command[0].upper()):float(command[1]) for command in serial_text.split("><")}
-    return dict_out
\ No newline at end of file
@@ -0,0 +1,44 @@
+import numpy as np
+
+# The decisions of the PID controller, kept apart from its timing and serial writes so that the offline simulator (see simulator/) makes exactly the same ones.
+# Every function works elementwise, on plain numbers for PIDRunner or on arrays of parameter sets for the simulator. Comparisons of arrays give arrays of bools, so combine the results with &, | and ~ rather than and, or and not
+
+PID_STARTING_OUTPUT = -.28
+"""Integral term the PID controller starts with"""
+MAX_DUTY = 255
+
+def pid_tunings(proportional_gain, integral_gain, derivative_gain):
+    """(Kp, Ki, Kd) of the PID controller for the given gains. The controller acts on the difference in level (anolyte - catholyte), with a setpoint of zero"""
+    return (-proportional_gain, -integral_gain, derivative_gain)
+
+def pid_output_limits(base_duty):
+    """Limits of the PID output, which is added to the base duty of one pump or the other, so that neither duty can exceed MAX_DUTY"""
+    return (-(MAX_DUTY-base_duty), MAX_DUTY-base_duty)
+
+def split_control(control, base_duty):
+    """(anolyte duty, catholyte duty) for a PID output. A positive output speeds up the anolyte pump, a negative one the catholyte pump, while the other runs at the base duty"""
+    anolyte_duty = np.where(control > 0, base_duty + control, base_duty)
+    catholyte_duty = np.where(control > 0, base_duty, base_duty - control)
+    return (anolyte_duty, catholyte_duty)
+
+def refill_conditions(total_volume, volume_change, refilling, time_refilling, time_since_refill, refill_percentage_trigger, refill_cooldown_period, refill_time, refill_stop_on_full):
+    """(start, stop): whether a refill should start or stop now.
+    total_volume and volume_change are the averaged anolyte + catholyte volume and its change since the initial volume, or None when there is no new level reading (in which case only the time-based cutoff can stop a refill).
+    time_refilling is only used while refilling. time_since_refill is the time since the last refill finished, infinite if there has not been one"""
+    if volume_change is not None:
+        initial_volume = total_volume - volume_change
+        # percentage change in volume from initial volume
+        percent_change = np.where(initial_volume != 0, 0-volume_change/np.where(initial_volume != 0, initial_volume, 1) * 100, 0)
+        # volume has been depleted enough to justify a refill
+        insufficient_volume = (initial_volume > 0) & (percent_change > refill_percentage_trigger)
+        # a refill is ongoing, the reservoir is full again, and the setting to stop filling once full is active
+        full_stop_refill = refilling & (volume_change >= 0) & refill_stop_on_full
+    else:
+        insufficient_volume = False
+        full_stop_refill = False
+    cooldown_over = time_since_refill > refill_cooldown_period
+    # cutoff for the time-based refill
+    time_stop_refill = refilling & (time_refilling > refill_time) & ~np.asarray(refill_stop_on_full)
+    start = insufficient_volume & ~np.asarray(refilling) & cooldown_over
+    stop = ~start & (time_stop_refill | full_stop_refill)
+    return (start, stop)
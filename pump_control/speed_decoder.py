@@ -0,0 +1,162 @@
+from typing import Iterator, Iterable, Mapping
+from support_classes import PumpNames
+from serial_interface.framing import FrameType, frame_type, frame_payload
+from serial_interface.capabilities import SpeedFormat
+import numpy as np
+
+SpeedReading = Mapping[PumpNames,float]
+
+class SpeedView(Mapping[PumpNames,float]):
+    """Read-only mapping from pump to speed, backed by a NumPy row indexed by pump ordinal.
+    Behaves like the dictionaries that speeds used to be reported in, and the row itself is available as `array` for numerical work"""
+
+    __slots__ = ("__index","__row")
+
+    def __init__(self, index: dict[PumpNames,int], row: np.ndarray) -> None:
+        self.__index = index
+        self.__row = row
+
+    @property
+    def array(self) -> np.ndarray:
+        return self.__row
+
+    def __getitem__(self, pump: PumpNames) -> float:
+        return float(self.__row[self.__index[pump]])
+
+    def __iter__(self) -> Iterator[PumpNames]:
+        return iter(self.__index)
+
+    def __len__(self) -> int:
+        return len(self.__index)
+
+    def __repr__(self) -> str:
+        return f"SpeedView({ {pump.value:float(self.__row[i]) for pump, i in self.__index.items()} })"
+
+class SpeedAggregate(SpeedView):
+    """Speeds folded over a poll period. As a mapping it gives each pump's mean speed, so it can be used wherever a single reading is.
+    minimum and maximum give the extremes of each pump, and count the number of reports that included it. Pumps with no reports read as zero throughout"""
+
+    __slots__ = ("minimum","maximum","count")
+
+    def __init__(self, index: dict[PumpNames,int], mean: np.ndarray, minimum: np.ndarray, maximum: np.ndarray, count: np.ndarray) -> None:
+        super().__init__(index,mean)
+        self.minimum = SpeedView(index,minimum)
+        self.maximum = SpeedView(index,maximum)
+        self.count = count
+        """Number of reports folded in, per pump ordinal"""
+
+class SpeedDecoder:
+    """Decodes speed reports of every format into a preallocated row, without building intermediate lists or dictionaries.
+    Build one per pump configuration. decode overwrites the same row each time, and reading takes an immutable snapshot of it to hand on.
+    The text format is told apart line by line, unless speed_format (see SpeedFormat) is known from the firmware's banner"""
+
+    def __init__(self, pumps: Iterable[PumpNames], speed_format: str|None = None) -> None:
+        self.pumps = list(pumps)
+        self.__name_value = None if speed_format is None else speed_format == SpeedFormat.NAME_VALUE
+        self.__index = {pump:i for i, pump in enumerate(self.pumps)}
+        # <name,value> reports name pumps by their microcontroller name, in either case
+        self.__name_index = {**{pump.value.upper():i for pump, i in self.__index.items()},**{pump.value:i for pump, i in self.__index.items()}}
+        self.__row = np.zeros(len(self.pumps),dtype=np.float64)
+        self.__reported = np.zeros(len(self.pumps),dtype=bool)
+        # <name,value> reports are decoded into these first, so that a malformed report leaves the last good one in place
+        self.__scratch_row = np.zeros(len(self.pumps),dtype=np.float64)
+        self.__scratch_reported = np.zeros(len(self.pumps),dtype=bool)
+
+    @property
+    def index(self) -> dict[PumpNames,int]:
+        """Pump -> ordinal of the pump in the decoded row"""
+        return self.__index
+
+    @property
+    def reported(self) -> np.ndarray:
+        """Which pumps the most recent report included. Overwritten by the next call to decode"""
+        return self.__reported
+
+    def decode(self, message: str|bytes) -> np.ndarray:
+        """Decode a comma separated or <name,value> line, or a binary speed frame. Pumps missing from the report read as zero.
+        Returns the decoder's row, which is overwritten by the next call. Raises ValueError if the report is malformed, leaving the row (and reported) as they were"""
+        if isinstance(message,bytes):
+            self.__decode_binary(message)
+        elif self.__name_value if self.__name_value is not None else "<" in message:
+            self.__decode_name_value(message)
+        else:
+            self.__decode_comma_separated(message)
+        return self.__row
+
+    def reading(self) -> SpeedView:
+        """Snapshot of the most recently decoded speeds"""
+        row = self.__row.copy()
+        row.flags.writeable = False
+        return SpeedView(self.__index,row)
+
+    def __decode_comma_separated(self, line: str):
+        speeds = line.split(",")
+        n = min(len(speeds),len(self.__row))
+        # NumPy raises ValueError for anything that is not a number, before the row is touched
+        values = np.array(speeds[:n],dtype=np.float64)
+        self.__row[:n] = values
+        self.__row[n:] = 0
+        self.__reported[:n] = True
+        self.__reported[n:] = False
+
+    def __decode_name_value(self, line: str):
+        row = self.__scratch_row
+        reported = self.__scratch_reported
+        row[:] = 0
+        reported[:] = False
+        for item in line.strip().removeprefix("<").removesuffix(">").split("><"):
+            name, _, speed = item.partition(",")
+            index = self.__name_index.get(name)
+            if index is None:
+                raise ValueError(f"Speed reported for unknown pump {name}")
+            row[index] = speed
+            reported[index] = True
+        self.__row[:] = row
+        self.__reported[:] = reported
+
+    def __decode_binary(self, frame: bytes):
+        if frame_type(frame) != FrameType.SPEEDS:
+            raise ValueError(f"Expected a speed frame, received frame type {frame_type(frame)}")
+        payload = frame_payload(frame)
+        # one little endian uint16 per pump
+        n = min(len(payload)//2,len(self.__row))
+        self.__row[:n] = np.frombuffer(payload,dtype="<u2",count=n)
+        self.__row[n:] = 0
+        self.__reported[:n] = True
+        self.__reported[n:] = False
+
+class SpeedAggregator:
+    """Folds decoded reports into running per-pump sums, extremes and counts, in preallocated arrays, so that any number of reports can be taken in a poll period at a fixed cost each"""
+
+    def __init__(self, decoder: SpeedDecoder) -> None:
+        self.__index = decoder.index
+        n = len(decoder.index)
+        self.__sum = np.zeros(n,dtype=np.float64)
+        self.__min = np.full(n,np.inf)
+        self.__max = np.full(n,-np.inf)
+        self.__count = np.zeros(n,dtype=np.int64)
+
+    def add(self, row: np.ndarray, reported: np.ndarray):
+        """Fold in one decoded report. Only the pumps the report included are counted"""
+        np.add(self.__sum,row,out=self.__sum,where=reported)
+        np.minimum(self.__min,row,out=self.__min,where=reported)
+        np.maximum(self.__max,row,out=self.__max,where=reported)
+        self.__count += reported
+
+    def empty(self) -> bool:
+        return not self.__count.any()
+
+    def aggregate(self) -> SpeedAggregate:
+        """Statistics of every report added since the last call, which then starts a new period"""
+        counted = self.__count > 0
+        mean = np.divide(self.__sum,self.__count,out=np.zeros_like(self.__sum),where=counted)
+        minimum = np.where(counted,self.__min,0.0)
+        maximum = np.where(counted,self.__max,0.0)
+        count = self.__count.copy()
+        for array in (mean,minimum,maximum,count):
+            array.flags.writeable = False
+        self.__sum[:] = 0
+        self.__min[:] = np.inf
+        self.__max[:] = -np.inf
+        self.__count[:] = 0
+        return SpeedAggregate(self.__index,mean,minimum,maximum,count)
@@ -0,0 +1,134 @@
+from dataclasses import dataclass
+from support_classes import PumpNames
+from .speed_decoder import SpeedView
+import numpy as np
+
+STATISTICS_TIME_CONSTANT = 5.0
+"""Time constant (s) of the exponentially weighted rolling mean, variance and rate of change"""
+STALL_SPEED = 100.0
+"""Speeds (rpm) below this count as stationary"""
+SETTLE_TIME = 3.0
+"""Time (s) a pump is given to spin up or down after its duty changes, before it can be flagged"""
+MISMATCH_TOLERANCE = 0.5
+"""Fraction of the expected speed by which a pump's mean speed may differ before its speed and duty are flagged as mismatched"""
+
+@dataclass(frozen=True)
+class SpeedStatistics:
+    """Rolling statistics of every pump at one moment. Pumps that have not reported yet read as zero, and are never flagged"""
+    timestamp: float
+    """time.monotonic() of the newest report included"""
+    mean: SpeedView
+    variance: SpeedView
+    rate: SpeedView
+    """Rate of change of speed, in rpm/s"""
+    duties: dict[PumpNames,int]
+    """Duties the statistics were judged against. Pumps never written to are absent"""
+    stalled: frozenset[PumpNames]
+    """Pumps driven with a non-zero duty that are not turning"""
+    mismatched: frozenset[PumpNames]
+    """Pumps that are turning, but at a speed that does not match their duty (including pumps turning with zero duty)"""
+
+    def std(self, pump: PumpNames) -> float:
+        return float(np.sqrt(self.variance[pump]))
+
+class SpeedStatisticsEngine:
+    """Streaming per-pump statistics over the speed reports.
+    Each report updates exponentially weighted estimates in place, vectorised over the pumps, so the cost of a report is fixed and no history is kept or rescanned.
+    The weights follow the reports' timestamps, so irregular or bursty reporting is weighted by time rather than by count"""
+
+    def __init__(self, index: dict[PumpNames,int], speed_per_duty: float, time_constant: float = STATISTICS_TIME_CONSTANT, stall_speed: float = STALL_SPEED, settle_time: float = SETTLE_TIME, mismatch_tolerance: float = MISMATCH_TOLERANCE) -> None:
+        self.__index = index
+        self.__pumps = list(index)
+        self.speed_per_duty = speed_per_duty
+        self.time_constant = time_constant
+        self.stall_speed = stall_speed
+        self.settle_time = settle_time
+        self.mismatch_tolerance = mismatch_tolerance
+        n = len(index)
+        self.__mean = np.zeros(n)
+        self.__variance = np.zeros(n)
+        self.__rate = np.zeros(n)
+        self.__last_speed = np.zeros(n)
+        self.__last_time = np.zeros(n)
+        self.__seen = np.zeros(n,dtype=bool)
+        self.__duty = np.zeros(n)
+        self.__duty_known = np.zeros(n,dtype=bool)
+        self.__duty_since = np.zeros(n)
+        self.__duties: dict[PumpNames,int] = {}
+        self.__timestamp = 0.0
+        # working arrays, reused between updates
+        self.__dt = np.zeros(n)
+        self.__alpha = np.zeros(n)
+        self.__delta = np.zeros(n)
+        self.__step = np.zeros(n)
+        self.__update = np.zeros(n,dtype=bool)
+
+    def set_duties(self, duties: dict[str,int], timestamp: float):
+        """Record the current duties, keyed by pump name (see GenericInterface.applied_duties). A pump whose duty changes gets the settle time before it can be flagged"""
+        for pump, duty in duties.items():
+            i = self.__index.get(pump)
+            if i is None:
+                continue
+            if not self.__duty_known[i] or self.__duty[i] != duty:
+                self.__duty[i] = duty
+                self.__duty_known[i] = True
+                self.__duty_since[i] = timestamp
+                self.__duties[self.__pumps[i]] = duty
+
+    def update(self, row: np.ndarray, reported: np.ndarray, timestamp: float):
+        """Fold in one decoded report (see SpeedDecoder.decode and SpeedDecoder.reported)"""
+        np.greater(reported,self.__seen,out=self.__update)
+        if self.__update.any():
+            # a pump's first report starts its statistics
+            np.copyto(self.__mean,row,where=self.__update)
+            np.copyto(self.__last_speed,row,where=self.__update)
+            np.copyto(self.__last_time,timestamp,where=self.__update)
+            self.__seen |= reported
+
+        # alpha = 1 - exp(-dt/tau): the weight of the new report grows with the time it covers.
+        # Pumps missing from the report get a weight of zero, which leaves their statistics untouched
+        np.subtract(timestamp,self.__last_time,out=self.__dt)
+        np.multiply(self.__dt,-1/self.time_constant,out=self.__alpha)
+        np.expm1(self.__alpha,out=self.__alpha)
+        np.negative(self.__alpha,out=self.__alpha)
+        self.__alpha *= reported
+
+        # incremental exponentially weighted variance: var = (1-alpha)*(var + alpha*delta^2), with delta taken from the previous mean
+        np.subtract(row,self.__mean,out=self.__delta)
+        np.multiply(self.__delta,self.__alpha,out=self.__step)
+        self.__mean += self.__step
+        self.__step *= self.__delta
+        self.__variance += self.__step
+        np.subtract(1,self.__alpha,out=self.__step)
+        self.__variance *= self.__step
+
+        np.greater(self.__dt,0,out=self.__update)
+        np.subtract(row,self.__last_speed,out=self.__delta)
+        np.divide(self.__delta,self.__dt,out=self.__delta,where=self.__update)
+        self.__delta -= self.__rate
+        self.__delta *= self.__alpha
+        self.__rate += self.__delta
+
+        np.copyto(self.__last_speed,row,where=reported)
+        np.copyto(self.__last_time,timestamp,where=reported)
+        self.__timestamp = max(self.__timestamp,timestamp)
+
+    def statistics(self) -> SpeedStatistics:
+        """Snapshot of the current statistics, with stalled and mismatched pumps judged at the newest report"""
+        judged = self.__seen & self.__duty_known & (self.__timestamp - self.__duty_since >= self.settle_time)
+        stationary = self.__mean < self.stall_speed
+        stalled = judged & (self.__duty > 0) & stationary
+        expected = self.__duty*self.speed_per_duty
+        # a pump is always allowed stall_speed of slack, so that a pump idling at zero duty is not flagged for noise
+        mismatched = judged & ~stalled & (np.abs(self.__mean-expected) > np.maximum(self.mismatch_tolerance*expected,self.stall_speed))
+        arrays = []
+        for array in (self.__mean,self.__variance,self.__rate):
+            array = array.copy()
+            array.flags.writeable = False
+            arrays.append(SpeedView(self.__index,array))
+        return SpeedStatistics(
+            self.__timestamp,*arrays,
+            duties = dict(self.__duties),
+            stalled = frozenset(self.__pumps[i] for i in np.flatnonzero(stalled)),
+            mismatched = frozenset(self.__pumps[i] for i in np.flatnonzero(mismatched))
+        )
@@ -2,11 +2,16 @@ from collections import deque
 import numpy as np
     
 class TimeAvg:
+    """Mean of the data appended within the last delta_t seconds.
+    Each item of data can be a number, or an array to average many streams that share their timestamps at once (as the simulator does for a batch of parameter sets).
+    A running sum is kept, so the cost of each append and calculation does not grow with the window. It is summed afresh once as many points have left the window as are in it, so rounding errors cannot build up"""
 
     def __init__(self,delta_t: float,data_size: int = 0):
         self.dt = delta_t
         self.stream = deque[_DataPoint]()
         self.__data_size = data_size
+        self.__sum: np.ndarray|None = None
+        self.__removed = 0
 
     @property
     def furthest_time(self) -> float|None:
@@ -19,23 +24,32 @@ class TimeAvg:
             return None
         return self.stream[-1].time
     
-    def append(self,data: list[float], timestamp: float):
-        if not isinstance(data,list):
+    def append(self,data: list[float]|np.ndarray, timestamp: float):
+        if not isinstance(data,(list,np.ndarray)):
             data = list(data)
         if self.__data_size == 0:
             self.__data_size = len(data)
         elif len(data) != self.__data_size or len(data)<1:
             raise ValueError("Time data size does not match that already in memory")
-        datap = _DataPoint(list(map(float,data)),timestamp)
+        datap = _DataPoint(np.array(data,dtype=float),timestamp)
 
         self.stream.append(datap)
+        if self.__sum is not None:
+            self.__sum += datap.data
         if self.furthest_time is not None and self.latest_time is not None:
             while self.latest_time-self.furthest_time>self.dt:
-                self.stream.popleft()
+                removed = self.stream.popleft()
+                if self.__sum is not None:
+                    self.__sum -= removed.data
+                self.__removed += 1
+        if self.__removed >= len(self.stream):
+            self.__sum = None
 
-    def calculate(self) -> list[float]:
-        twod_list = [datapoint.data for datapoint in self.stream]
-        out= list(np.mean(np.array(twod_list),axis=0))
+    def calculate(self) -> list[float]|list[np.ndarray]:
+        if self.__sum is None:
+            self.__sum = np.sum(np.stack([datapoint.data for datapoint in self.stream]),axis=0)
+            self.__removed = 0
+        out= list(self.__sum/len(self.stream))
         return out
     
     @staticmethod
@@ -53,6 +67,6 @@ class TimeAvg:
 
 class _DataPoint:
 
-    def __init__(self,data: list[float], time: float) -> None:
+    def __init__(self,data: np.ndarray, time: float) -> None:
         self.data = data
         self.time = time
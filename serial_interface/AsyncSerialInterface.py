@@ -0,0 +1,270 @@
+from .GenericInterface import GenericInterface, InterfaceException, WriteCommand, WritePriority, TimestampedMessage
+from .framing import BinaryFramer
+from .protocols import SerialProtocol, TextProtocol, BinaryProtocol
+from .scheduling import WriteScheduler, AckTracker
+from .buffers import MessageRing, OverwritingQueue, ConfirmationQueue
+from .interlock import Interlock, InterlockRule, InterlockTrip
+from .capabilities import is_banner
+from .SerialInterface import SERIAL_WRITE_PAUSE, _SERIAL_OUTPUT_QUEUE_MAX_SIZE, _FALLBACK_POLL_PERIOD, _selectable_fileno, write_loop, flush_write_buffer, enforce_interlock, _handle_ack
+from support_classes import Timer
+from serial import Serial, SerialException
+import asyncio
+import time
+
+class AsyncSerialInterface(GenericInterface):
+    """Serial interface that is serviced directly by the event loop that establishes it, instead of by a dedicated thread.
+    The port's file descriptor is registered with the loop (add_reader/add_writer), so framing, acknowledgements and paced writes all run as loop callbacks, and readbatch awaits the next messages directly.
+    Where the loop cannot watch the port (Windows COM ports, the proactor event loop, mocked ports), the port is polled by a task instead.
+    write, write_batch and close may be called from any thread. Everything else must be called from the loop that called establish."""
+
+    def __init__(self,port: str,baudrate: int = 9600,batch_writes: bool = False,acknowledge_writes: bool = False,binary_protocol: bool = False,**kwargs) -> None:
+        super().__init__(port,baudrate=baudrate,**kwargs)
+        self.__port = port
+        self.__baudrate = baudrate
+        self.__batch_writes = batch_writes
+
+        self._write_scheduler = WriteScheduler() # commands *waiting to* be sent over serial, at most one per pump and priority
+        self._write_output_queue = ConfirmationQueue(_SERIAL_OUTPUT_QUEUE_MAX_SIZE) # commands that *have* been sent (or, when writes are acknowledged, applied). Read by other threads, so it stays a threadsafe queue
+        self._ack_tracker = AckTracker() if acknowledge_writes else None
+        self._protocol: SerialProtocol = BinaryProtocol() if binary_protocol else TextProtocol()
+        self._framer = self._protocol.new_framer()
+        self._interlock = Interlock() # safety rules checked as soon as reports are framed
+
+        self.__messages = MessageRing()
+        self.__message_available = asyncio.Event()
+
+        self.__loop: asyncio.AbstractEventLoop|None = None
+        self.__serial: Serial|None = None
+        self.__fd: int|None = None
+        self.__writer_registered = False
+        self.__write_timer = Timer(SERIAL_WRITE_PAUSE)
+        self.__write_handle: asyncio.TimerHandle|None = None
+        self.__interlock_handle: asyncio.TimerHandle|None = None
+        self.__poll_task: asyncio.Task|None = None
+        self.__error: BaseException|None = None
+
+        port_desc = GenericInterface.get_serial_ports()
+        if port not in port_desc[0]:
+            raise InterfaceException(f"""Port "{self.port}" could not be found""")
+
+    @property
+    def port(self):
+        return self.__port
+
+    @property
+    def baudrate(self):
+        return self.__baudrate
+
+    @property
+    def written_duties(self):
+        return self._write_output_queue
+
+    def applied_duties(self) -> dict[str,int]:
+        return self._write_output_queue.latest_duties()
+
+    def set_interlock_rules(self, rules: list[InterlockRule]):
+        self._interlock.set_rules(rules)
+        if self.__loop is not None:
+            self.__loop.call_soon_threadsafe(self.__check_interlock)
+
+    @property
+    def interlock_trips(self) -> OverwritingQueue[InterlockTrip]:
+        return self._interlock.trips
+
+    @property
+    def coalesced_writes(self) -> int:
+        """Number of queued commands that were superseded by a newer command for the same pump before they could be sent"""
+        return self._write_scheduler.coalesced_count
+
+    @property
+    def dropped_messages(self) -> int:
+        """Number of messages from the microcontroller that were overwritten before they were read"""
+        return self.__messages.dropped_count
+
+    @property
+    def unacknowledged_writes(self) -> int:
+        """Number of sent commands that the microcontroller never acknowledged. Always zero if writes are not acknowledged"""
+        return 0 if self._ack_tracker is None else self._ack_tracker.unacknowledged_count
+
+    @property
+    def rejected_frames(self) -> int:
+        """Number of received binary frames that were thrown away because their CRC did not match. Always zero for the text protocol"""
+        return self._framer.rejected_frames if isinstance(self._framer,BinaryFramer) else 0
+
+    def _serial_initialiser(self) -> Serial:
+        return Serial(self.port,baudrate=self.baudrate)
+
+    async def establish(self):
+        if self.__serial is not None:
+            return
+        self.__loop = asyncio.get_running_loop()
+        try:
+            self.__serial = self._serial_initialiser()
+        except (SerialException, OSError, ValueError):
+            errtxt = f"""Could not connect to port "{self.port}".""" if self.port in GenericInterface.get_serial_ports()[0] else f"""Port "{self.port}" could not be found"""
+            raise InterfaceException(errtxt)
+        self.__error = None
+        self.__write_timer = Timer(SERIAL_WRITE_PAUSE)
+        self.__fd = _selectable_fileno(self.__serial)
+        if self.__fd is not None:
+            try:
+                self.__loop.add_reader(self.__fd,self.__on_readable)
+            except NotImplementedError:
+                # e.g. the proactor event loop on Windows
+                self.__fd = None
+        if self.__fd is None:
+            self.__poll_task = self.__loop.create_task(self.__poll())
+        # send anything that was queued before the port was opened
+        self.__request_write()
+
+    def close(self):
+        if self.__serial is None:
+            return
+        try:
+            on_loop = asyncio.get_running_loop() is self.__loop
+        except RuntimeError:
+            on_loop = False
+        if not on_loop and self.__loop.is_running():
+            # the port is owned by the event loop, so it has to be closed there
+            async def close_on_loop():
+                self.close()
+            asyncio.run_coroutine_threadsafe(close_on_loop(),self.__loop).result()
+            return
+        serial_inst = self.__serial
+        self.__serial = None
+        self.__stop_servicing()
+        try:
+            # pending commands (e.g. stops during teardown) are still sent. This blocks the loop, but only while the interface shuts down
+            flush_write_buffer(serial_inst,MessageRing(1),self._framer,self._write_scheduler,self._write_output_queue,self.__write_timer,self.__batch_writes,self._ack_tracker,self._protocol)
+        finally:
+            serial_inst.close()
+            # wake any reader so that it sees the interface has closed
+            self.__message_available.set()
+
+    async def readbatch(self) -> list[TimestampedMessage]:
+        while True:
+            self.__raise_if_closed()
+            self.__message_available.clear()
+            messages = self.__messages.drain()
+            if len(messages) > 0:
+                return messages
+            await self.__message_available.wait()
+
+    def write(self,command: WriteCommand,priority: WritePriority = WritePriority.NORMAL):
+        self.write_batch([command],priority)
+
+    def write_batch(self,commands: list[WriteCommand],priority: WritePriority = WritePriority.NORMAL):
+        self.__raise_if_closed()
+        # all commands are queued before the loop is woken, so in batch mode they are sent in the same write
+        self._write_scheduler.put_many(commands,priority)
+        self.__loop.call_soon_threadsafe(self.__request_write)
+
+    def __raise_if_closed(self):
+        if self.__serial is None or self.__error is not None:
+            raise (InterfaceException("Interface not established") if self.__error is None else self.__error)
+
+    def __fail(self, error: BaseException):
+        """The port has failed (e.g. it was unplugged): stop servicing it and pass the error on to readers and writers"""
+        self.__error = error if isinstance(error,InterfaceException) else InterfaceException(f"""Lost connection to port "{self.port}": {error}""")
+        self.__stop_servicing()
+        self.__message_available.set()
+
+    def __stop_servicing(self):
+        if self.__write_handle is not None:
+            self.__write_handle.cancel()
+            self.__write_handle = None
+        if self.__interlock_handle is not None:
+            self.__interlock_handle.cancel()
+            self.__interlock_handle = None
+        if self.__poll_task is not None:
+            self.__poll_task.cancel()
+            self.__poll_task = None
+        if self.__fd is not None:
+            self.__loop.remove_reader(self.__fd)
+            if self.__writer_registered:
+                self.__loop.remove_writer(self.__fd)
+            self.__writer_registered = False
+            self.__fd = None
+
+    ## READING
+    async def __poll(self):
+        while True:
+            self.__on_readable()
+            await asyncio.sleep(_FALLBACK_POLL_PERIOD)
+
+    def __on_readable(self):
+        if self.__serial is None or self.__error is not None:
+            return
+        try:
+            n_waiting = self.__serial.in_waiting
+            data = self.__serial.read(n_waiting) if n_waiting > 0 else b""
+        except (SerialException, OSError) as e:
+            self.__fail(e)
+            return
+        acknowledged = False
+        timestamp = time.monotonic()
+        for message in self._framer.feed(data):
+            if self._protocol.is_ack(message):
+                _handle_ack(message,self._ack_tracker,self._write_output_queue,self._protocol)
+                acknowledged = True
+                continue
+            if is_banner(message):
+                continue
+            self._interlock.report(message,self._protocol,timestamp)
+            self.__messages.put(message,timestamp)
+            self.__message_available.set()
+        self.__check_interlock()
+        if acknowledged:
+            # the acknowledgement may release the next write
+            self.__request_write()
+
+    ## INTERLOCK
+    def __check_interlock(self):
+        """Send any stops the interlock calls for straight away, then come back when a rule could trip without new data (e.g. missing telemetry)"""
+        if self.__interlock_handle is not None:
+            self.__interlock_handle.cancel()
+            self.__interlock_handle = None
+        if self.__serial is None or self.__error is not None or not self._interlock.enabled:
+            return
+        try:
+            enforce_interlock(self.__serial,self._interlock,self._write_scheduler,self._write_output_queue,self._ack_tracker,self._protocol)
+        except (SerialException, OSError) as e:
+            self.__fail(e)
+            return
+        deadline = self._interlock.time_to_deadline(time.monotonic())
+        if deadline is not None:
+            self.__interlock_handle = self.__loop.call_later(deadline,self.__check_interlock)
+
+    ## WRITING
+    def __request_write(self):
+        """Send any pending commands as soon as the port can take them"""
+        if self.__serial is None or self.__error is not None or self.__writer_registered:
+            return
+        if self.__fd is not None:
+            self.__loop.add_writer(self.__fd,self.__on_writable)
+            self.__writer_registered = True
+        else:
+            self.__service_writes()
+
+    def __on_writable(self):
+        self.__loop.remove_writer(self.__fd)
+        self.__writer_registered = False
+        self.__service_writes()
+
+    def __service_writes(self):
+        if self.__write_handle is not None:
+            self.__write_handle.cancel()
+            self.__write_handle = None
+        if self.__serial is None or self.__error is not None:
+            return
+        try:
+            write_loop(self.__serial,self._write_scheduler,self._write_output_queue,self.__write_timer,self.__batch_writes,self._ack_tracker,self._protocol)
+        except (SerialException, OSError) as e:
+            self.__fail(e)
+            return
+        # a pump that has just started may need watching
+        self.__check_interlock()
+        # come back when the write pause ends, or when an acknowledgement is overdue. An acknowledgement that arrives in time requests the next write itself
+        ack_outstanding = self._ack_tracker is not None and self._ack_tracker.outstanding() > 0
+        if ack_outstanding or not self._write_scheduler.empty():
+            self.__write_handle = self.__loop.call_later(self.__write_timer.remaining(),self.__request_write)
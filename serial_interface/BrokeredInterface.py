@@ -0,0 +1,147 @@
+from pathlib import Path
+from .GenericInterface import GenericInterface, InterfaceException, WriteCommand, WritePriority, TimestampedMessage
+from .buffers import MessageRing, OverwritingQueue, ConfirmationQueue
+from .interlock import InterlockRule, InterlockTrip
+from .broker import RecordType, decode_message, decode_commands, encode_commands, split_records, _RECV_SIZE
+from .SerialInterface import _ThreadsafeAsyncEvent, _SERIAL_OUTPUT_QUEUE_MAX_SIZE
+from support_classes import SharedState
+import asyncio
+import threading
+import socket
+
+class BrokeredInterface(GenericInterface):
+    """Shares the port of a SerialInterface in another process, which was created with broker_path (see broker.py).
+    Every message the owner reads is received here too, with the owner's timestamps (time.monotonic() is the same clock for every process on a machine), and so is every confirmed command. The current duties are sent as soon as the connection is made.
+    Commands are queued by the owner with the priority they are written with, so they are paced and coalesced together with the owner's own commands.
+    The safety interlock is the owner's: its stops are confirmed here like any other command, but its rules and trips stay with the owner.
+    If the owner closes the port, readbatch raises InterfaceException, which ends SerialReader as a lost connection would."""
+
+    def __init__(self, broker_path: Path|str, **kwargs) -> None:
+        super().__init__(str(broker_path),**kwargs)
+        self.__broker_path = str(broker_path)
+        self.__sock: socket.socket|None = None
+        self.__send_lock = threading.Lock()
+        self.__thread: threading.Thread|None = None
+        self._connected = _ThreadsafeAsyncEvent()
+        self._error = SharedState[BaseException|None](None)
+        self._data_available = _ThreadsafeAsyncEvent()
+        self._read_queue = MessageRing()
+        self._write_output_queue = ConfirmationQueue(_SERIAL_OUTPUT_QUEUE_MAX_SIZE)
+        self.__trips = OverwritingQueue[InterlockTrip]()
+
+    @property
+    def port(self):
+        return self.__broker_path
+
+    @property
+    def written_duties(self):
+        return self._write_output_queue
+
+    def applied_duties(self) -> dict[str,int]:
+        return self._write_output_queue.latest_duties()
+
+    def set_interlock_rules(self, rules: list[InterlockRule]):
+        # the owner's rules are enforced on the owner's serial thread, and a second set here could only trip later
+        pass
+
+    @property
+    def interlock_trips(self) -> OverwritingQueue[InterlockTrip]:
+        """Always empty: trips are reported to the process that owns the port"""
+        return self.__trips
+
+    @property
+    def dropped_messages(self) -> int:
+        """Number of messages received from the broker that were overwritten before they were read"""
+        return self._read_queue.dropped_count
+
+    async def establish(self):
+        if self._connected.is_set():
+            return
+        event_loop = asyncio.get_event_loop()
+        self._connected.set_loop(event_loop)
+        self._data_available.set_loop(event_loop)
+        sock = socket.socket(socket.AF_UNIX,socket.SOCK_STREAM)
+        try:
+            await event_loop.run_in_executor(None,sock.connect,self.__broker_path)
+        except OSError:
+            sock.close()
+            raise InterfaceException(f"""Could not connect to a shared port at "{self.__broker_path}".""")
+        self.__sock = sock
+        self._error.set_value(None)
+        self._connected.set()
+        self.__thread = threading.Thread(target=self.__receive_loop,args=(sock,),daemon=True)
+        self.__thread.start()
+
+    def close(self):
+        sock = self.__sock
+        if sock is None:
+            return
+        self.__sock = None
+        self._connected.clear()
+        try:
+            # wakes the receiving thread, which closes the socket once it has stopped
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        if self.__thread is not None and self.__thread is not threading.current_thread():
+            self.__thread.join()
+
+    def __receive_loop(self, sock: socket.socket):
+        buffer = bytearray()
+        try:
+            while True:
+                data = sock.recv(_RECV_SIZE)
+                if len(data) == 0:
+                    if self._connected.is_set():
+                        self._error.set_value(InterfaceException(f"""The shared port at "{self.__broker_path}" was closed by its owner."""))
+                    return
+                buffer += data
+                for record_type, payload in split_records(buffer):
+                    if record_type == RecordType.MESSAGE:
+                        message = decode_message(payload)
+                        self._read_queue.put(message.message,message.timestamp)
+                    elif record_type == RecordType.CONFIRMED:
+                        for command in decode_commands(payload):
+                            self._write_output_queue.put(command)
+                if not self._read_queue.empty():
+                    self._data_available.set()
+        except (OSError, ValueError) as e:
+            if self._connected.is_set():
+                self._error.set_value(InterfaceException(f"""Lost the shared port at "{self.__broker_path}": {e}"""))
+        except BaseException as e:
+            self._error.set_value(e)
+        finally:
+            self._connected.clear()
+            # wake any reader, so that it sees the connection has gone (and why)
+            self._data_available.set()
+            sock.close()
+
+    async def readbatch(self) -> list[TimestampedMessage]:
+        while True:
+            if not self._connected.is_set():
+                err = self._error.get_value()
+                raise (InterfaceException("Interface not established") if err is None else err)
+            # clear before draining, so that a message that arrives in between sets the flag again
+            self._data_available.clear()
+            messages = self._read_queue.drain()
+            if len(messages) > 0:
+                return messages
+            await self._data_available.async_event.wait()
+
+    def write(self,command: WriteCommand,priority: WritePriority = WritePriority.NORMAL):
+        self.write_batch([command],priority)
+
+    def write_batch(self,commands: list[WriteCommand],priority: WritePriority = WritePriority.NORMAL):
+        sock = self.__sock
+        if sock is None or not self._connected.is_set():
+            err = self._error.get_value()
+            raise (InterfaceException("Interface not established") if err is None else err)
+        if len(commands) == 0:
+            return
+        for command in commands:
+            command.validate()
+        try:
+            with self.__send_lock:
+                sock.sendall(encode_commands(commands,priority))
+        except OSError as e:
+            raise InterfaceException(f"""Could not send commands to the shared port at "{self.__broker_path}": {e}""")
@@ -1,5 +1,8 @@
-from .GenericInterface import InterfaceException, GenericInterface
+from .GenericInterface import InterfaceException, GenericInterface, BROADCAST_PUMP
 from .SerialInterface import SerialInterface
+from .AsyncSerialInterface import AsyncSerialInterface
+from .protocols import TextProtocol, BinaryProtocol
+from .capabilities import FirmwareCapabilities, SpeedFormat, CAPABILITY_QUERY, BANNER_VERSION
 from support_classes import PumpConfig
 import random
 import time
@@ -8,40 +11,71 @@ from serial import Serial
 # Mocking classes that simulate behaviour of a serial port.
 
 class DummyInterface(SerialInterface):
-    def __init__(self, num_pumps: int, port: str, baudrate: int = 9600, **kwargs) -> None:
+    def __init__(self, num_pumps: int, port: str, baudrate: int = 9600, report_period: float = 1.0, acknowledge_writes: bool = False, binary_protocol: bool = False, **kwargs) -> None:
         self.__num_pumps = num_pumps
+        self.__report_period = report_period
+        self.__acknowledge_writes = acknowledge_writes
+        self.__binary_protocol = binary_protocol
         try:
-            super().__init__(port, baudrate, **kwargs)
+            super().__init__(port, baudrate, acknowledge_writes=acknowledge_writes, binary_protocol=binary_protocol, **kwargs)
         except InterfaceException:
             pass
 
     # simply redefining the serial initialiser allows us to insert the mocking "DummySerial" class into the existing serial loop
     def _serial_initialiser(self):
-        return DummySerial(self.__num_pumps, self.port, baudrate=9600)
+        return DummySerial(self.__num_pumps, self.port, baudrate=self.baudrate, report_period=self.__report_period, acknowledge_writes=self.__acknowledge_writes, binary_protocol=self.__binary_protocol)
 
+class AsyncDummyInterface(AsyncSerialInterface):
+    def __init__(self, num_pumps: int, port: str, baudrate: int = 9600, report_period: float = 1.0, acknowledge_writes: bool = False, binary_protocol: bool = False, **kwargs) -> None:
+        self.__num_pumps = num_pumps
+        self.__report_period = report_period
+        self.__acknowledge_writes = acknowledge_writes
+        self.__binary_protocol = binary_protocol
+        try:
+            super().__init__(port, baudrate, acknowledge_writes=acknowledge_writes, binary_protocol=binary_protocol, **kwargs)
+        except InterfaceException:
+            pass
+
+    def _serial_initialiser(self):
+        return DummySerial(self.__num_pumps, self.port, baudrate=self.baudrate, report_period=self.__report_period, acknowledge_writes=self.__acknowledge_writes, binary_protocol=self.__binary_protocol)
 
 
 class DummySerial(Serial):
-    def __init__(self, num_pumps: int, port: str | None = None, baudrate: int = 9600, bytesize: int = 8, parity: str = "N", stopbits: float = 1, timeout: float | None = None, xonxoff: bool = False, rtscts: bool = False, write_timeout: float | None = None, dsrdtr: bool = False, inter_byte_timeout: float | None = None, exclusive: float | None = None) -> None:
+    def __init__(self, num_pumps: int, port: str | None = None, baudrate: int = 9600, bytesize: int = 8, parity: str = "N", stopbits: float = 1, timeout: float | None = None, xonxoff: bool = False, rtscts: bool = False, write_timeout: float | None = None, dsrdtr: bool = False, inter_byte_timeout: float | None = None, exclusive: float | None = None, report_period: float = 1.0, acknowledge_writes: bool = False, binary_protocol: bool = False) -> None:
         names = PumpConfig.allowable_values[:num_pumps]
+        self.report_period = report_period
+        self.byte_time = 10/baudrate # start bit, 8 data bits and stop bit
+        self.protocol = BinaryProtocol() if binary_protocol else TextProtocol()
         self.applied_duties = {name:"0" for name in names}
+        self.capabilities = FirmwareCapabilities(BANNER_VERSION,num_pumps,SpeedFormat.BINARY if binary_protocol else SpeedFormat.COMMA_SEPARATED,True,acknowledge_writes,binary_protocol,True,baudrate,report_period)
         self.output_pointer = 0
-        self.output = "0,"*(num_pumps-1)+"0\n"
+        self.output = b""
         self._generate_output()
         self.time_of_last_input = time.time()
+        self.acknowledge_writes = acknowledge_writes
+        self.ack_output = b""
 
     @property
-    def in_waiting(self) -> bool:
-        if time.time()-self.time_of_last_input>=1:
-            return True
+    def in_waiting(self) -> int:
+        # a report is available once the report period has passed and it has had time to be transmitted at the baud rate
+        if time.time()-self.time_of_last_input>=self.report_period+len(self.output)*self.byte_time:
+            return len(self.ack_output)+len(self.output)-self.output_pointer
         else:
-            return False
+            return len(self.ack_output)
 
     def write(self,b: bytes):
-        s = b.decode()
-        pmpname, duty = GenericInterface.unformat_duty(s)
-        speed = str(int(int(duty)/255 * 12300))
-        self.applied_duties[pmpname] = speed
+        if b == CAPABILITY_QUERY:
+            # answered straight away, like an acknowledgement
+            self.ack_output += (self.capabilities.to_banner()+"\n").encode()
+            return
+        for name, duty in self.protocol.decode_duties(b):
+            # like the generated firmware, the broadcast name sets every pump
+            for pmpname in (self.applied_duties.keys() if name == BROADCAST_PUMP else [name]):
+                speed = str(int(int(duty)/255 * 12300))
+                self.applied_duties[pmpname] = speed
+                if self.acknowledge_writes:
+                    # duties are applied straight away, so they are acknowledged straight away
+                    self.ack_output += self.protocol.encode_ack(pmpname,duty)
 
     def reset_output_buffer(self) -> None:
         pass
@@ -50,12 +84,16 @@ class DummySerial(Serial):
         pass
 
     def read(self,size: int = 1) -> bytes:
-        out = self.output[self.output_pointer]
-        if out == "\n":
+        if len(self.ack_output) > 0:
+            # acknowledgements are sent ahead of any speed line that is waiting
+            out = self.ack_output[:size]
+            self.ack_output = self.ack_output[len(out):]
+            return out
+        out = self.output[self.output_pointer:self.output_pointer+size]
+        self.output_pointer += len(out)
+        if self.output_pointer >= len(self.output):
             self._generate_output()
-        else:
-            self.output_pointer += 1
-        return out.encode()
+        return out
 
     def _generate_output(self):
         def random_value(str_in: str):
@@ -64,12 +102,14 @@ class DummySerial(Serial):
                 num_out = int(num_in - num_in/10 + num_in/5 * random.random())
             else:
                 num_out = int(num_in - 50 + 100 * random.random())
-            return str(num_out)
-        outlst = [random_value(val) for val in self.applied_duties.values()]
-        csv = ",".join(outlst)
-        self.output = f"{csv}\n"
+            return num_out
+        self.output = self.protocol.encode_speeds([random_value(val) for val in self.applied_duties.values()])
         self.output_pointer = 0
         self.time_of_last_input = time.time()
 
+    def fileno(self) -> int:
+        # there is no underlying port, so the serial loop falls back to polling in_waiting
+        raise OSError("DummySerial is not backed by a file descriptor")
+
     def close(self):
         pass
@@ -2,20 +2,51 @@ from abc import ABC, abstractmethod
 import queue
 import serial.tools.list_ports
 from dataclasses import dataclass
+from numbers import Integral
+from enum import IntEnum
+from support_classes import PumpConfig, SharedState
+from .capabilities import FirmwareCapabilities
 
 DUMMY_PORT = "Dummy Port"
 DUMMY_DESCRIPTION = "Debug Only"
+ACK_PREFIX = "!"
+"""First character of a line sent by the microcontroller to confirm that it has applied a duty"""
+BROADCAST_PUMP = "*"
+"""Pump name that addresses every pump at once, e.g. <*,0> stops them all. Only understood by microcontrollers with broadcast support (see MicrocontrollerProfile.broadcast_stop)"""
+
+class WritePriority(IntEnum):
+    NORMAL = 0
+    """Routine duty changes (manual sets, PID and refill updates)"""
+    HIGH = 1
+    """Commands that must pre-empt routine traffic, e.g. stopping pumps"""
+    EMERGENCY = 2
+    """Commands sent straight away, without waiting for the pause between writes or for outstanding acknowledgements, e.g. stopping every pump"""
+
+MAX_DUTY = 255
+"""Largest duty a microcontroller accepts. Binary frames carry the duty in a single byte"""
 
 @dataclass
 class WriteCommand:
     pump: str
     duty: int
+    def validate(self):
+        """Raises ValueError if the command could not be sent. Checked when commands are queued, since an unencodable command would otherwise end the serial thread"""
+        if not isinstance(self.duty,Integral) or not 0 <= self.duty <= MAX_DUTY:
+            raise ValueError(f"Duty must be an integer from 0 to {MAX_DUTY}, not {self.duty!r}")
+        if not isinstance(self.pump,str) or len(self.pump) != 1 or not self.pump.isascii():
+            raise ValueError(f"Pump name must be a single ASCII character, not {self.pump!r}")
     def to_str(self) -> str:
         return GenericInterface.format_duty(self.pump,self.duty)
     @staticmethod
     def from_str(str_in: str) -> "WriteCommand":
         return WriteCommand(*GenericInterface.unformat_duty(str_in))
 
+@dataclass
+class TimestampedMessage:
+    timestamp: float
+    """time.monotonic() when the message arrived from the microcontroller"""
+    message: str|bytes
+
 @dataclass
 class SpeedReading:
     pump: str
@@ -28,14 +59,34 @@ class SpeedReading:
 
 class GenericInterface(ABC):
 
-    def __init__(self,port,**kwargs) -> None:
-        pass
+    def __init__(self,port,broadcast_stop: bool = False,**kwargs) -> None:
+        self._broadcast_stop = broadcast_stop
+        self.degraded = SharedState[bool](False)
+        """True while the connection is lost and the interface is trying to re-establish it. Reads time out meanwhile, and writes are held (the newest for each pump) until the connection is back"""
+        self.capabilities: FirmwareCapabilities|None = None
+        """What the firmware reported it supports when the interface was established, or None if it was not asked or did not answer (see capabilities.py)"""
 
     @property
     @abstractmethod
     def written_duties(self) -> queue.Queue[WriteCommand]:
         """This is a queue that stores all write commands that have been successfully performed"""
         pass
+
+    @abstractmethod
+    def applied_duties(self) -> dict[str,int]:
+        """The latest successfully performed duty of each pump, without consuming written_duties. Pumps that have never been written to are absent"""
+        pass
+
+    @abstractmethod
+    def set_interlock_rules(self, rules: list) -> None:
+        """Replace the safety interlock rules (see interlock.py). They are checked wherever the interface decodes reports, and stop pumps without waiting for the write queue"""
+        pass
+
+    @property
+    @abstractmethod
+    def interlock_trips(self) -> queue.Queue:
+        """Every set of pumps stopped by the safety interlock (InterlockTrip), with the reasons"""
+        pass
     
     @abstractmethod
     async def establish(self):
@@ -46,13 +97,31 @@ class GenericInterface(ABC):
         pass
 
     @abstractmethod
-    async def readbuffer(self) -> str:
+    async def readbatch(self) -> list[TimestampedMessage]:
+        """Wait for messages from the microcontroller, then return every message that has arrived since the previous read, oldest first.
+        Each message is a text line, or a whole frame (bytes) if the binary protocol is used"""
         pass
 
+    async def readbuffer(self) -> str|bytes:
+        """Wait for messages from the microcontroller and return only the newest one"""
+        return (await self.readbatch())[-1].message
+
     @abstractmethod
-    def write(self,command: WriteCommand):
+    def write(self,command: WriteCommand,priority: WritePriority = WritePriority.NORMAL):
         pass
 
+    def write_batch(self,commands: list[WriteCommand],priority: WritePriority = WritePriority.NORMAL):
+        """Queue several commands at once. Interfaces that support batching send them together in as few writes as possible"""
+        for command in commands:
+            self.write(command,priority)
+
+    def stop_all(self):
+        """Stop every pump, ahead of any queued commands: with one broadcast command if the microcontroller understands it (broadcast_stop), otherwise with a stop for each pump in the same write"""
+        if self._broadcast_stop:
+            self.write(WriteCommand(BROADCAST_PUMP,0),WritePriority.EMERGENCY)
+        else:
+            self.write_batch([WriteCommand(pmp.value,0) for pmp in PumpConfig().pumps],WritePriority.EMERGENCY)
+
     @staticmethod
     def get_serial_ports(debug: bool = False):
         COM_ports = serial.tools.list_ports.comports()
@@ -72,10 +141,26 @@ class GenericInterface(ABC):
     def format_duty(ident: str, duty: int) -> str:
         return f"<{ident},{duty}>"
     @staticmethod
+    def format_duties(commands: list[WriteCommand]) -> str:
+        return "".join(GenericInterface.format_duty(command.pump,command.duty) for command in commands)
+    @staticmethod
     def unformat_duty(str_in: str) -> tuple[str,int]:
         items = str_in.removeprefix("<").removesuffix(">").split(",")
         return (items[0],int(items[1]))
     @staticmethod
+    def unformat_duties(str_in: str) -> list[tuple[str,int]]:
+        return [GenericInterface.unformat_duty(command) for command in str_in.replace("<","").split(">") if command != ""]
+    @staticmethod
+    def format_ack(ident: str, duty: int) -> str:
+        return f"{ACK_PREFIX}{ident},{duty}"
+    @staticmethod
+    def is_ack(str_in: str) -> bool:
+        return str_in.startswith(ACK_PREFIX)
+    @staticmethod
+    def unformat_ack(str_in: str) -> tuple[str,int]:
+        items = str_in.removeprefix(ACK_PREFIX).split(",")
+        return (items[0],int(items[1]))
+    @staticmethod
     def unformat_speeds(str_in: str) -> list[tuple[str,float]]:
         # TODO: The logic for interpreting the serial speed readings is in async_serialreader, but it likely should be handled by the serial interface
         # In this way, the formatting protocols for writing and reading from the microcontroller are solely handled by GenericInterface
@@ -0,0 +1,300 @@
+from typing import Callable
+from .GenericInterface import GenericInterface, InterfaceException, WriteCommand, WritePriority, TimestampedMessage, BROADCAST_PUMP
+from .framing import BinaryFramer
+from .protocols import SerialProtocol, TextProtocol, BinaryProtocol
+from .scheduling import WriteScheduler, AckTracker
+from .buffers import MessageRing, OverwritingQueue, ConfirmationQueue
+from .interlock import Interlock, InterlockRule, InterlockTrip
+from .SerialInterface import SERIAL_WRITE_PAUSE, _SERIAL_OUTPUT_QUEUE_MAX_SIZE, _FALLBACK_POLL_PERIOD, _SelectorWaker, _ThreadsafeAsyncEvent, _selectable_fileno, _select_timeout, _interlock_timeout, read_loop, write_loop
+from support_classes import SharedState, Timer, PumpConfig
+from serial import Serial
+import asyncio
+import threading
+import selectors
+import time
+
+class _RenamedOutput:
+    """Stands in for the write output queue of a single port: confirmed commands are renamed from the port's pump names to the unified pump names before they are reported"""
+
+    def __init__(self, output_queue: OverwritingQueue[WriteCommand], global_names: dict[str,str]) -> None:
+        self.__output_queue = output_queue
+        self.__global_names = global_names
+
+    def put(self, command: WriteCommand):
+        if command.pump == BROADCAST_PUMP:
+            # a broadcast only reaches the pumps of this port
+            for name in self.__global_names.values():
+                self.__output_queue.put(WriteCommand(name,command.duty))
+            return
+        self.__output_queue.put(WriteCommand(self.__global_names[command.pump],command.duty))
+
+class _PortChannel:
+    """Everything the I/O thread keeps for one port. Each microcontroller names its own pumps a, b, c..., which are mapped onto a slice of the unified pump names"""
+
+    def __init__(self, serial_initialiser: Callable[[],Serial], first_pump: int, num_pumps: int, write_output_queue: OverwritingQueue[WriteCommand], batch_writes: bool, acknowledge_writes: bool, binary_protocol: bool) -> None:
+        self.serial_initialiser = serial_initialiser
+        self.serial_inst: Serial|None = None
+        self.fd: int|None = None
+        self.first_pump = first_pump
+        self.num_pumps = num_pumps
+        local_names = PumpConfig.allowable_values[:num_pumps]
+        global_names = PumpConfig.allowable_values[first_pump:first_pump+num_pumps]
+        self.local_names = dict(zip(global_names,local_names))
+        self.batch_writes = batch_writes
+        self.write_scheduler = WriteScheduler()
+        self.write_output = _RenamedOutput(write_output_queue,dict(zip(local_names,global_names)))
+        self.write_timer = Timer(SERIAL_WRITE_PAUSE)
+        self.ack_tracker = AckTracker() if acknowledge_writes else None
+        self.protocol: SerialProtocol = BinaryProtocol() if binary_protocol else TextProtocol()
+        self.framer = self.protocol.new_framer()
+        self.messages = MessageRing(1) # only the newest report of this port is merged
+        self.speeds = [0]*num_pumps
+
+    def read(self):
+        read_loop(self.serial_inst,self.messages,self.framer,self.ack_tracker,self.write_output,self.protocol)
+
+    def write(self):
+        write_loop(self.serial_inst,self.write_scheduler,self.write_output,self.write_timer,self.batch_writes,self.ack_tracker,self.protocol)
+
+    def select_timeout(self) -> float:
+        return _select_timeout(self.fd,self.write_scheduler,self.write_timer,self.ack_tracker)
+
+class MultiSerialInterface(GenericInterface):
+    """Drives several microcontrollers, each on its own serial port, from a single I/O thread, and presents them as one interface with a unified pump namespace.
+    Pumps are numbered across the ports in order: with two controllers of 4 and 3 pumps, pumps a-d are pumps a-d of the first port and pumps e-g are pumps a-c of the second.
+    Commands are routed to the port that owns the pump. Whenever a port reports its speeds, a merged report with the latest speeds of every port is passed on, in the format of a single microcontroller with all the pumps.
+    All ports share the same protocol settings."""
+
+    def __init__(self,ports: list[str],pump_counts: list[int],baudrate: int = 9600,batch_writes: bool = False,acknowledge_writes: bool = False,binary_protocol: bool = False,**kwargs) -> None:
+        super().__init__(",".join(ports),baudrate=baudrate,**kwargs)
+        if len(ports) != len(pump_counts) or len(ports) == 0:
+            raise InterfaceException("Every port needs a pump count")
+        if len(set(ports)) != len(ports):
+            raise InterfaceException("A port can only be used once")
+        if min(pump_counts) < 1 or sum(pump_counts) > PumpConfig.max_pumps:
+            raise InterfaceException(f"There must be between 1 and {PumpConfig.max_pumps} pumps in total")
+        self.__ports = tuple(ports)
+        self.__pump_counts = tuple(pump_counts)
+        self.__baudrate = baudrate
+        self._thread_alive = _ThreadsafeAsyncEvent()
+        self._thread_error = SharedState[BaseException|None](None)
+        self._data_available = _ThreadsafeAsyncEvent()
+
+        self._read_queue = MessageRing() # merged speed reports of all ports
+        self._write_output_queue = ConfirmationQueue(_SERIAL_OUTPUT_QUEUE_MAX_SIZE) # commands that have been sent (or applied), named with the unified pump names
+        self._channels: list[_PortChannel] = []
+        first_pump = 0
+        for i, num_pumps in enumerate(pump_counts):
+            self._channels.append(_PortChannel(lambda i=i: self._serial_initialiser(i),first_pump,num_pumps,self._write_output_queue,batch_writes,acknowledge_writes,binary_protocol))
+            first_pump += num_pumps
+        # unified pump name -> channel that drives it
+        self._pump_channels = {name:channel for channel in self._channels for name in channel.local_names}
+        # the merged reports are re-encoded, so that they are read exactly like those of a single microcontroller
+        merge_protocol = BinaryProtocol() if binary_protocol else TextProtocol()
+        merge_framer = merge_protocol.new_framer()
+        self._merge = lambda speeds: merge_framer.feed(merge_protocol.encode_speeds(speeds))[-1]
+        # the interlock works on the merged speeds and the unified pump names
+        self._interlock = Interlock()
+
+        self._waker = _SelectorWaker()
+        self._thread = threading.Thread(target = multi_serial_loop, args = (self._channels,self._read_queue,self._merge,self._thread_alive,self._thread_error,self._data_available,self._waker,self._interlock,self._write_output_queue))
+        available_ports = GenericInterface.get_serial_ports()[0]
+        for port in ports:
+            if port not in available_ports:
+                raise InterfaceException(f"""Port "{port}" could not be found""")
+
+    @property
+    def port(self):
+        return ",".join(self.__ports)
+
+    @property
+    def ports(self) -> tuple[str,...]:
+        return self.__ports
+
+    @property
+    def pump_counts(self) -> tuple[int,...]:
+        return self.__pump_counts
+
+    @property
+    def baudrate(self):
+        return self.__baudrate
+
+    @property
+    def written_duties(self):
+        return self._write_output_queue
+
+    def applied_duties(self) -> dict[str,int]:
+        return self._write_output_queue.latest_duties()
+
+    def set_interlock_rules(self, rules: list[InterlockRule]):
+        self._interlock.set_rules(rules)
+        self._waker.wake()
+
+    @property
+    def interlock_trips(self) -> OverwritingQueue[InterlockTrip]:
+        return self._interlock.trips
+
+    @property
+    def coalesced_writes(self) -> int:
+        """Number of queued commands that were superseded by a newer command for the same pump before they could be sent"""
+        return sum(channel.write_scheduler.coalesced_count for channel in self._channels)
+
+    @property
+    def dropped_messages(self) -> int:
+        """Number of merged reports that were overwritten before they were read"""
+        return self._read_queue.dropped_count
+
+    @property
+    def unacknowledged_writes(self) -> int:
+        """Number of sent commands that a microcontroller never acknowledged. Always zero if writes are not acknowledged"""
+        return sum(channel.ack_tracker.unacknowledged_count for channel in self._channels if channel.ack_tracker is not None)
+
+    @property
+    def rejected_frames(self) -> int:
+        """Number of received binary frames that were thrown away because their CRC did not match. Always zero for the text protocol"""
+        return sum(channel.framer.rejected_frames for channel in self._channels if isinstance(channel.framer,BinaryFramer))
+
+    def _serial_initialiser(self, index: int) -> Serial:
+        return Serial(self.__ports[index],baudrate=self.baudrate)
+
+    async def establish(self):
+        event_loop = asyncio.get_event_loop()
+        self._thread_alive.set_loop(event_loop)
+        self._data_available.set_loop(event_loop)
+
+        if not self._thread_alive.is_set():
+            self._thread.start()
+            try:
+                successful_start = await asyncio.wait_for(self._thread_alive.async_event.wait(),4.0)
+            except TimeoutError:
+                successful_start = False
+            err = self._thread_error.get_value()
+            if not successful_start:
+                self._thread_alive.clear()
+                self._thread.join()
+                if err is not None:
+                    raise InterfaceException(f"""Could not connect to ports "{self.port}": {err}""")
+                raise InterfaceException(f"""Could not connect to ports "{self.port}".""")
+            elif err is not None:
+                self._thread.join()
+                raise err
+
+    def close(self):
+        if self._thread_alive.is_set():
+            self._thread_alive.clear()
+            self._waker.wake()
+            self._thread.join()
+
+    async def readbatch(self) -> list[TimestampedMessage]:
+        while True:
+            if not self._thread_alive.is_set():
+                err = self._thread_error.get_value()
+                raise (InterfaceException("Interface not established") if err is None else err)
+            self._data_available.clear()
+            messages = self._read_queue.drain()
+            if len(messages) > 0:
+                return messages
+            await self._data_available.async_event.wait()
+
+    def write(self,command: WriteCommand,priority: WritePriority = WritePriority.NORMAL):
+        self.write_batch([command],priority)
+
+    def write_batch(self,commands: list[WriteCommand],priority: WritePriority = WritePriority.NORMAL):
+        if not self._thread_alive.is_set():
+            err = self._thread_error.get_value()
+            raise (InterfaceException("Interface not established") if err is None else err)
+        routed: dict[int,tuple[_PortChannel,list[WriteCommand]]] = {}
+        for command in commands:
+            if command.pump == BROADCAST_PUMP:
+                # every microcontroller understands the broadcast name, so each port is sent its own copy
+                for channel in self._channels:
+                    routed.setdefault(id(channel),(channel,[]))[1].append(command)
+                continue
+            channel = self._pump_channels.get(command.pump)
+            if channel is None:
+                raise InterfaceException(f"Pump {command.pump} is not connected to any port")
+            routed.setdefault(id(channel),(channel,[]))[1].append(WriteCommand(channel.local_names[command.pump],command.duty))
+        # each port receives its share of the batch atomically, so in batch mode it is sent in one write
+        for channel, port_commands in routed.values():
+            channel.write_scheduler.put_many(port_commands,priority)
+        self._waker.wake()
+
+def multi_serial_loop(channels: list[_PortChannel], read_queue: MessageRing, merge: Callable[[list[int]],str|bytes], alive_event: _ThreadsafeAsyncEvent, error_state: SharedState[BaseException|None], data_event: _ThreadsafeAsyncEvent, waker: _SelectorWaker, interlock: Interlock|None = None, write_output_queue: ConfirmationQueue|None = None):
+    # as serial_loop, but every port is serviced in each pass, and the selector wakes when any of them has data
+    selector = selectors.DefaultSelector()
+    try:
+        selector.register(waker,selectors.EVENT_READ)
+        for channel in channels:
+            channel.serial_inst = channel.serial_initialiser()
+            channel.fd = _selectable_fileno(channel.serial_inst)
+            if channel.fd is not None:
+                selector.register(channel.fd,selectors.EVENT_READ)
+        alive_event.set()
+        while alive_event.is_set():
+            for channel in channels:
+                channel.read()
+                _merge_reports(channel,channels,read_queue,merge,interlock)
+            _enforce_interlock(channels,interlock,write_output_queue)
+            for channel in channels:
+                channel.write()
+            if not read_queue.empty():
+                data_event.set()
+            selector.select(_interlock_timeout(interlock,min(channel.select_timeout() for channel in channels)))
+            waker.clear()
+    except BaseException as e:
+        error_state.set_value(e)
+    finally:
+        alive_event.clear()
+        selector.close()
+        waker.close()
+        open_channels = [channel for channel in channels if channel.serial_inst is not None]
+        try:
+            _flush_channels(open_channels)
+        finally:
+            for channel in open_channels:
+                channel.serial_inst.close()
+
+def _merge_reports(channel: _PortChannel, channels: list[_PortChannel], read_queue: MessageRing, merge: Callable[[list[int]],str|bytes], interlock: Interlock|None = None):
+    for message in channel.messages.drain():
+        try:
+            speeds = channel.protocol.decode_speeds(message.message)
+        except ValueError:
+            continue
+        # a short report leaves the remaining pumps at zero, as it would for a single microcontroller
+        channel.speeds = (speeds+[0]*channel.num_pumps)[:channel.num_pumps]
+        merged = [speed for port in channels for speed in port.speeds]
+        if interlock is not None and interlock.enabled:
+            interlock.report_speeds(merged,message.timestamp)
+        read_queue.put(merge(merged),message.timestamp)
+
+def _enforce_interlock(channels: list[_PortChannel], interlock: Interlock|None, write_output_queue: ConfirmationQueue|None):
+    """As enforce_interlock, with each stop sent straight to the port that drives the pump"""
+    if interlock is None or not interlock.enabled or write_output_queue is None:
+        return
+    now = time.monotonic()
+    interlock.update_duties(write_output_queue.latest_duties(),now)
+    stops = interlock.evaluate(now)
+    for channel in channels:
+        local_stops = [WriteCommand(channel.local_names[command.pump],0) for command in stops if command.pump in channel.local_names]
+        if len(local_stops) == 0:
+            continue
+        stopped = [command.pump for command in local_stops]
+        channel.write_scheduler.discard(stopped)
+        if channel.ack_tracker is not None:
+            channel.ack_tracker.discard(stopped)
+        channel.serial_inst.write(channel.protocol.encode_duties(local_stops))
+        for command in local_stops:
+            channel.write_output.put(command)
+
+def _flush_channels(channels: list[_PortChannel]):
+    """Runs once the thread is ready to stop: sends the remaining commands of every port, with the ports waiting out their write pauses side by side"""
+    while True:
+        pending = [channel for channel in channels if not channel.write_scheduler.empty()]
+        if len(pending) == 0:
+            return
+        for channel in pending:
+            channel.write()
+            if channel.ack_tracker is not None:
+                # keep reading so that acknowledgements can release the remaining writes
+                channel.read()
+        time.sleep(min(_FALLBACK_POLL_PERIOD if channel.ack_tracker is not None else channel.write_timer.remaining() for channel in pending))
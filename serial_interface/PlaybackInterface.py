@@ -0,0 +1,142 @@
+from typing import Iterator
+from pathlib import Path
+from .GenericInterface import GenericInterface, InterfaceException, WriteCommand, WritePriority, TimestampedMessage
+from .protocols import SerialProtocol, TextProtocol, BinaryProtocol
+from .framing import LineFramer, BinaryFramer
+from .buffers import ConfirmationQueue, OverwritingQueue, MESSAGE_RING_CAPACITY
+from .interlock import Interlock, InterlockRule, InterlockTrip
+from .capture import CaptureReader, CaptureRecord, CaptureDirection
+from .capabilities import is_banner
+from .SerialInterface import _SERIAL_OUTPUT_QUEUE_MAX_SIZE
+import asyncio
+import time
+
+class PlaybackInterface(GenericInterface):
+    """Plays back a capture recorded by SerialInterface (see capture_path) as if the microcontroller were connected, at speed times real time, or as fast as possible if speed is None.
+    Played as fast as possible, every recorded read is handed over as a batch of its own, as if the reader had been waiting for it.
+    Timestamps are moved onto this machine's time.monotonic() clock as if the recording had started when playback did, so everything downstream (e.g. speed statistics) sees the recorded timing however fast the capture is played.
+    The recorded commands are confirmed on written_duties as they were on the recorded link. Commands written to the interface go nowhere, and interlock stops are confirmed but cannot change the recorded speeds.
+    Once the capture runs out, readbatch raises InterfaceException, which ends SerialReader as a lost connection would."""
+
+    def __init__(self, capture_path: Path|str, speed: float|None = 1.0, **kwargs) -> None:
+        super().__init__(str(capture_path),**kwargs)
+        if speed is not None and speed <= 0:
+            raise InterfaceException("Playback speed must be positive")
+        self.__capture_path = capture_path
+        self.__speed = speed
+        self.__capture: CaptureReader|None = None
+        self.__records: Iterator[CaptureRecord]|None = None
+        self.__next_record: CaptureRecord|None = None
+        self.__protocol: SerialProtocol = TextProtocol()
+        self.__framer: LineFramer|BinaryFramer = self.__protocol.new_framer()
+        self.__start = 0.0
+        self.__offset: float|None = None
+        self._write_output_queue = ConfirmationQueue(_SERIAL_OUTPUT_QUEUE_MAX_SIZE)
+        self._interlock = Interlock()
+
+    @property
+    def port(self):
+        return str(self.__capture_path)
+
+    @property
+    def written_duties(self):
+        return self._write_output_queue
+
+    def applied_duties(self) -> dict[str,int]:
+        return self._write_output_queue.latest_duties()
+
+    def set_interlock_rules(self, rules: list[InterlockRule]):
+        self._interlock.set_rules(rules)
+
+    @property
+    def interlock_trips(self) -> OverwritingQueue[InterlockTrip]:
+        return self._interlock.trips
+
+    async def establish(self):
+        if self.__capture is not None:
+            return
+        try:
+            self.__capture = CaptureReader(self.__capture_path)
+        except (OSError, ValueError) as e:
+            raise InterfaceException(f"Could not open capture: {e}")
+        self.__protocol = BinaryProtocol() if self.__capture.binary_protocol else TextProtocol()
+        self.__framer = self.__protocol.new_framer()
+        self.__records = iter(self.__capture)
+        self.__start = time.monotonic()
+
+    def close(self):
+        if self.__capture is not None:
+            self.__capture.close()
+            self.__records = iter(())
+
+    async def readbatch(self) -> list[TimestampedMessage]:
+        if self.__records is None:
+            raise InterfaceException("Interface not established")
+        messages: list[TimestampedMessage] = []
+        while len(messages) < MESSAGE_RING_CAPACITY:
+            record = self.__peek()
+            if record is None:
+                break
+            if self.__offset is None:
+                self.__offset = self.__start - record.timestamp
+            timestamp = record.timestamp + self.__offset
+            if self.__speed is not None:
+                wait = self.__start + (timestamp - self.__start)/self.__speed - time.monotonic()
+                if wait > 0:
+                    if len(messages) > 0:
+                        # hand over what is due now, rather than holding it back until the next record
+                        break
+                    await asyncio.sleep(wait)
+            self.__next_record = None
+            messages += self.__play(record,timestamp)
+            if self.__speed is None and len(messages) > 0:
+                # as if the reader had been waiting for every chunk, so that the readings do not depend on how fast the capture is played
+                break
+        if len(messages) == 0:
+            raise InterfaceException(f"""Reached the end of capture "{self.port}".""")
+        if self.__speed is None:
+            # as fast as possible still lets the rest of the event loop run between batches
+            await asyncio.sleep(0)
+        return messages
+
+    def __peek(self) -> CaptureRecord|None:
+        if self.__next_record is None:
+            self.__next_record = next(self.__records,None)
+        return self.__next_record
+
+    def __play(self, record: CaptureRecord, timestamp: float) -> list[TimestampedMessage]:
+        """Messages completed by a recorded chunk. Commands and acknowledgements are confirmed on written_duties as they were on the recorded link"""
+        if record.direction == CaptureDirection.SENT:
+            if not self.__capture.acknowledge_writes:
+                try:
+                    commands = self.__protocol.decode_duties(record.data)
+                except (ValueError, IndexError):
+                    commands = []
+                for pump, duty in commands:
+                    self._write_output_queue.put(WriteCommand(pump,duty))
+            return []
+        messages: list[TimestampedMessage] = []
+        for message in self.__framer.feed(record.data):
+            if self.__protocol.is_ack(message):
+                try:
+                    self._write_output_queue.put(WriteCommand(*self.__protocol.decode_ack(message)))
+                except ValueError:
+                    pass
+                continue
+            if is_banner(message):
+                continue
+            self._interlock.report(message,self.__protocol,timestamp)
+            messages.append(TimestampedMessage(timestamp,message))
+        if self._interlock.enabled:
+            self._interlock.update_duties(self._write_output_queue.latest_duties(),timestamp)
+            for command in self._interlock.evaluate(timestamp):
+                self._write_output_queue.put(command)
+        return messages
+
+    def write(self,command: WriteCommand,priority: WritePriority = WritePriority.NORMAL):
+        self.write_batch([command],priority)
+
+    def write_batch(self,commands: list[WriteCommand],priority: WritePriority = WritePriority.NORMAL):
+        # the recorded microcontroller cannot be driven, so commands are accepted and dropped
+        if self.__records is None:
+            raise InterfaceException("Interface not established")
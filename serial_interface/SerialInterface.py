@@ -1,17 +1,65 @@
 from typing import Callable
-from .GenericInterface import GenericInterface, InterfaceException, WriteCommand
+from .GenericInterface import GenericInterface, InterfaceException, WriteCommand, WritePriority, TimestampedMessage
+from .framing import LineFramer, BinaryFramer
+from .protocols import SerialProtocol, TextProtocol, BinaryProtocol
+from .scheduling import WriteScheduler, AckTracker
+from .buffers import MessageRing, OverwritingQueue, ConfirmationQueue
+from .interlock import Interlock, InterlockRule, InterlockTrip
+from .reconnect import PortLocator, Reconnector
+from .capture import CaptureWriter, RecordingSerial
+from .broker import SerialBroker
+from .capabilities import FirmwareCapabilities, request_capabilities, is_banner
+from pathlib import Path
 from serial import Serial
 import asyncio
 import threading
-import queue
 from support_classes import SharedState, Timer
+from serial import SerialException
+import selectors
+import socket
 import time
+import os
 
 SERIAL_WRITE_PAUSE = 2 #TODO make this a hidden setting
-"""Seconds until a subsequent write command is sent. Allows the microcontroller some processing time"""
+"""Seconds until a subsequent write command is sent. Allows the microcontroller some processing time.
+When writes are acknowledged, this is instead the longest wait for an acknowledgement, after which the microcontroller is assumed not to send them"""
 
 _SERIAL_OUTPUT_QUEUE_MAX_SIZE = 16
 
+_IDLE_SELECT_TIMEOUT = 1.0
+"""Longest time in seconds that the serial thread blocks when it has nothing to do. Writes and closing the interface wake the thread immediately, so this is only a safety net"""
+_FALLBACK_POLL_PERIOD = 0.01
+"""Polling period in seconds for serial objects that cannot be waited on with a selector (Windows COM ports, mocked ports)"""
+
+class _SelectorWaker:
+    """A connected socket pair used to wake the serial thread's selector from another thread. Sockets are used instead of a pipe because select() on Windows only supports sockets."""
+
+    def __init__(self):
+        self.__recv_sock, self.__send_sock = socket.socketpair()
+        self.__recv_sock.setblocking(False)
+        self.__send_sock.setblocking(False)
+
+    def fileno(self) -> int:
+        return self.__recv_sock.fileno()
+
+    def wake(self):
+        try:
+            self.__send_sock.send(b"\0")
+        except OSError:
+            # the socket buffer is full (a wake-up is already pending) or the waker has been closed
+            pass
+
+    def clear(self):
+        try:
+            while self.__recv_sock.recv(4096):
+                pass
+        except OSError:
+            pass
+
+    def close(self):
+        self.__recv_sock.close()
+        self.__send_sock.close()
+
 class _ThreadsafeAsyncEvent(threading.Event):
     """An equivalent of *threading.Event*, but also including an *asyncio.Event* property that is updated alongside. Allows for event loops to await the event in a threadsafe manner."""
 
@@ -24,46 +72,133 @@ class _ThreadsafeAsyncEvent(threading.Event):
         self.__loop = loop
 
     def set(self):
-        if self.__loop and self.__loop.is_running():
+        # set the threading flag first, so that a coroutine woken by the async event always sees is_set() == True
+        super().set()
+        if self.__on_loop():
+            self.async_event.set()
+        elif self.__loop and self.__loop.is_running():
             self.__loop.call_soon_threadsafe(self.async_event.set)
-        return super().set()
     
     def clear(self):
-        if self.__loop and self.__loop.is_running():
+        super().clear()
+        # on the loop's own thread, the async event is cleared straight away, so that a coroutine that clears and then waits does not see the stale flag
+        if self.__on_loop():
+            self.async_event.clear()
+        elif self.__loop and self.__loop.is_running():
             self.__loop.call_soon_threadsafe(self.async_event.clear)
-        return super().clear()
+
+    def __on_loop(self) -> bool:
+        try:
+            return self.__loop is not None and asyncio.get_running_loop() is self.__loop
+        except RuntimeError:
+            return False
 
 class SerialInterface(GenericInterface):
 
-    def __init__(self,port: str,baudrate: int = 9600,**kwargs) -> None:
+    def __init__(self,port: str,baudrate: int = 9600,batch_writes: bool = False,acknowledge_writes: bool = False,binary_protocol: bool = False,reconnect: bool = True,capture_path: Path|str|None = None,broker_path: Path|str|None = None,negotiate: bool = True,**kwargs) -> None:
         super().__init__(port,baudrate=baudrate,**kwargs)
         self._thread_alive = _ThreadsafeAsyncEvent()
         self._thread_error = SharedState[BaseException|None](None)
-        self.__port = port
+        self._port_locator = PortLocator(port) # follows the device if it comes back under another name
+        self.__baudrate = baudrate
+        self.__batch_writes = batch_writes
+        self.__negotiate = negotiate
 
-        # threadsafe awaitable flag to signal when new data is on the read queue
+        # threadsafe awaitable flag to signal when new data is in the read ring
         self._data_available = _ThreadsafeAsyncEvent()        
         
-        self._read_queue = queue.Queue(1)
-        self._write_input_queue = queue.Queue[WriteCommand]() # This is the queue of commands *waiting to* be sent over serial
-        self._write_output_queue = queue.Queue[WriteCommand](_SERIAL_OUTPUT_QUEUE_MAX_SIZE) # This queue communicates which command *have* been sent over serial
+        self._read_queue = MessageRing() # timestamped messages that have arrived but not been read yet
+        self._write_scheduler = WriteScheduler() # This holds the commands *waiting to* be sent over serial, at most one per pump and priority
+        self._write_output_queue = ConfirmationQueue(_SERIAL_OUTPUT_QUEUE_MAX_SIZE) # This queue communicates which command *have* been sent over serial (or, when writes are acknowledged, applied by the microcontroller)
+        self._ack_tracker = AckTracker() if acknowledge_writes else None # holds sent commands until the microcontroller confirms them
+        self._protocol: SerialProtocol = BinaryProtocol() if binary_protocol else TextProtocol()
+        self._framer = self._protocol.new_framer()
+        self._interlock = Interlock() # safety rules checked by the serial thread as reports arrive
+        # every byte read or written is recorded to capture_path, if given (see capture.py and PlaybackInterface)
+        self.__capture_path = capture_path
+        self._capture: CaptureWriter|None = None
+        # if the port fails once established, the serial thread reopens it instead of failing the interface
+        self._reconnector = Reconnector(self._open_port,self._port_locator,self.degraded) if reconnect else None
+        # other processes can share the port through a Unix-domain socket at broker_path, if given (see broker.py and BrokeredInterface)
+        self._broker = SerialBroker(broker_path,self.write_batch,self.applied_duties) if broker_path is not None else None
+        if self._broker is not None:
+            self._read_queue.tap = self._broker.publish_message
+            self._write_output_queue.tap = self._broker.publish_confirmation
+
+        # wakes the serial thread as soon as a command is queued or the interface is closed
+        self._waker = _SelectorWaker()
         
-        # the thread takes _serial_initialiser as an argument, rather than e.g. a port string, so that DummyInterface can simply override SerialInterface._serial_initialiser instead of having to rewrite the whole serial loop
-        self._thread = threading.Thread(target = serial_loop, args = (self._serial_initialiser,self._read_queue,self._write_input_queue,self._write_output_queue,self._thread_alive,self._thread_error,self._data_available))
+        self._thread = self._new_thread(self._open_port)
         port_desc = GenericInterface.get_serial_ports()
         if port not in port_desc[0]:
             raise InterfaceException(f"""Port "{self.port}" could not be found""")
 
     @property
     def port(self):
-        return self.__port #  make sure "port" property is read only to external classes
+        return self._port_locator.port #  make sure "port" property is read only to external classes
+
+    @property
+    def reconnections(self) -> int:
+        """Number of times the port was reopened after the connection was lost"""
+        return 0 if self._reconnector is None else self._reconnector.reconnect_count
+
+    @property
+    def baudrate(self):
+        return self.__baudrate
 
     @property
     def written_duties(self):
         return self._write_output_queue
+
+    def applied_duties(self) -> dict[str,int]:
+        return self._write_output_queue.latest_duties()
+
+    def set_interlock_rules(self, rules: list[InterlockRule]):
+        self._interlock.set_rules(rules)
+        self._waker.wake()
+
+    @property
+    def interlock_trips(self) -> OverwritingQueue[InterlockTrip]:
+        return self._interlock.trips
+
+    @property
+    def coalesced_writes(self) -> int:
+        """Number of queued commands that were superseded by a newer command for the same pump before they could be sent"""
+        return self._write_scheduler.coalesced_count
+
+    @property
+    def dropped_messages(self) -> int:
+        """Number of messages from the microcontroller that were overwritten before they were read"""
+        return self._read_queue.dropped_count
+
+    @property
+    def unacknowledged_writes(self) -> int:
+        """Number of sent commands that the microcontroller never acknowledged. Always zero if writes are not acknowledged"""
+        return 0 if self._ack_tracker is None else self._ack_tracker.unacknowledged_count
+
+    @property
+    def rejected_frames(self) -> int:
+        """Number of received binary frames that were thrown away because their CRC did not match. Always zero for the text protocol"""
+        return self._framer.rejected_frames if isinstance(self._framer,BinaryFramer) else 0
     
     def _serial_initialiser(self) -> Serial:
-        return Serial(self.port,baudrate=9600)
+        return Serial(self.port,baudrate=self.baudrate)
+
+    def _new_thread(self, serial_initialiser: Callable[[],Serial]) -> threading.Thread:
+        # the thread opens the port through _open_port, which calls _serial_initialiser, rather than taking e.g. a port string, so that DummyInterface can simply override SerialInterface._serial_initialiser instead of having to rewrite the whole serial loop
+        return threading.Thread(target = serial_loop, args = (serial_initialiser,self._read_queue,self._write_scheduler,self._write_output_queue,self._thread_alive,self._thread_error,self._data_available,self._waker,self.__batch_writes,self._ack_tracker,self._protocol,self._framer,self._interlock,self._reconnector,self._port_locator,self.capabilities is not None))
+
+    def _open_port(self) -> Serial:
+        """Open the port for the serial thread, wrapped so that its traffic is recorded if a capture was requested"""
+        return self._record(self._serial_initialiser())
+
+    def _record(self, serial_inst: Serial) -> Serial:
+        if self.__capture_path is None:
+            return serial_inst
+        if self._capture is None:
+            # one capture covers every reconnection
+            self._capture = CaptureWriter(self.__capture_path,isinstance(self._protocol,BinaryProtocol),self._ack_tracker is not None)
+        return RecordingSerial(serial_inst,self._capture)
 
     async def establish(self):
         # attach event loop to threadsafe events
@@ -72,6 +207,8 @@ class SerialInterface(GenericInterface):
         self._data_available.set_loop(event_loop)
 
         if not self._thread_alive.is_set():
+            if self.__negotiate and self.capabilities is None:
+                await self.__negotiate_capabilities(event_loop)
             self._thread.start()
             try:
                 successful_start = await asyncio.wait_for(self._thread_alive.async_event.wait(),4.0)
@@ -87,53 +224,214 @@ class SerialInterface(GenericInterface):
             elif err is not None:
                 self._thread.join()
                 raise err
+            if self._broker is not None:
+                try:
+                    self._broker.start()
+                except InterfaceException:
+                    self.close()
+                    raise
+
+    async def __negotiate_capabilities(self, event_loop: asyncio.AbstractEventLoop):
+        """Ask the firmware what it supports before the serial thread starts, and switch to the fastest mode it offers. Without an answer (older sketches), the options given to the interface are kept"""
+        try:
+            serial_inst = await event_loop.run_in_executor(None,self._serial_initialiser)
+        except (SerialException, OSError, ValueError):
+            errtxt = f"""Could not connect to port "{self.port}".""" if self.port in GenericInterface.get_serial_ports()[0] else f"""Port "{self.port}" could not be found"""
+            raise InterfaceException(errtxt)
+        try:
+            capabilities = await event_loop.run_in_executor(None,request_capabilities,serial_inst)
+        except (SerialException, OSError):
+            _close_quietly(serial_inst)
+            raise InterfaceException(f"""Could not connect to port "{self.port}".""")
+        if capabilities is not None:
+            self.__adopt(capabilities)
+        # the thread carries on with the port that is already open, rather than resetting the board again by reopening it
+        opened = [self._record(serial_inst)]
+        self._thread = self._new_thread(lambda: opened.pop() if len(opened) > 0 else self._open_port())
+
+    def __adopt(self, capabilities: FirmwareCapabilities):
+        self.capabilities = capabilities
+        self.__batch_writes = capabilities.batch_commands
+        self._broadcast_stop = capabilities.broadcast
+        if capabilities.acknowledge_commands != (self._ack_tracker is not None):
+            self._ack_tracker = AckTracker() if capabilities.acknowledge_commands else None
+        if capabilities.binary_protocol != isinstance(self._protocol,BinaryProtocol):
+            self._protocol = BinaryProtocol() if capabilities.binary_protocol else TextProtocol()
+            self._framer = self._protocol.new_framer()
 
     def close(self):
+        if self._broker is not None:
+            # clients stop sending commands before the thread that would send them stops
+            self._broker.close()
         if self._thread_alive.is_set():
             self._thread_alive.clear()
+            self._waker.wake()
             self._thread.join()
+        if self._capture is not None:
+            self._capture.close()
 
-    async def readbuffer(self) -> str:
-        if self._thread_alive.is_set():
-            await self._data_available.async_event.wait()
-            data = self._read_queue.get()
+    async def readbatch(self) -> list[TimestampedMessage]:
+        while True:
+            if not self._thread_alive.is_set():
+                err = self._thread_error.get_value()
+                raise (InterfaceException("Interface not established") if err is None else err)
+            # clear before draining, so that a message that arrives in between sets the flag again
             self._data_available.clear()
-            return data
-        else:
-            err = self._thread_error.get_value()
-            raise (InterfaceException("Interface not established") if err is None else err)
+            messages = self._read_queue.drain()
+            if len(messages) > 0:
+                return messages
+            await self._data_available.async_event.wait()
+
+    def write(self,command: WriteCommand,priority: WritePriority = WritePriority.NORMAL):
+        self.write_batch([command],priority)
 
-    def write(self,command: WriteCommand):
+    def write_batch(self,commands: list[WriteCommand],priority: WritePriority = WritePriority.NORMAL):
         if self._thread_alive.is_set():
-            self._write_input_queue.put(command)
+            # all commands are queued before the thread is woken, so in batch mode they are sent in the same write
+            self._write_scheduler.put_many(commands,priority)
+            self._waker.wake()
         else:
             err = self._thread_error.get_value()
             raise (InterfaceException("Interface not established") if err is None else err)
 
-def serial_loop(serial_initialiser: Callable[[],Serial], read_queue: queue.Queue[str], write_input_queue: queue.Queue[WriteCommand], write_output_queue: queue.Queue[WriteCommand], alive_event: _ThreadsafeAsyncEvent, error_state: SharedState[BaseException|None], data_event: _ThreadsafeAsyncEvent):
+def serial_loop(serial_initialiser: Callable[[],Serial], read_queue: MessageRing, write_scheduler: WriteScheduler, write_output_queue: OverwritingQueue[WriteCommand], alive_event: _ThreadsafeAsyncEvent, error_state: SharedState[BaseException|None], data_event: _ThreadsafeAsyncEvent, waker: _SelectorWaker, batch_writes: bool = False, ack_tracker: AckTracker|None = None, protocol: SerialProtocol|None = None, framer: LineFramer|BinaryFramer|None = None, interlock: Interlock|None = None, reconnector: Reconnector|None = None, port_locator: PortLocator|None = None, board_ready: bool = False):
     serial_inst = None
     write_timer = Timer(SERIAL_WRITE_PAUSE)
+    if board_ready:
+        # the board has already answered (see capabilities.py), so the first write need not wait for it to start up
+        write_timer.expire()
+    if protocol is None:
+        protocol = TextProtocol()
+    if framer is None:
+        framer = protocol.new_framer()
+    # The thread sleeps in the selector until the port has data, a command is queued or closed (via the waker), or the write pause elapses
+    selector = selectors.DefaultSelector()
     try:
         serial_inst = serial_initialiser()
+        if port_locator is not None:
+            # remembered while the device is known to be there, so that it can be found again if it comes back under another name
+            port_locator.remember()
+        selector.register(waker,selectors.EVENT_READ)
+        serial_fd = _selectable_fileno(serial_inst)
+        if serial_fd is not None:
+            selector.register(serial_fd,selectors.EVENT_READ)
         alive_event.set()
         while alive_event.is_set():
-            ## WRITE TO PORT FROM QUEUE
-            write_loop(serial_inst,write_input_queue,write_output_queue,write_timer)
-            ## READ FROM PORT TO QUEUE
-            read_loop(serial_inst,read_queue)
+            try:
+                ## READ FROM PORT TO QUEUE
+                # reading first means an acknowledgement that has just arrived releases the next write in the same pass
+                read_loop(serial_inst,read_queue,framer,ack_tracker,write_output_queue,protocol,interlock)
+                ## STOP ANY PUMPS THAT BREAK THE INTERLOCK, AHEAD OF EVERYTHING ELSE
+                enforce_interlock(serial_inst,interlock,write_scheduler,write_output_queue,ack_tracker,protocol)
+                ## WRITE TO PORT FROM QUEUE
+                write_loop(serial_inst,write_scheduler,write_output_queue,write_timer,batch_writes,ack_tracker,protocol)
+            except (SerialException, OSError):
+                if reconnector is None:
+                    raise
+                ## THE PORT HAS FAILED (E.G. A USB HICCUP): REOPEN IT WHILE THE INTERFACE STAYS ALIVE
+                # readers time out and writes are held in the scheduler meanwhile, so everything upstream keeps running
+                if serial_fd is not None:
+                    selector.unregister(serial_fd)
+                _close_quietly(serial_inst)
+                serial_inst = None
+                serial_inst = reconnector.reconnect(lambda seconds: _wait_unless_closed(selector,waker,alive_event,seconds))
+                if serial_inst is None:
+                    # closed while reconnecting
+                    break
+                serial_fd = _selectable_fileno(serial_inst)
+                if serial_fd is not None:
+                    selector.register(serial_fd,selectors.EVENT_READ)
+                resume_link(framer,write_scheduler,write_output_queue,write_timer,ack_tracker)
+                continue
             ## NOTIFY IF NEW DATA
             if not read_queue.empty():
                 data_event.set()
-            time.sleep(0.1)
+            ## WAIT FOR SOMETHING TO DO
+            selector.select(_interlock_timeout(interlock,_select_timeout(serial_fd,write_scheduler,write_timer,ack_tracker)))
+            waker.clear()
     except BaseException as e:
         error_state.set_value(e)
     finally:
         alive_event.clear()
-        flush_write_buffer(serial_inst,write_input_queue,write_output_queue,write_timer)
+        # wake any reader, so that it sees the interface has stopped (and why) without waiting for more data
+        data_event.set()
+        selector.close()
+        waker.close()
+        flush_write_buffer(serial_inst,read_queue,framer,write_scheduler,write_output_queue,write_timer,batch_writes,ack_tracker,protocol)
         if serial_inst is not None:
             serial_inst.close()
 
-def write_loop(serial_inst: Serial, write_queue: queue.Queue[WriteCommand], write_output_queue: queue.Queue[WriteCommand], write_timer: Timer):
+def _wait_unless_closed(selector: selectors.BaseSelector, waker: _SelectorWaker, alive_event: _ThreadsafeAsyncEvent, seconds: float) -> bool:
+    """Sleep in the selector for the given time, returning early (with False) if the interface is closed. Writes wake the selector too, but do not end the wait"""
+    deadline = time.monotonic() + seconds
+    while alive_event.is_set() and deadline > time.monotonic():
+        selector.select(deadline - time.monotonic())
+        waker.clear()
+    return alive_event.is_set()
+
+def _close_quietly(serial_inst: Serial):
+    try:
+        serial_inst.close()
+    except (SerialException, OSError):
+        pass
+
+def resume_link(framer: LineFramer|BinaryFramer, write_queue: WriteScheduler, write_output_queue: ConfirmationQueue, write_timer: Timer, ack_tracker: AckTracker|None = None):
+    """Prepare to use a port that has just been reopened. The microcontroller may have reset meanwhile, so every pump is sent its last commanded duty again"""
+    # a partial message from before the failure will never be completed
+    framer.reset()
+    duties = write_output_queue.latest_duties()
+    if ack_tracker is not None:
+        # commands that were sent but never confirmed may not have been applied
+        duties.update({command.pump:command.duty for command in ack_tracker.reset()})
+    # a pump that was given a newer command while the port was down keeps it
+    write_queue.restore([WriteCommand(pump,duty) for pump, duty in duties.items()],WritePriority.HIGH)
+    # opening the port resets most boards, so they are given the same time to start up as on the first connection
+    write_timer.reset()
+
+def _selectable_fileno(serial_inst: Serial) -> int|None:
+    """File descriptor of the serial port if it can be waited on with a selector, otherwise None"""
+    if os.name == "nt":
+        # select() on Windows does not support COM port handles
+        return None
+    try:
+        return serial_inst.fileno()
+    except (AttributeError, OSError, ValueError, SerialException):
+        return None
+
+def _select_timeout(serial_fd: int|None, write_queue: WriteScheduler, write_timer: Timer, ack_tracker: AckTracker|None = None) -> float:
+    timeout = _IDLE_SELECT_TIMEOUT
+    if ack_tracker is not None and ack_tracker.outstanding() > 0:
+        # the acknowledgement wakes the selector when it arrives, so only wake up early if it is overdue
+        timeout = write_timer.remaining()
+    elif not write_queue.empty():
+        # wake up as soon as the next write is allowed
+        timeout = write_timer.remaining() if ack_tracker is None else 0.0
+    if serial_fd is None:
+        # the port cannot signal incoming data, so it has to be polled
+        timeout = min(timeout,_FALLBACK_POLL_PERIOD)
+    return timeout
+
+def write_loop(serial_inst: Serial, write_queue: WriteScheduler, write_output_queue: OverwritingQueue[WriteCommand], write_timer: Timer, batch_writes: bool = False, ack_tracker: AckTracker|None = None, protocol: SerialProtocol|None = None):
+    if protocol is None:
+        protocol = TextProtocol()
+    emergency = write_queue.get_emergency()
+    if len(emergency) > 0:
+        # emergency commands pre-empt everything: they are sent without waiting for the pause between writes or for outstanding acknowledgements.
+        # Like interlock stops, they are reported as soon as they are written, and the commands they override are no longer waited on
+        write_timer.reset()
+        serial_inst.write(protocol.encode_duties(emergency))
+        if ack_tracker is not None:
+            ack_tracker.discard([command.pump for command in emergency])
+        for command in emergency:
+            write_output_queue.put(command)
+    if ack_tracker is not None and ack_tracker.outstanding() > 0:
+        if not write_timer.check():
+            # the microcontroller has not confirmed the previous write yet
+            return
+        # No acknowledgement within SERIAL_WRITE_PAUSE: the microcontroller does not send them (e.g. older firmware), so fall back to the fixed pause.
+        # The commands are reported as written, as they would have been without acknowledgements
+        for command in ack_tracker.expire():
+            write_output_queue.put(command)
     newwrite = write_queue.qsize()>0
     # only proceed if there are new commands AND the minimum period between writes is exceeded
     # Sometimes, the microcontroller may not be able to process a flood of write commands, so SERIAL_WRITE_PAUSE is used to implement a minimum time between writes.
@@ -152,40 +450,92 @@ def write_loop(serial_inst: Serial, write_queue: queue.Queue[WriteCommand], writ
     #     nextqueue = nextqueue.removeprefix(command)
     #     if get_first_command(nextqueue) != "":
     #         write_queue.put(nextqueue)
-    if newwrite and write_timer.check():
+    # when writes are acknowledged, an empty tracker means the previous write has been confirmed, so there is no need to wait
+    if newwrite and (ack_tracker is not None or write_timer.check()):
         write_timer.reset()
-        command = write_queue.get()
-        serial_inst.write(command.to_str().encode())
-        try:
-            write_output_queue.put(command, timeout=0.1)
-        except queue.Full:
-            # remove the oldest command so there is room for the new command
-            write_output_queue.get()
-            write_output_queue.put(command)
-        
+        # in batch mode, every pending command (up to the size of the microcontroller's receive buffer) is sent in one write
+        commands = write_queue.get_many(protocol.max_batch_size if batch_writes else 1)
+        serial_inst.write(protocol.encode_duties(commands))
+        if ack_tracker is not None:
+            # reported once the microcontroller confirms them
+            ack_tracker.expect(commands)
+        else:
+            for command in commands:
+                write_output_queue.put(command)
 
-def flush_write_buffer(serial_inst: Serial, write_queue: queue.Queue[WriteCommand], write_output_queue: queue.Queue[str], write_timer: Timer):
+def flush_write_buffer(serial_inst: Serial, read_queue: MessageRing, framer: LineFramer|BinaryFramer, write_queue: WriteScheduler, write_output_queue: OverwritingQueue[WriteCommand], write_timer: Timer, batch_writes: bool = False, ack_tracker: AckTracker|None = None, protocol: SerialProtocol|None = None):
     """This function runs once the thread is ready to stop. It is a simpler loop that only writes any remaining commands to the serial port"""
+    if serial_inst is None:
+        return
     while not write_queue.empty():
-        write_loop(serial_inst,write_queue,write_output_queue,write_timer)
-        time.sleep(0.1)
+        write_loop(serial_inst,write_queue,write_output_queue,write_timer,batch_writes,ack_tracker,protocol)
+        if ack_tracker is None:
+            time.sleep(write_timer.remaining())
+        else:
+            # keep reading so that acknowledgements can release the remaining writes
+            time.sleep(min(write_timer.remaining(),_FALLBACK_POLL_PERIOD))
+            read_loop(serial_inst,read_queue,framer,ack_tracker,write_output_queue,protocol)
     
     
 
-def read_loop(serial_inst: Serial, read_queue: queue.Queue[str]):
-    currentbytes = bytearray()
-    while serial_inst.in_waiting:
-        nextbyte = serial_inst.read()
-        if len(nextbyte) == 0:
-            break
-        elif nextbyte in (b"\n", b"\r"):
-            serial_inst.reset_input_buffer()
-            if read_queue.full():
-                read_queue.get()
-            read_queue.put(currentbytes.decode())
-            currentbytes = bytearray()
-        else:
-            currentbytes += nextbyte
+def read_loop(serial_inst: Serial, read_queue: MessageRing, framer: LineFramer|BinaryFramer, ack_tracker: AckTracker|None = None, write_output_queue: OverwritingQueue[WriteCommand]|None = None, protocol: SerialProtocol|None = None, interlock: Interlock|None = None):
+    if protocol is None:
+        protocol = TextProtocol()
+    # read everything that is buffered in one call. The framer keeps any partial line (or frame) until the rest of it arrives
+    n_waiting = serial_inst.in_waiting
+    if n_waiting > 0:
+        # every message completed by this read arrived no later than now
+        timestamp = time.monotonic()
+        for message in framer.feed(serial_inst.read(n_waiting)):
+            if protocol.is_ack(message):
+                # acknowledgements never reach the read queue, even if they are not being tracked, so they cannot be mistaken for speeds
+                _handle_ack(message,ack_tracker,write_output_queue,protocol)
+                continue
+            if is_banner(message):
+                # e.g. the board restarted after a reconnection
+                continue
+            if interlock is not None:
+                interlock.report(message,protocol,timestamp)
+            read_queue.put(message,timestamp)
+
+def enforce_interlock(serial_inst: Serial, interlock: Interlock|None, write_queue: WriteScheduler, write_output_queue: ConfirmationQueue, ack_tracker: AckTracker|None = None, protocol: SerialProtocol|None = None):
+    """Check the interlock rules, and send any stops they call for immediately: they bypass the write queue and the pause between writes"""
+    if interlock is None or not interlock.enabled:
+        return
+    if protocol is None:
+        protocol = TextProtocol()
+    now = time.monotonic()
+    interlock.update_duties(write_output_queue.latest_duties(),now)
+    stops = interlock.evaluate(now)
+    if len(stops) == 0:
+        return
+    stopped = [command.pump for command in stops]
+    # commands for these pumps that have not been sent or confirmed yet were decided before the trip, so they must not restart the pumps
+    write_queue.discard(stopped)
+    if ack_tracker is not None:
+        ack_tracker.discard(stopped)
+    serial_inst.write(protocol.encode_duties(stops))
+    for command in stops:
+        write_output_queue.put(command)
+
+def _interlock_timeout(interlock: Interlock|None, timeout: float) -> float:
+    """Shorten the selector timeout so that the thread wakes when an interlock rule could trip without new data (e.g. missing telemetry)"""
+    if interlock is None or not interlock.enabled:
+        return timeout
+    deadline = interlock.time_to_deadline(time.monotonic())
+    return timeout if deadline is None else min(timeout,deadline)
+
+def _handle_ack(message: str|bytes, ack_tracker: AckTracker|None, write_output_queue: OverwritingQueue[WriteCommand]|None, protocol: SerialProtocol):
+    if ack_tracker is None or write_output_queue is None:
+        return
+    try:
+        pump, duty = protocol.decode_ack(message)
+    except ValueError:
+        # corrupted acknowledgement: the command is released by the fallback timer instead
+        return
+    command = ack_tracker.acknowledge(pump,duty)
+    if command is not None:
+        write_output_queue.put(command)
 
 def get_first_command(comstr: str):
     outstr = ""
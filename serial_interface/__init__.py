@@ -1,3 +1,8 @@
-from .GenericInterface import GenericInterface, InterfaceException, DUMMY_DESCRIPTION, DUMMY_PORT, WriteCommand, SpeedReading
+from .GenericInterface import GenericInterface, InterfaceException, DUMMY_DESCRIPTION, DUMMY_PORT, WriteCommand, WritePriority, SpeedReading, TimestampedMessage
 from .SerialInterface import SerialInterface
-from .DummyInterface import DummyInterface
\ No newline at end of file
+from .AsyncSerialInterface import AsyncSerialInterface
+from .DummyInterface import DummyInterface, AsyncDummyInterface
+from .MultiSerialInterface import MultiSerialInterface
+from .PlaybackInterface import PlaybackInterface
+from .BrokeredInterface import BrokeredInterface
+from .interlock import InterlockRule, InterlockTrip, OverspeedRule, StallRule, TelemetryTimeoutRule
@@ -0,0 +1,293 @@
+from typing import Callable
+from collections import deque
+from enum import IntEnum
+from pathlib import Path
+from .GenericInterface import InterfaceException, WriteCommand, WritePriority, TimestampedMessage, BROADCAST_PUMP
+from support_classes import PumpConfig
+import selectors
+import socket
+import struct
+import threading
+import os
+
+# Every record exchanged between the broker and its clients is
+#   type (1 byte) | payload length (uint32) | payload
+# MESSAGE payload: timestamp (float64) | 1 if the message is a binary frame, 0 if it is a text line | message bytes
+# CONFIRMED payload: one command
+# COMMANDS payload: priority (1 byte) | one command after another
+# where a command is the pump name (1 ASCII byte) and the duty (uint16). Every number is little endian.
+_RECORD_HEADER = struct.Struct("<BI")
+_MESSAGE_HEADER = struct.Struct("<dB")
+_COMMAND = struct.Struct("<cH")
+_PRIORITY = struct.Struct("<B")
+_MAX_RECORD_SIZE = 1 << 16
+"""Longest record accepted from the other side. Anything longer can only come from a broken peer"""
+_CLIENT_BUFFER_LIMIT = 1 << 20
+"""Bytes queued for a client that is not reading, after which it is disconnected instead of being buffered for indefinitely"""
+_SEND_SIZE = 1 << 16
+_RECV_SIZE = 1 << 16
+
+def _check_client_command(command: WriteCommand):
+    """Raises ValueError unless the command is valid (see WriteCommand.validate) for one of the configured pumps, or for every pump"""
+    command.validate()
+    if command.pump == BROADCAST_PUMP:
+        return
+    try:
+        pumps = [pmp.value for pmp in PumpConfig().pumps]
+    except RuntimeError:
+        # the pump configuration has not been generated yet, so no pump is known
+        pumps = []
+    if command.pump not in pumps:
+        raise ValueError(f"Unknown pump {command.pump!r}")
+
+class RecordType(IntEnum):
+    MESSAGE = 0
+    """Broker to client: a speed report (or any other message) framed by the serial thread"""
+    CONFIRMED = 1
+    """Broker to client: a command that has been sent (or, when writes are acknowledged, applied)"""
+    COMMANDS = 2
+    """Client to broker: commands to queue on the interface with the given priority"""
+
+def encode_record(record_type: RecordType, payload: bytes) -> bytes:
+    return _RECORD_HEADER.pack(record_type,len(payload)) + payload
+
+def encode_message(message: TimestampedMessage) -> bytes:
+    data = message.message if isinstance(message.message,bytes) else message.message.encode()
+    return encode_record(RecordType.MESSAGE,_MESSAGE_HEADER.pack(message.timestamp,isinstance(message.message,bytes)) + data)
+
+def decode_message(payload: bytes) -> TimestampedMessage:
+    timestamp, binary = _MESSAGE_HEADER.unpack_from(payload)
+    data = payload[_MESSAGE_HEADER.size:]
+    return TimestampedMessage(timestamp,data if binary else data.decode(errors="replace"))
+
+def encode_commands(commands: list[WriteCommand], priority: WritePriority|None = None) -> bytes:
+    """COMMANDS record, or a CONFIRMED record for a single command if priority is None"""
+    body = b"".join(_COMMAND.pack(command.pump.encode("ascii")[:1],command.duty) for command in commands)
+    if priority is None:
+        return encode_record(RecordType.CONFIRMED,body)
+    return encode_record(RecordType.COMMANDS,_PRIORITY.pack(priority) + body)
+
+def decode_commands(payload: bytes) -> list[WriteCommand]:
+    if len(payload) % _COMMAND.size != 0:
+        raise ValueError(f"Command payload of {len(payload)} bytes is not a whole number of commands")
+    return [WriteCommand(pump.decode("ascii"),duty) for pump, duty in _COMMAND.iter_unpack(payload)]
+
+def split_records(buffer: bytearray) -> list[tuple[int,bytes]]:
+    """Remove and return every complete record at the front of buffer, leaving any partial record in place. Raises ValueError for a record that is too long to be genuine"""
+    records: list[tuple[int,bytes]] = []
+    offset = 0
+    while len(buffer) - offset >= _RECORD_HEADER.size:
+        record_type, length = _RECORD_HEADER.unpack_from(buffer,offset)
+        if length > _MAX_RECORD_SIZE:
+            raise ValueError(f"Record of {length} bytes is too long")
+        end = offset + _RECORD_HEADER.size + length
+        if end > len(buffer):
+            break
+        records.append((record_type,bytes(buffer[offset+_RECORD_HEADER.size:end])))
+        offset = end
+    del buffer[:offset]
+    return records
+
+class _BrokerClient:
+
+    def __init__(self, sock: socket.socket) -> None:
+        self.sock = sock
+        self.outbox: deque[bytes] = deque()
+        self.queued_bytes = 0
+        self.inbox = bytearray()
+
+    def queue(self, record: bytes) -> bool:
+        """Queue a record to send. Returns False if the client has fallen too far behind"""
+        self.outbox.append(record)
+        self.queued_bytes += len(record)
+        return self.queued_bytes <= _CLIENT_BUFFER_LIMIT
+
+class SerialBroker:
+    """Shares the port of a SerialInterface with other processes (see BrokeredInterface) over a Unix-domain socket.
+    The serial thread hands every message and confirmation to publish_message and publish_confirmation, which encode the record once and queue it, so the serial thread does the same work however many clients there are.
+    The broker's own thread then fans each record out to the clients, sharing the encoded bytes between them. A client that stops reading is disconnected rather than being buffered for.
+    Clients send commands, which are queued on the interface with their priority, so they are paced, coalesced and prioritised exactly like local commands."""
+
+    def __init__(self, path: Path|str, write_batch: Callable[[list[WriteCommand],WritePriority],None], applied_duties: Callable[[],dict[str,int]]) -> None:
+        if not hasattr(socket,"AF_UNIX"):
+            raise InterfaceException("Sharing the port needs Unix-domain sockets, which this platform does not support")
+        self.__path = str(path)
+        self.__write_batch = write_batch
+        self.__applied_duties = applied_duties
+        self.__published: deque[bytes] = deque() # appended by the serial thread, consumed by the broker thread
+        self.__running = threading.Event()
+        self.__thread: threading.Thread|None = None
+        self.__listener: socket.socket|None = None
+        self.__wake_recv, self.__wake_send = socket.socketpair()
+        self.__wake_recv.setblocking(False)
+        self.__wake_send.setblocking(False)
+        self.disconnected_clients = 0
+        """Number of clients dropped for falling behind (or sending garbage)"""
+
+    @property
+    def path(self) -> str:
+        return self.__path
+
+    def start(self):
+        listener = socket.socket(socket.AF_UNIX,socket.SOCK_STREAM)
+        try:
+            if os.path.exists(self.__path):
+                self.__remove_stale_socket()
+            listener.bind(self.__path)
+            listener.listen()
+            listener.setblocking(False)
+        except OSError as e:
+            listener.close()
+            raise InterfaceException(f"""Could not share the port at "{self.__path}": {e}""")
+        self.__listener = listener
+        self.__running.set()
+        self.__thread = threading.Thread(target=self.__run,daemon=True)
+        self.__thread.start()
+
+    def __remove_stale_socket(self):
+        probe = socket.socket(socket.AF_UNIX,socket.SOCK_STREAM)
+        try:
+            probe.connect(self.__path)
+        except OSError:
+            # nothing is listening, so the socket was left behind by a broker that did not shut down cleanly
+            os.unlink(self.__path)
+            return
+        finally:
+            probe.close()
+        raise InterfaceException(f"""Another broker is already sharing a port at "{self.__path}".""")
+
+    def close(self):
+        if not self.__running.is_set():
+            return
+        self.__running.clear()
+        self.__wake()
+        self.__thread.join()
+        self.__thread = None
+
+    def publish_message(self, message: TimestampedMessage):
+        if self.__running.is_set():
+            self.__published.append(encode_message(message))
+            self.__wake()
+
+    def publish_confirmation(self, command: WriteCommand):
+        if self.__running.is_set():
+            self.__published.append(encode_commands([command]))
+            self.__wake()
+
+    def __wake(self):
+        try:
+            self.__wake_send.send(b"\0")
+        except OSError:
+            # a wake-up is already pending
+            pass
+
+    def __run(self):
+        selector = selectors.DefaultSelector()
+        clients: dict[socket.socket,_BrokerClient] = {}
+        selector.register(self.__listener,selectors.EVENT_READ)
+        selector.register(self.__wake_recv,selectors.EVENT_READ)
+        try:
+            while self.__running.is_set():
+                for key, events in selector.select():
+                    if key.fileobj is self.__listener:
+                        self.__accept(selector,clients)
+                    elif key.fileobj is self.__wake_recv:
+                        try:
+                            while self.__wake_recv.recv(4096):
+                                pass
+                        except OSError:
+                            pass
+                    elif key.fileobj in clients:
+                        client = clients[key.fileobj]
+                        if events & selectors.EVENT_READ and not self.__receive(client):
+                            self.__drop(selector,clients,client)
+                # every record is queued for every client, sharing the same bytes object
+                while len(self.__published) > 0:
+                    record = self.__published.popleft()
+                    for client in list(clients.values()):
+                        if not client.queue(record):
+                            self.__drop(selector,clients,client,fell_behind=True)
+                for client in list(clients.values()):
+                    if not self.__send(client):
+                        self.__drop(selector,clients,client)
+                    elif client.sock in clients:
+                        selector.modify(client.sock,selectors.EVENT_READ | (selectors.EVENT_WRITE if client.queued_bytes > 0 else 0))
+        finally:
+            for client in list(clients.values()):
+                client.sock.close()
+            selector.close()
+            self.__listener.close()
+            self.__wake_recv.close()
+            self.__wake_send.close()
+            try:
+                os.unlink(self.__path)
+            except OSError:
+                pass
+
+    def __accept(self, selector: selectors.BaseSelector, clients: dict[socket.socket,_BrokerClient]):
+        try:
+            sock, _ = self.__listener.accept()
+        except OSError:
+            return
+        sock.setblocking(False)
+        client = _BrokerClient(sock)
+        clients[sock] = client
+        selector.register(sock,selectors.EVENT_READ)
+        # a new client starts from the current duties, rather than only seeing the ones that change after it connects
+        for pump, duty in self.__applied_duties().items():
+            client.queue(encode_commands([WriteCommand(pump,duty)]))
+
+    def __receive(self, client: _BrokerClient) -> bool:
+        try:
+            data = client.sock.recv(_RECV_SIZE)
+        except BlockingIOError:
+            return True
+        except OSError:
+            return False
+        if len(data) == 0:
+            return False
+        client.inbox += data
+        try:
+            for record_type, payload in split_records(client.inbox):
+                if record_type == RecordType.COMMANDS and len(payload) >= _PRIORITY.size:
+                    priority = WritePriority(_PRIORITY.unpack_from(payload)[0])
+                    commands = decode_commands(payload[_PRIORITY.size:])
+                    # a bad command would otherwise reach the serial thread (or the board) unchecked
+                    for command in commands:
+                        _check_client_command(command)
+                    self.__write_batch(commands,priority)
+        except (ValueError, UnicodeDecodeError):
+            return False
+        except InterfaceException:
+            # the interface is closing, and the client will find out when its connection closes
+            pass
+        return True
+
+    def __send(self, client: _BrokerClient) -> bool:
+        while client.queued_bytes > 0:
+            # send several records at a time, without copying more than one socket buffer's worth
+            chunk = []
+            size = 0
+            while len(client.outbox) > 0 and size < _SEND_SIZE:
+                chunk.append(client.outbox.popleft())
+                size += len(chunk[-1])
+            data = b"".join(chunk)
+            try:
+                sent = client.sock.send(data)
+            except BlockingIOError:
+                sent = 0
+            except OSError:
+                return False
+            client.queued_bytes -= sent
+            if sent < len(data):
+                client.outbox.appendleft(data[sent:])
+                return True
+        return True
+
+    def __drop(self, selector: selectors.BaseSelector, clients: dict[socket.socket,_BrokerClient], client: _BrokerClient, fell_behind: bool = False):
+        if clients.pop(client.sock,None) is None:
+            return
+        selector.unregister(client.sock)
+        client.sock.close()
+        if fell_behind:
+            self.disconnected_clients += 1
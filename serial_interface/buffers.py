@@ -0,0 +1,108 @@
+from .GenericInterface import TimestampedMessage, WriteCommand, BROADCAST_PUMP
+from support_classes import PumpConfig
+from collections import deque
+from typing import TypeVar, Generic, Callable
+import threading
+import queue
+
+MESSAGE_RING_CAPACITY = 256
+"""Messages held between reads. At 10 reports per second this is over 25 s of readings"""
+
+class MessageRing:
+    """Threadsafe bounded buffer of timestamped messages from the microcontroller.
+    The producer never blocks: when the ring is full the oldest message is overwritten and counted in dropped_count, so no message is lost without trace.
+    The consumer takes everything that has arrived in one call."""
+
+    def __init__(self, capacity: int = MESSAGE_RING_CAPACITY) -> None:
+        self.__lock = threading.Lock()
+        self.__messages: deque[TimestampedMessage] = deque(maxlen=capacity)
+        self.dropped_count = 0
+        """Number of messages overwritten before they were read"""
+        self.tap: Callable[[TimestampedMessage],None]|None = None
+        """Called with every message as it is put, on the producer's thread, e.g. to publish it to other processes (see broker.py). Must not block"""
+
+    def put(self, message: str|bytes, timestamp: float):
+        timestamped = TimestampedMessage(timestamp,message)
+        with self.__lock:
+            if len(self.__messages) == self.__messages.maxlen:
+                self.dropped_count += 1
+            self.__messages.append(timestamped)
+        if self.tap is not None:
+            self.tap(timestamped)
+
+    def drain(self) -> list[TimestampedMessage]:
+        """Remove and return every message, oldest first"""
+        with self.__lock:
+            messages = list(self.__messages)
+            self.__messages.clear()
+            return messages
+
+    def empty(self) -> bool:
+        with self.__lock:
+            return len(self.__messages) == 0
+
+    def __len__(self) -> int:
+        with self.__lock:
+            return len(self.__messages)
+
+
+T = TypeVar("T")
+
+class OverwritingQueue(queue.Queue[T], Generic[T]):
+    """A queue.Queue whose put never blocks: if the queue is full, the oldest item is discarded (and counted in overwritten_count) to make room.
+    Consumers use it exactly like a queue.Queue."""
+
+    def __init__(self, maxsize: int = 0) -> None:
+        super().__init__(maxsize)
+        self.overwritten_count = 0
+        """Number of items discarded before they were consumed"""
+
+    def put(self, item: T, block: bool = True, timeout: float|None = None):
+        # block and timeout are accepted for compatibility with queue.Queue, but put never waits
+        with self.not_full:
+            if 0 < self.maxsize <= self._qsize():
+                self._get()
+                self.overwritten_count += 1
+            else:
+                self.unfinished_tasks += 1
+            self._put(item)
+            self.not_empty.notify()
+
+    def put_nowait(self, item: T):
+        self.put(item)
+
+
+class ConfirmationQueue(OverwritingQueue[WriteCommand]):
+    """OverwritingQueue of confirmed commands that also remembers the latest duty of every pump, so the current duties can be read without consuming the queue.
+    A broadcast command is confirmed as one command per pump, so consumers never see BROADCAST_PUMP"""
+
+    def __init__(self, maxsize: int = 0) -> None:
+        super().__init__(maxsize)
+        self.__duties: dict[str,int] = {}
+        self.tap: Callable[[WriteCommand],None]|None = None
+        """Called with every confirmed command as it is put (broadcasts once per pump), e.g. to publish it to other processes (see broker.py). Must not block"""
+
+    def put(self, item: WriteCommand, block: bool = True, timeout: float|None = None):
+        if item.pump == BROADCAST_PUMP:
+            for pump in self.__every_pump():
+                self.put(WriteCommand(pump,item.duty),block,timeout)
+            return
+        with self.mutex:
+            self.__duties[item.pump] = item.duty
+        super().put(item,block,timeout)
+        if self.tap is not None:
+            self.tap(item)
+
+    def latest_duties(self) -> dict[str,int]:
+        """Pump -> most recently confirmed duty. Pumps that have never been written to are absent"""
+        with self.mutex:
+            return dict(self.__duties)
+
+    def __every_pump(self) -> list[str]:
+        try:
+            pumps = [pmp.value for pmp in PumpConfig().pumps]
+        except RuntimeError:
+            # the pump configuration has not been generated yet, so only the pumps written to so far are known
+            pumps = []
+        with self.mutex:
+            return list(dict.fromkeys(pumps+list(self.__duties)))
@@ -0,0 +1,103 @@
+from dataclasses import dataclass
+from .framing import LineFramer
+from serial import Serial
+import time
+
+# Firmware generated by codegen describes itself with a text line, sent when it starts up and whenever it receives CAPABILITY_QUERY:
+#   #RFB,<version>,pumps=<n>,speeds=<format>,batch=<0|1>,ack=<0|1>,binary=<0|1>,broadcast=<0|1>,baud=<baud rate>,period=<report period in ms>,tacho=<mode>
+# Fields after the version are key=value pairs, so that fields can be added without breaking older hosts, which ignore keys they do not know.
+BANNER_PREFIX = "#RFB"
+BANNER_VERSION = 1
+CAPABILITY_QUERY = b"?"
+"""Sent on its own, outside any command. Ignored by every command reader, including those of sketches that predate the banner"""
+CAPABILITY_TIMEOUT = 2.5
+"""Seconds to wait for the banner. Opening the port resets most boards, which then take up to about 2 s to start"""
+_QUERY_PERIOD = 0.5
+"""Seconds between queries while waiting, since a query that arrives while the board is starting up is lost"""
+_POLL_PERIOD = 0.01
+
+class SpeedFormat:
+    """Values of the speeds field, matching codegen.SpeedFormats"""
+    COMMA_SEPARATED = "comma_separated"
+    NAME_VALUE = "name_value"
+    BINARY = "binary"
+
+class TachoMode:
+    """Values of the tacho field, matching codegen.TachoModes"""
+    PULSE_COUNT = "pulse_count"
+    PERIOD = "period"
+
+@dataclass(frozen=True)
+class FirmwareCapabilities:
+    """What a sketch was generated with, as described by its banner"""
+    version: int
+    num_pumps: int
+    speed_format: str
+    """One of SpeedFormat"""
+    batch_commands: bool
+    """Applies every command of a batched write"""
+    acknowledge_commands: bool
+    binary_protocol: bool
+    broadcast: bool
+    """Understands BROADCAST_PUMP"""
+    baudrate: int
+    report_period: float
+    """Seconds between speed reports"""
+    tacho_mode: str = TachoMode.PULSE_COUNT
+    """How speeds are measured, one of TachoMode"""
+
+    def to_banner(self) -> str:
+        fields = dict(pumps=self.num_pumps,speeds=self.speed_format,batch=int(self.batch_commands),ack=int(self.acknowledge_commands),binary=int(self.binary_protocol),broadcast=int(self.broadcast),baud=self.baudrate,period=max(int(round(self.report_period*1000)),1),tacho=self.tacho_mode)
+        return ",".join([BANNER_PREFIX,str(self.version)]+[f"{key}={value}" for key, value in fields.items()])
+
+    @staticmethod
+    def from_banner(banner: str) -> "FirmwareCapabilities":
+        """Raises ValueError if the banner is malformed or is missing a field"""
+        parts = banner.strip().split(",")
+        if len(parts) < 2 or parts[0] != BANNER_PREFIX:
+            raise ValueError(f"Not a capability banner: {banner}")
+        fields = dict(part.partition("=")[::2] for part in parts[2:])
+        try:
+            return FirmwareCapabilities(
+                version=int(parts[1]),
+                num_pumps=int(fields["pumps"]),
+                speed_format=fields["speeds"],
+                batch_commands=fields["batch"] == "1",
+                acknowledge_commands=fields["ack"] == "1",
+                binary_protocol=fields["binary"] == "1",
+                broadcast=fields.get("broadcast","0") == "1",
+                baudrate=int(fields["baud"]),
+                report_period=int(fields["period"])/1000,
+                tacho_mode=fields.get("tacho",TachoMode.PULSE_COUNT))
+        except KeyError as e:
+            raise ValueError(f"Capability banner is missing {e}: {banner}")
+
+def is_banner(message: str|bytes) -> bool:
+    """Whether a received message is a capability banner rather than a speed report. Banners are text, so binary frames never are"""
+    return isinstance(message,str) and message.startswith(BANNER_PREFIX)
+
+def request_capabilities(serial_inst: Serial, timeout: float = CAPABILITY_TIMEOUT) -> FirmwareCapabilities|None:
+    """Ask the firmware on a freshly opened port what it supports, and wait for its banner. Anything else received meanwhile (e.g. speed reports) is discarded.
+    Returns None if no banner arrives within the timeout, as for sketches generated before the banner was introduced"""
+    framer = LineFramer()
+    deadline = time.monotonic() + timeout
+    next_query = 0.0
+    while (now := time.monotonic()) < deadline:
+        if now >= next_query:
+            serial_inst.write(CAPABILITY_QUERY)
+            next_query = now + _QUERY_PERIOD
+        n_waiting = serial_inst.in_waiting
+        if n_waiting == 0:
+            time.sleep(_POLL_PERIOD)
+            continue
+        for line in framer.feed(serial_inst.read(n_waiting)):
+            # in binary mode, the banner can share a "line" with the tail of a binary frame
+            start = line.find(BANNER_PREFIX)
+            if start < 0:
+                continue
+            try:
+                return FirmwareCapabilities.from_banner(line[start:])
+            except ValueError:
+                # corrupted banner: the next query gets another one
+                pass
+    return None
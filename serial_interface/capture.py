@@ -0,0 +1,107 @@
+from dataclasses import dataclass
+from enum import IntEnum
+from pathlib import Path
+from typing import Iterator, BinaryIO
+from serial import Serial
+import struct
+import time
+
+# A capture file starts with a header
+#   CAPTURE_MAGIC | version (1 byte) | flags (1 byte)
+# followed by one record per chunk of bytes read from or written to the port
+#   timestamp (float64, time.monotonic() of the recording machine) | direction (1 byte) | length (uint32) | bytes
+# Every number is little endian.
+CAPTURE_MAGIC = b"RFBCAP"
+CAPTURE_VERSION = 1
+_HEADER = struct.Struct("<6sBB")
+_RECORD = struct.Struct("<dBI")
+_WRITE_BUFFER_SIZE = 1 << 16
+"""Bytes buffered before the capture is written to disk, so the serial thread rarely waits on the file"""
+
+class CaptureFlags(IntEnum):
+    """Protocol options of the recorded link, so that a capture can be played back without knowing how it was made"""
+    BINARY_PROTOCOL = 1
+    ACKNOWLEDGED_WRITES = 2
+
+class CaptureDirection(IntEnum):
+    RECEIVED = 0
+    """Bytes read from the microcontroller"""
+    SENT = 1
+    """Bytes written to the microcontroller"""
+
+@dataclass(frozen=True)
+class CaptureRecord:
+    timestamp: float
+    """time.monotonic() on the recording machine when the bytes were read or written"""
+    direction: CaptureDirection
+    data: bytes
+
+class CaptureWriter:
+    """Appends every chunk of serial traffic to a capture file, with its timestamp and direction. Only used by the serial thread, so it is not threadsafe"""
+
+    def __init__(self, path: Path|str, binary_protocol: bool = False, acknowledge_writes: bool = False) -> None:
+        self.__file: BinaryIO = open(path,"wb",buffering=_WRITE_BUFFER_SIZE)
+        flags = (CaptureFlags.BINARY_PROTOCOL if binary_protocol else 0) | (CaptureFlags.ACKNOWLEDGED_WRITES if acknowledge_writes else 0)
+        self.__file.write(_HEADER.pack(CAPTURE_MAGIC,CAPTURE_VERSION,flags))
+        self.recorded_bytes = 0
+
+    def record(self, direction: CaptureDirection, data: bytes, timestamp: float|None = None):
+        if len(data) == 0 or self.__file.closed:
+            return
+        self.__file.write(_RECORD.pack(time.monotonic() if timestamp is None else timestamp,direction,len(data)))
+        self.__file.write(data)
+        self.recorded_bytes += len(data)
+
+    def close(self):
+        self.__file.close()
+
+class RecordingSerial:
+    """Stands in for a serial object, recording every chunk that is read from or written to it. Everything else is passed straight through"""
+
+    def __init__(self, serial_inst: Serial, writer: CaptureWriter) -> None:
+        self.__serial_inst = serial_inst
+        self.__writer = writer
+
+    def read(self, size: int = 1) -> bytes:
+        data = self.__serial_inst.read(size)
+        self.__writer.record(CaptureDirection.RECEIVED,data)
+        return data
+
+    def write(self, data: bytes):
+        written = self.__serial_inst.write(data)
+        self.__writer.record(CaptureDirection.SENT,bytes(data))
+        return written
+
+    def __getattr__(self, name: str):
+        return getattr(self.__serial_inst,name)
+
+class CaptureReader:
+    """Reads a capture file one record at a time, so that captures of any length can be played back without loading them into memory"""
+
+    def __init__(self, path: Path|str) -> None:
+        self.__file: BinaryIO = open(path,"rb")
+        header = self.__file.read(_HEADER.size)
+        if len(header) < _HEADER.size:
+            raise ValueError(f"{path} is not a serial capture")
+        magic, version, flags = _HEADER.unpack(header)
+        if magic != CAPTURE_MAGIC:
+            raise ValueError(f"{path} is not a serial capture")
+        if version != CAPTURE_VERSION:
+            raise ValueError(f"{path} is a version {version} capture, but only version {CAPTURE_VERSION} is supported")
+        self.binary_protocol = bool(flags & CaptureFlags.BINARY_PROTOCOL)
+        self.acknowledge_writes = bool(flags & CaptureFlags.ACKNOWLEDGED_WRITES)
+
+    def __iter__(self) -> Iterator[CaptureRecord]:
+        while True:
+            header = self.__file.read(_RECORD.size)
+            if len(header) < _RECORD.size:
+                # the end of the capture, or a record cut short because the recording was interrupted
+                return
+            timestamp, direction, length = _RECORD.unpack(header)
+            data = self.__file.read(length)
+            if len(data) < length:
+                return
+            yield CaptureRecord(timestamp,CaptureDirection(direction),data)
+
+    def close(self):
+        self.__file.close()
@@ -0,0 +1,141 @@
+import binascii
+from enum import IntEnum
+
+MAX_LINE_LENGTH = 4096
+"""Maximum number of bytes held for a single unterminated line. A longer line can only be produced by noise on the port, so it is discarded"""
+
+class LineFramer:
+    """Incrementally splits a stream of serial bytes into text lines.
+    Bytes are fed in chunks of any size; partial lines are held until their terminator arrives in a later chunk.
+    "\\n", "\\r\\n" and a lone "\\r" all terminate a line, and empty lines are skipped."""
+
+    def __init__(self, max_line_length: int = MAX_LINE_LENGTH) -> None:
+        self.__buffer = bytearray()
+        self.__max_line_length = max_line_length
+        self.discarded_bytes = 0
+        """Number of bytes thrown away because a line exceeded the maximum length"""
+
+    def feed(self, data: bytes) -> list[str]:
+        """Add newly received bytes and return every line that has been completed by them, oldest first"""
+        if not data:
+            return []
+        self.__buffer += data
+        # treat carriage returns as line feeds - a "\r\n" pair then produces an empty line, which is skipped below
+        parts = self.__buffer.replace(b"\r",b"\n").split(b"\n")
+        # the final part is either empty (the chunk ended on a terminator) or an incomplete line
+        remainder = parts.pop()
+        if len(remainder) > self.__max_line_length:
+            self.discarded_bytes += len(remainder)
+            remainder = b""
+        self.__buffer = bytearray(remainder)
+        # undecodable bytes are replaced rather than raised, so that a corrupted line is rejected by the parser instead of killing the serial thread
+        return [part.decode(errors="replace") for part in parts if part]
+
+    def pending(self) -> int:
+        """Number of bytes held that belong to an incomplete line"""
+        return len(self.__buffer)
+
+    def reset(self):
+        self.__buffer = bytearray()
+
+
+# Binary frames have the layout
+#   SYNC_BYTE | type | sequence | payload length | payload | CRC (2 bytes, big endian)
+# The CRC is CRC-16/CCITT-FALSE over the type, sequence, length and payload bytes.
+# Each side numbers its frames with a sequence number that wraps at 256, so that lost frames can be counted.
+SYNC_BYTE = 0xA5
+BINARY_HEADER_SIZE = 4
+"""Bytes before the payload: sync, type, sequence and length"""
+BINARY_CRC_SIZE = 2
+MAX_PAYLOAD_LENGTH = 64
+"""Longest payload accepted from the microcontroller. A longer length byte can only be produced by noise on the port"""
+
+class FrameType(IntEnum):
+    SPEEDS = ord("S")
+    """Microcontroller to computer: one little endian uint16 rpm per pump, in pump order"""
+    DUTY = ord("D")
+    """Computer to microcontroller: pump name (one ASCII byte) followed by the duty (one byte)"""
+    ACK = ord("A")
+    """Microcontroller to computer: pump name and duty of a duty that has been applied"""
+
+def crc16(data: bytes) -> int:
+    return binascii.crc_hqx(data,0xFFFF)
+
+def encode_frame(frame_type: FrameType, sequence: int, payload: bytes) -> bytes:
+    body = bytes((frame_type,sequence & 0xFF,len(payload))) + payload
+    return bytes((SYNC_BYTE,)) + body + crc16(body).to_bytes(BINARY_CRC_SIZE,"big")
+
+def frame_type(frame: bytes) -> int:
+    return frame[1]
+
+def frame_payload(frame: bytes) -> bytes:
+    return frame[BINARY_HEADER_SIZE:-BINARY_CRC_SIZE]
+
+class BinaryFramer:
+    """Incrementally splits a stream of serial bytes into binary frames, the counterpart of LineFramer for the binary protocol.
+    Frames whose CRC does not match are rejected, and the search for the next frame resumes from the byte after their sync byte."""
+
+    def __init__(self, max_payload_length: int = MAX_PAYLOAD_LENGTH) -> None:
+        self.__buffer = bytearray()
+        self.__max_payload_length = max_payload_length
+        self.__last_sequence: int|None = None
+        self.discarded_bytes = 0
+        """Number of bytes thrown away because they were not part of a frame"""
+        self.rejected_frames = 0
+        """Number of frames thrown away because their CRC did not match"""
+        self.lost_frames = 0
+        """Number of frames that never arrived (or were rejected), counted from gaps in the sequence numbers"""
+
+    def feed(self, data: bytes) -> list[bytes]:
+        """Add newly received bytes and return every frame that has been completed by them, oldest first"""
+        if not data:
+            return []
+        self.__buffer += data
+        buffer = self.__buffer
+        frames = []
+        start = 0
+        while True:
+            sync = buffer.find(SYNC_BYTE,start)
+            if sync < 0:
+                self.discarded_bytes += len(buffer) - start
+                start = len(buffer)
+                break
+            self.discarded_bytes += sync - start
+            start = sync
+            if len(buffer) - sync < BINARY_HEADER_SIZE:
+                # wait for the rest of the header
+                break
+            payload_length = buffer[sync+3]
+            if payload_length > self.__max_payload_length:
+                # not a real frame: the sync byte was part of the noise
+                self.discarded_bytes += 1
+                start = sync + 1
+                continue
+            end = sync + BINARY_HEADER_SIZE + payload_length + BINARY_CRC_SIZE
+            if len(buffer) < end:
+                # wait for the rest of the frame
+                break
+            if crc16(buffer[sync+1:end-BINARY_CRC_SIZE]) != int.from_bytes(buffer[end-BINARY_CRC_SIZE:end],"big"):
+                self.rejected_frames += 1
+                self.discarded_bytes += 1
+                start = sync + 1
+                continue
+            frame = bytes(buffer[sync:end])
+            self.__count_lost(frame[2])
+            frames.append(frame)
+            start = end
+        del buffer[:start]
+        return frames
+
+    def __count_lost(self, sequence: int):
+        if self.__last_sequence is not None:
+            self.lost_frames += (sequence - self.__last_sequence - 1) & 0xFF
+        self.__last_sequence = sequence
+
+    def pending(self) -> int:
+        """Number of bytes held that may belong to an incomplete frame"""
+        return len(self.__buffer)
+
+    def reset(self):
+        self.__buffer = bytearray()
+        self.__last_sequence = None
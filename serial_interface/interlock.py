@@ -0,0 +1,163 @@
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from .GenericInterface import WriteCommand
+from .protocols import SerialProtocol
+from .buffers import OverwritingQueue
+from support_classes import PumpConfig
+import threading
+import time
+
+STALL_SPEED = 100
+"""Speeds (rpm) below this count as stationary"""
+_TRIP_QUEUE_MAX_SIZE = 100
+
+@dataclass(frozen=True)
+class InterlockTrip:
+    """Pumps the interlock stopped, and why"""
+    timestamp: float
+    """time.monotonic() when the stop was sent"""
+    pumps: tuple[str,...]
+    reasons: tuple[str,...]
+    """Reason each pump was stopped, in the same order as pumps"""
+
+class InterlockRule(ABC):
+    """A condition under which pumps must be stopped immediately. Rules are evaluated by the serial I/O thread, so they must be quick and must not block"""
+
+    @abstractmethod
+    def check(self, interlock: "Interlock", now: float) -> dict[str,str]:
+        """Pumps that must be stopped now, each with the reason"""
+        pass
+
+    def deadline(self, interlock: "Interlock") -> float|None:
+        """time.monotonic() at which the rule could trip without any new speed report arriving, or None if only a report can trip it"""
+        return None
+
+@dataclass
+class OverspeedRule(InterlockRule):
+    """Trips a pump that reports a speed above max_speed"""
+    max_speed: float
+
+    def check(self, interlock: "Interlock", now: float) -> dict[str,str]:
+        return {pump:f"{speed} rpm exceeds the {self.max_speed:g} rpm limit" for pump, speed in interlock.speeds.items() if speed > self.max_speed}
+
+@dataclass
+class StallRule(InterlockRule):
+    """Trips a pump that is driven with a non-zero duty but has stayed below stall_speed for stall_time seconds.
+    The time only starts once the pump's duty was last changed, so a pump is given stall_time to spin up"""
+    stall_time: float
+    stall_speed: float = STALL_SPEED
+
+    def __post_init__(self):
+        self.__stationary_since: dict[str,float] = {}
+
+    def check(self, interlock: "Interlock", now: float) -> dict[str,str]:
+        tripped: dict[str,str] = {}
+        for pump, duty in interlock.duties.items():
+            speed = interlock.speeds.get(pump)
+            if duty == 0 or speed is None or speed >= self.stall_speed:
+                self.__stationary_since.pop(pump,None)
+                continue
+            since = max(self.__stationary_since.setdefault(pump,now),interlock.duty_changed[pump])
+            if now - since >= self.stall_time:
+                tripped[pump] = f"stalled at {speed} rpm with duty {duty} for {now-since:.1f} s"
+        return tripped
+
+@dataclass
+class TelemetryTimeoutRule(InterlockRule):
+    """Trips every running pump if no speed report has arrived for timeout seconds"""
+    timeout: float
+
+    def check(self, interlock: "Interlock", now: float) -> dict[str,str]:
+        silence = now - interlock.last_report
+        if silence < self.timeout:
+            return {}
+        return {pump:f"no speed report for {silence:.1f} s" for pump, duty in interlock.duties.items() if duty != 0}
+
+    def deadline(self, interlock: "Interlock") -> float|None:
+        if all(duty == 0 for duty in interlock.duties.values()):
+            # nothing to stop, so nothing to wake up for
+            return None
+        return interlock.last_report + self.timeout
+
+
+class Interlock:
+    """Safety interlock run by the serial I/O thread, where reports are framed.
+    Speed reports and confirmed duties are fed in as they arrive, and the rules are checked in the same pass. Pumps that trip a rule are stopped with a command written straight to the port, ahead of the write queue and its pacing, and the trip is reported on trips.
+    A stopped pump is not tripped again until it is given a non-zero duty. With no rules, nothing is decoded or checked."""
+
+    def __init__(self, rules: list[InterlockRule]|None = None) -> None:
+        self.__lock = threading.Lock()
+        self.__rules: list[InterlockRule] = list(rules) if rules is not None else []
+        self.speeds: dict[str,int] = {}
+        """Most recently reported speed of each pump"""
+        self.duties: dict[str,int] = {}
+        """Most recently confirmed duty of each pump"""
+        self.duty_changed: dict[str,float] = {}
+        """time.monotonic() at which each pump's duty last changed"""
+        self.last_report = time.monotonic()
+        """time.monotonic() of the most recent speed report (or of when the rules were last set, if later)"""
+        self.trips = OverwritingQueue[InterlockTrip](_TRIP_QUEUE_MAX_SIZE)
+        """Every trip, for the rest of the application to react to (e.g. stop the PID controller and tell the user)"""
+        self.trip_count = 0
+
+    @property
+    def enabled(self) -> bool:
+        return len(self.__rules) > 0
+
+    def set_rules(self, rules: list[InterlockRule]):
+        """Replace the rules. Safe to call from any thread"""
+        with self.__lock:
+            self.__rules = list(rules)
+            # telemetry is timed from now, rather than from a report that arrived while there was no rule
+            self.last_report = max(self.last_report,time.monotonic())
+
+    def report(self, message: str|bytes, protocol: SerialProtocol, timestamp: float):
+        """Record a speed report. Malformed reports are ignored here, and left to the reader to handle"""
+        if not self.enabled:
+            return
+        try:
+            speeds = protocol.decode_speeds(message)
+        except (ValueError, IndexError):
+            return
+        self.report_speeds(speeds,timestamp)
+
+    def report_speeds(self, speeds: list[int], timestamp: float, names: list[str]|None = None):
+        """Record the speed of every pump, in pump order (pumps a, b, c... unless names are given)"""
+        if names is None:
+            names = PumpConfig.allowable_values[:len(speeds)]
+        self.speeds.update(zip(names,speeds))
+        self.last_report = max(self.last_report,timestamp)
+
+    def update_duties(self, duties: dict[str,int], now: float):
+        for pump, duty in duties.items():
+            if self.duties.get(pump) != duty:
+                self.duties[pump] = duty
+                self.duty_changed[pump] = now
+
+    def evaluate(self, now: float) -> list[WriteCommand]:
+        """Check every rule, and return the stop commands to send immediately"""
+        with self.__lock:
+            rules = self.__rules
+        tripped: dict[str,str] = {}
+        for rule in rules:
+            for pump, reason in rule.check(self,now).items():
+                # stopped pumps are not stopped again, but a pump whose duty is unknown is
+                if self.duties.get(pump) != 0:
+                    tripped.setdefault(pump,reason)
+        if len(tripped) == 0:
+            return []
+        for pump in tripped:
+            self.duties[pump] = 0
+            self.duty_changed[pump] = now
+        self.trip_count += 1
+        self.trips.put(InterlockTrip(now,tuple(tripped),tuple(tripped.values())))
+        return [WriteCommand(pump,0) for pump in tripped]
+
+    def time_to_deadline(self, now: float) -> float|None:
+        """Seconds until a rule could trip without a new report, so that the I/O thread wakes in time to check it"""
+        with self.__lock:
+            rules = self.__rules
+        deadlines = [deadline for deadline in (rule.deadline(self) for rule in rules) if deadline is not None]
+        if len(deadlines) == 0:
+            return None
+        return max(min(deadlines)-now,0.0)
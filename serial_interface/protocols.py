@@ -0,0 +1,155 @@
+from abc import ABC, abstractmethod
+from .GenericInterface import GenericInterface, WriteCommand
+from .framing import LineFramer, BinaryFramer, FrameType, encode_frame, frame_type, frame_payload, BINARY_HEADER_SIZE, BINARY_CRC_SIZE
+import struct
+
+_SERIAL_RECEIVE_BUFFER_SIZE = 64
+"""Size of the serial receive buffer of an AVR microcontroller. A batched write must fit inside it"""
+
+class SerialProtocol(ABC):
+    """Encoding of the messages exchanged with the microcontroller.
+    Messages received from the microcontroller are text lines (str) for the text protocol, or whole frames (bytes) for the binary protocol."""
+
+    @property
+    @abstractmethod
+    def max_batch_size(self) -> int:
+        """Most commands sent in a single batched write"""
+        pass
+
+    @abstractmethod
+    def new_framer(self) -> LineFramer|BinaryFramer:
+        """Framer that splits the received byte stream into messages"""
+        pass
+
+    @abstractmethod
+    def encode_duties(self, commands: list[WriteCommand]) -> bytes:
+        pass
+
+    @abstractmethod
+    def is_ack(self, message: str|bytes) -> bool:
+        pass
+
+    @abstractmethod
+    def decode_ack(self, message: str|bytes) -> tuple[str,int]:
+        """Pump and duty confirmed by an acknowledgement. Raises ValueError if the acknowledgement is malformed"""
+        pass
+
+    @abstractmethod
+    def decode_speeds(self, message: str|bytes) -> list[int]:
+        """Speed of every pump in a speed report, in pump order. Raises ValueError if the report is malformed"""
+        pass
+
+    # The remaining methods encode the microcontroller's side of the protocol, and are used to mock it
+
+    @abstractmethod
+    def decode_duties(self, data: bytes) -> list[tuple[str,int]]:
+        pass
+
+    @abstractmethod
+    def encode_ack(self, pump: str, duty: int) -> bytes:
+        pass
+
+    @abstractmethod
+    def encode_speeds(self, speeds: list[int]) -> bytes:
+        pass
+
+
+class TextProtocol(SerialProtocol):
+    """Commands are sent as <name,duty>, speeds are received as comma separated (or <name,value>) lines and acknowledgements as !name,duty lines"""
+
+    @property
+    def max_batch_size(self) -> int:
+        return _SERIAL_RECEIVE_BUFFER_SIZE // len(GenericInterface.format_duty("a",255))
+
+    def new_framer(self) -> LineFramer:
+        return LineFramer()
+
+    def encode_duties(self, commands: list[WriteCommand]) -> bytes:
+        return GenericInterface.format_duties(commands).encode()
+
+    def is_ack(self, message: str) -> bool:
+        return GenericInterface.is_ack(message)
+
+    def decode_ack(self, message: str) -> tuple[str,int]:
+        try:
+            return GenericInterface.unformat_ack(message)
+        except IndexError:
+            raise ValueError(f"Malformed acknowledgement: {message}")
+
+    def decode_speeds(self, message: str) -> list[int]:
+        if "<" not in message:
+            return [int(float(speed)) for speed in message.split(",")]
+        # <name,value> reports: pumps that are missing from the report read as zero
+        speeds: dict[int,int] = {}
+        for pump, speed in (item.split(",") for item in message.strip().removeprefix("<").removesuffix(">").split("><")):
+            speeds[_pump_index(pump)] = int(float(speed))
+        return [speeds.get(i,0) for i in range(max(speeds)+1)]
+
+    def decode_duties(self, data: bytes) -> list[tuple[str,int]]:
+        return GenericInterface.unformat_duties(data.decode())
+
+    def encode_ack(self, pump: str, duty: int) -> bytes:
+        return (GenericInterface.format_ack(pump,duty)+"\n").encode()
+
+    def encode_speeds(self, speeds: list[int]) -> bytes:
+        return (",".join(str(speed) for speed in speeds)+"\n").encode()
+
+
+class BinaryProtocol(SerialProtocol):
+    """Every message is a fixed size binary frame with a sequence number and a CRC (see framing.py), so corrupted messages are rejected instead of being misread"""
+
+    __DUTY_FRAME_SIZE = BINARY_HEADER_SIZE + 2 + BINARY_CRC_SIZE
+
+    def __init__(self) -> None:
+        self.__sequence = 0
+
+    @property
+    def max_batch_size(self) -> int:
+        return _SERIAL_RECEIVE_BUFFER_SIZE // self.__DUTY_FRAME_SIZE
+
+    def new_framer(self) -> BinaryFramer:
+        return BinaryFramer()
+
+    def __next_frame(self, frame_type: FrameType, payload: bytes) -> bytes:
+        frame = encode_frame(frame_type,self.__sequence,payload)
+        self.__sequence = (self.__sequence + 1) & 0xFF
+        return frame
+
+    def encode_duties(self, commands: list[WriteCommand]) -> bytes:
+        return b"".join(self.__next_frame(FrameType.DUTY,_pump_byte(command.pump)+bytes((command.duty,))) for command in commands)
+
+    def is_ack(self, message: bytes) -> bool:
+        return frame_type(message) == FrameType.ACK
+
+    def decode_ack(self, message: bytes) -> tuple[str,int]:
+        return _decode_pump_duty(frame_payload(message))
+
+    def decode_speeds(self, message: bytes) -> list[int]:
+        if frame_type(message) != FrameType.SPEEDS:
+            raise ValueError(f"Expected a speed frame, received frame type {frame_type(message)}")
+        payload = frame_payload(message)
+        return list(struct.unpack(f"<{len(payload)//2}H",payload[:len(payload)//2*2]))
+
+    def decode_duties(self, data: bytes) -> list[tuple[str,int]]:
+        return [_decode_pump_duty(frame_payload(frame)) for frame in BinaryFramer().feed(data) if frame_type(frame) == FrameType.DUTY]
+
+    def encode_ack(self, pump: str, duty: int) -> bytes:
+        return self.__next_frame(FrameType.ACK,_pump_byte(pump)+bytes((duty,)))
+
+    def encode_speeds(self, speeds: list[int]) -> bytes:
+        # rpm is sent as uint16, so it saturates instead of wrapping around
+        return self.__next_frame(FrameType.SPEEDS,struct.pack(f"<{len(speeds)}H",*(min(max(speed,0),0xFFFF) for speed in speeds)))
+
+def _pump_index(pump: str) -> int:
+    name = pump.strip().lower()
+    if len(name) != 1 or not "a" <= name <= "z":
+        raise ValueError(f"Unknown pump name: {pump}")
+    return ord(name) - ord("a")
+
+def _pump_byte(pump: str) -> bytes:
+    return pump.encode("ascii")[:1]
+
+def _decode_pump_duty(payload: bytes) -> tuple[str,int]:
+    if len(payload) != 2:
+        raise ValueError(f"Expected a 2 byte payload, received {len(payload)} bytes")
+    return (chr(payload[0]),payload[1])
@@ -0,0 +1,91 @@
+from typing import Callable
+from .GenericInterface import InterfaceException
+from support_classes import SharedState
+from serial import Serial, SerialException
+from serial.tools.list_ports import comports
+from serial.tools.list_ports_common import ListPortInfo
+import threading
+import time
+
+RECONNECT_INITIAL_DELAY = 0.5
+"""Seconds before the first attempt to reopen a port that has failed. The delay doubles after every failed attempt"""
+RECONNECT_MAX_DELAY = 5.0
+"""Longest delay between attempts to reopen a port"""
+RECONNECT_TIMEOUT = 60.0
+"""Seconds without a connection after which the interface gives up and fails"""
+_COMPORTS_CACHE_LIFETIME = 1.0
+"""comports() can take a large fraction of a second on some platforms, so its results are reused for this long"""
+
+_comports_lock = threading.Lock()
+_comports_cache: tuple[float,list[ListPortInfo]]|None = None
+
+def cached_comports(refresh: bool = False) -> list[ListPortInfo]:
+    """comports(), reusing the result of a recent call unless refresh is True"""
+    global _comports_cache
+    with _comports_lock:
+        now = time.monotonic()
+        if refresh or _comports_cache is None or now - _comports_cache[0] > _COMPORTS_CACHE_LIFETIME:
+            _comports_cache = (now,list(comports()))
+        return _comports_cache[1]
+
+class PortLocator:
+    """Keeps track of the name of a serial port.
+    A USB device that is unplugged (or resets) can come back under a different name (e.g. COM4 -> COM5, /dev/ttyACM0 -> /dev/ttyACM1), so the device is recognised by its USB serial number instead"""
+
+    def __init__(self, port: str) -> None:
+        self.port = port
+        """Name of the port, updated whenever the device is found under a new name"""
+        self.serial_number: str|None = None
+
+    def remember(self):
+        """Record the USB serial number of the port, if it has one"""
+        for info in cached_comports(refresh=True):
+            if info.device == self.port:
+                self.serial_number = info.serial_number
+
+    def locate(self) -> str|None:
+        """Current name of the port, or None if the device is not connected. Ports without a USB serial number are assumed to keep their name"""
+        if self.serial_number is None:
+            return self.port
+        ports = cached_comports()
+        # the old name is kept if the device is still there
+        for info in sorted(ports,key=lambda info: info.device != self.port):
+            if info.serial_number == self.serial_number:
+                self.port = info.device
+                return self.port
+        return None
+
+class Reconnector:
+    """Reopens a serial port that has failed, retrying with exponential backoff until it succeeds or timeout seconds have passed.
+    degraded is True from the failure until the port is open again"""
+
+    def __init__(self, serial_initialiser: Callable[[],Serial], locator: PortLocator, degraded: SharedState[bool], timeout: float = RECONNECT_TIMEOUT) -> None:
+        self.__serial_initialiser = serial_initialiser
+        self.__locator = locator
+        self.__degraded = degraded
+        self.timeout = timeout
+        self.reconnect_count = 0
+        """Number of times the port has been reopened after failing"""
+
+    def reconnect(self, wait: Callable[[float],bool]) -> Serial|None:
+        """Reopen the port. wait(seconds) sleeps between attempts, returning False if the interface has been closed meanwhile, in which case None is returned.
+        Raises InterfaceException if the port cannot be reopened within the timeout"""
+        self.__degraded.set_value(True)
+        deadline = time.monotonic() + self.timeout
+        delay = RECONNECT_INITIAL_DELAY
+        while True:
+            if not wait(min(delay,max(deadline-time.monotonic(),0.0))):
+                return None
+            port = self.__locator.locate()
+            if port is not None:
+                try:
+                    serial_inst = self.__serial_initialiser()
+                    self.reconnect_count += 1
+                    self.__degraded.set_value(False)
+                    return serial_inst
+                except (SerialException, OSError):
+                    # the device is back, but not ready to be opened yet
+                    pass
+            if time.monotonic() >= deadline:
+                raise InterfaceException(f"""Lost connection to port "{self.__locator.port}" and could not reconnect within {self.timeout:g} s""")
+            delay = min(delay*2,RECONNECT_MAX_DELAY)
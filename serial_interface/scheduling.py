@@ -0,0 +1,146 @@
+from .GenericInterface import WriteCommand, WritePriority, BROADCAST_PUMP
+import threading
+import itertools
+
+class WriteScheduler:
+    """Threadsafe replacement for a FIFO of write commands that holds at most one pending command per pump and priority.
+
+    A newer command for a pump supersedes (coalesces) the older pending ones of the same or a lower priority, since only the newest duty is of any use once it is sent.
+    A pending command is never superseded by one of lower priority (e.g. a stop by a routine duty): the newer command waits behind it, at its own priority, and is only due once the older one has been sent.
+    Pumps are drained highest priority first; pumps with equal priority are drained in the order they became pending, so a pump whose duty keeps being replaced is not starved.
+    A broadcast command (BROADCAST_PUMP) supersedes every command of the same or a lower priority pending before it.
+    """
+
+    def __init__(self) -> None:
+        self.__lock = threading.Lock()
+        self.__pending: dict[str,list[tuple[int,int,WriteCommand]]] = {} # for each pump, its pending commands in the order they are due, so in strictly decreasing priority
+        self.__counter = itertools.count()
+        self.coalesced_count = 0
+        """Number of commands that were superseded before being sent"""
+
+    def put(self, command: WriteCommand, priority: WritePriority = WritePriority.NORMAL):
+        command.validate()
+        with self.__lock:
+            self.__put_unlocked(command,priority)
+
+    def put_many(self, commands: list[WriteCommand], priority: WritePriority = WritePriority.NORMAL):
+        """Queue several commands atomically, so the consumer never sees only part of them. Raises ValueError, queueing none of them, if any command is invalid (see WriteCommand.validate)"""
+        for command in commands:
+            command.validate()
+        with self.__lock:
+            for command in commands:
+                self.__put_unlocked(command,priority)
+
+    def __put_unlocked(self, command: WriteCommand, priority: WritePriority):
+        if command.pump == BROADCAST_PUMP:
+            # the broadcast sets every pump, so nothing pending before it at the same or a lower priority is of any use
+            for pmp in list(self.__pending.keys()):
+                if pmp != BROADCAST_PUMP:
+                    self.__supersede_unlocked(pmp,priority)
+        order = self.__supersede_unlocked(command.pump,priority)
+        # a command replacing one of the same priority keeps the pump's place, otherwise the pump moves to the back of its lane
+        self.__pending.setdefault(command.pump,[]).append((priority,next(self.__counter) if order is None else order,command))
+
+    def __supersede_unlocked(self, pump: str, priority: WritePriority) -> int|None:
+        """Drop the pump's pending commands of the same or a lower priority, which are all at the end of its list. Returns the place of a dropped command of the same priority, if there was one"""
+        queued = self.__pending.get(pump)
+        order = None
+        while queued and queued[-1][0] <= priority:
+            (old_priority,old_order,_) = queued.pop()
+            if old_priority == priority:
+                order = old_order
+            self.coalesced_count += 1
+        if queued is not None and len(queued) == 0:
+            del self.__pending[pump]
+        return order
+
+    def __pop_unlocked(self, pump: str) -> WriteCommand:
+        """Remove and return the pump's command that is due first. Any command waiting behind it becomes due"""
+        queued = self.__pending[pump]
+        (_,_,command) = queued.pop(0)
+        if len(queued) == 0:
+            del self.__pending[pump]
+        return command
+
+    def get(self) -> WriteCommand|None:
+        """Remove and return the next command to be sent, or None if nothing is pending"""
+        commands = self.get_many(1)
+        return commands[0] if len(commands) > 0 else None
+
+    def get_many(self, max_commands: int) -> list[WriteCommand]:
+        """Remove and return up to max_commands commands in the order they are due to be sent. At most one command per pump is returned, so a command waiting behind another is sent in a later call"""
+        with self.__lock:
+            # only the first command of each pump is due, so sorting is cheap
+            pumps = sorted(self.__pending, key=lambda pmp: (-self.__pending[pmp][0][0],self.__pending[pmp][0][1]))[:max_commands]
+            return [self.__pop_unlocked(pmp) for pmp in pumps]
+
+    def restore(self, commands: list[WriteCommand], priority: WritePriority = WritePriority.NORMAL):
+        """Queue commands only for the pumps that have nothing pending, so that a pump's newer command is never replaced by an older one"""
+        with self.__lock:
+            for command in commands:
+                if command.pump not in self.__pending and BROADCAST_PUMP not in self.__pending:
+                    self.__put_unlocked(command,priority)
+
+    def get_emergency(self) -> list[WriteCommand]:
+        """Remove and return every pending WritePriority.EMERGENCY command, in the order they were queued. Commands waiting behind them stay pending"""
+        with self.__lock:
+            pumps = sorted((pmp for pmp, queued in self.__pending.items() if queued[0][0] >= WritePriority.EMERGENCY), key=lambda pmp: self.__pending[pmp][0][1])
+            return [self.__pop_unlocked(pmp) for pmp in pumps]
+
+    def discard(self, pumps: list[str]):
+        """Drop any pending commands for the given pumps"""
+        with self.__lock:
+            for pmp in pumps:
+                self.__pending.pop(pmp,None)
+
+    def empty(self) -> bool:
+        with self.__lock:
+            return len(self.__pending) == 0
+
+    def qsize(self) -> int:
+        with self.__lock:
+            return sum(len(queued) for queued in self.__pending.values())
+
+class AckTracker:
+    """Keeps the commands that have been sent to a microcontroller that acknowledges commands, until each one is confirmed.
+    Only used by the serial thread, so it is not threadsafe."""
+
+    def __init__(self) -> None:
+        self.__outstanding: dict[str,WriteCommand] = {}
+        self.unacknowledged_count = 0
+        """Number of sent commands that were never acknowledged before the fallback timer expired"""
+
+    def expect(self, commands: list[WriteCommand]):
+        for command in commands:
+            self.__outstanding[command.pump] = command
+
+    def acknowledge(self, pump: str, duty: int) -> WriteCommand|None:
+        """Match an acknowledgement to the command it confirms. Returns None if no sent command matches it"""
+        command = self.__outstanding.get(pump)
+        if command is None or command.duty != duty:
+            return None
+        return self.__outstanding.pop(pump)
+
+    def expire(self) -> list[WriteCommand]:
+        """Give up waiting for any outstanding acknowledgements, returning the commands that were never confirmed"""
+        commands = list(self.__outstanding.values())
+        self.unacknowledged_count += len(commands)
+        self.__outstanding.clear()
+        return commands
+
+    def discard(self, pumps: list[str]):
+        """Stop waiting for the given pumps' acknowledgements, e.g. because they have since been overridden. Their acknowledgements are then ignored"""
+        if BROADCAST_PUMP in pumps:
+            self.__outstanding.clear()
+            return
+        for pmp in pumps:
+            self.__outstanding.pop(pmp,None)
+
+    def reset(self) -> list[WriteCommand]:
+        """Stop waiting for every outstanding acknowledgement without counting them as unacknowledged (e.g. because the connection was lost), returning the commands that were never confirmed"""
+        commands = list(self.__outstanding.values())
+        self.__outstanding.clear()
+        return commands
+
+    def outstanding(self) -> int:
+        return len(self.__outstanding)
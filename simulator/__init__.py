@@ -0,0 +1,2 @@
+from .models import PumpModel, ReservoirModel, CameraModel
+from .simulation import simulate, parameter_grid, SimulationResults, BatchPID, BATCHED_SETTINGS, SHARED_SETTINGS
\ No newline at end of file
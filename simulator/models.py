@@ -0,0 +1,47 @@
+from dataclasses import dataclass
+import numpy as np
+
+@dataclass(frozen=True)
+class PumpModel:
+    """Flow delivered by a pump: proportional to the duty above the duty at which the pump starts turning, and zero below it"""
+    flow_per_duty: float = 0.05
+    """mL/s per unit of duty"""
+    minimum_duty: float = 0.0
+
+    def flow(self, duty: np.ndarray) -> np.ndarray:
+        return np.maximum(duty - self.minimum_duty, 0.0) * self.flow_per_duty
+
+@dataclass(frozen=True)
+class ReservoirModel:
+    """Anolyte and catholyte reservoirs, each pumped round its half of the cell.
+    Solvent crosses the membrane from the catholyte to the anolyte at a steady rate, and is pushed back by running the anolyte faster than the catholyte (which raises the pressure on the anolyte side). Both reservoirs evaporate at a steady rate, which is what eventually triggers a refill"""
+    anolyte_volume: float = 55.0
+    """Initial volume (mL)"""
+    catholyte_volume: float = 45.0
+    """Initial volume (mL)"""
+    crossover_rate: float = 0.002
+    """mL/s crossing from the catholyte to the anolyte when both are pumped equally"""
+    crossover_per_flow: float = 0.001
+    """mL/s pushed from the anolyte to the catholyte per mL/s by which the anolyte flow exceeds the catholyte flow"""
+    evaporation_rate: float = 0.0005
+    """mL/s lost from each reservoir"""
+
+    def advance(self, anolyte: np.ndarray, catholyte: np.ndarray, anolyte_flow: np.ndarray, catholyte_flow: np.ndarray, anolyte_refill: np.ndarray, catholyte_refill: np.ndarray, seconds: float) -> tuple[np.ndarray,np.ndarray]:
+        """Volumes after the given time with steady flows (mL/s). Volumes are exact, since every rate is constant over the interval, until a reservoir runs dry"""
+        transfer = self.crossover_per_flow*(anolyte_flow - catholyte_flow) - self.crossover_rate
+        anolyte = anolyte + (anolyte_refill - transfer - self.evaporation_rate)*seconds
+        catholyte = catholyte + (catholyte_refill + transfer - self.evaporation_rate)*seconds
+        return (np.maximum(anolyte,0.0), np.maximum(catholyte,0.0))
+
+@dataclass(frozen=True)
+class CameraModel:
+    """Level sensing by the camera and computer vision"""
+    noise: float = 0.5
+    """Standard deviation (mL) of the error in each volume read from an image"""
+    latency: float = 0.5
+    """Seconds from capturing an image to the PID controller acting on its reading"""
+
+    def read(self, volume: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+        if self.noise <= 0:
+            return volume.copy()
+        return volume + rng.normal(0.0, self.noise, volume.shape)
@@ -0,0 +1,184 @@
+from dataclasses import dataclass
+from collections import deque
+from itertools import product
+from typing import Any, Iterable
+from support_classes import Settings, DEFAULT_SETTINGS
+from serial_interface.SerialInterface import SERIAL_WRITE_PAUSE
+from pump_control.control_logic import PID_STARTING_OUTPUT, pid_tunings, pid_output_limits, split_control, refill_conditions
+from pump_control.timeavg import TimeAvg
+from .models import PumpModel, ReservoirModel, CameraModel
+import numpy as np
+import time
+
+BATCHED_SETTINGS = (Settings.PROPORTIONAL_GAIN, Settings.INTEGRAL_GAIN, Settings.DERIVATIVE_GAIN, Settings.BASE_CONTROL_DUTY,
+                    Settings.REFILL_PERCENTAGE_TRIGGER, Settings.PID_REFILL_COOLDOWN, Settings.REFILL_TIME, Settings.REFILL_DUTY, Settings.REFILL_STOP_ON_FULL)
+"""Settings that can take a different value in every parameter set of a run"""
+SHARED_SETTINGS = (Settings.SENSING_PERIOD, Settings.AVERAGE_WINDOW_WIDTH, Settings.LEVEL_STABILISATION_PERIOD)
+"""Settings that must be the same for every parameter set, since they set the times at which every set is sensed and averaged"""
+DEFAULT_SETTLE_TOLERANCE = 1.0
+"""mL either side of equal levels within which the levels count as settled"""
+
+class BatchPID:
+    """simple_pid.PID as PIDRunner configures it (proportional on error, derivative on measurement, integral clamped to the output limits, setpoint of zero), for many controllers stepped together"""
+
+    def __init__(self, tunings: tuple[np.ndarray,np.ndarray,np.ndarray], output_limits: tuple[np.ndarray,np.ndarray], starting_output: float) -> None:
+        (self.__kp, self.__ki, self.__kd) = tunings
+        (self.__lower, self.__upper) = output_limits
+        self.__integral = np.clip(starting_output, self.__lower, self.__upper)
+        self.__last_input: np.ndarray|None = None
+
+    def __call__(self, input_: np.ndarray, dt: float) -> np.ndarray:
+        error = 0 - input_
+        d_input = input_ - self.__last_input if self.__last_input is not None else np.zeros_like(input_)
+        proportional = self.__kp*error
+        self.__integral = np.clip(self.__integral + self.__ki*error*dt, self.__lower, self.__upper)
+        derivative = -self.__kd*d_input/dt
+        self.__last_input = input_
+        return np.clip(proportional + self.__integral + derivative, self.__lower, self.__upper)
+
+@dataclass(frozen=True)
+class SimulationResults:
+    """Performance of every parameter set of a run. Arrays are indexed like the values in parameters"""
+    parameters: dict[Settings,np.ndarray]
+    settling_time: np.ndarray
+    """Seconds until the difference in level entered the tolerance for the rest of the run. NaN if it was outside at the end"""
+    overshoot: np.ndarray
+    """mL by which the difference in level went past equal levels, on the opposite side to where it started"""
+    refill_count: np.ndarray
+    """Number of refills started"""
+    duration: float
+    """Simulated seconds"""
+    wall_time: float
+    """Seconds taken to simulate every parameter set"""
+
+    @property
+    def speedup(self) -> float:
+        """Simulated time per second of wall time, for the whole batch at once"""
+        return self.duration/self.wall_time if self.wall_time > 0 else float("inf")
+
+    def __len__(self) -> int:
+        return len(self.settling_time)
+
+    def rows(self) -> list[dict[str,Any]]:
+        """One dict per parameter set, of its parameters (by setting name) and results"""
+        return [{**{setting.value: values[i].item() for setting, values in self.parameters.items()},
+                 "settling_time": self.settling_time[i].item(), "overshoot": self.overshoot[i].item(), "refill_count": self.refill_count[i].item()}
+                for i in range(len(self))]
+
+def parameter_grid(values: dict[Settings,Iterable[Any]]) -> dict[Settings,np.ndarray]:
+    """Every combination of the given values, as one array per setting"""
+    settings = list(values.keys())
+    combinations = list(product(*[list(values[setting]) for setting in settings]))
+    return {setting: np.array([combination[i] for combination in combinations]) for i, setting in enumerate(settings)}
+
+def simulate(grid: dict[Settings,Iterable[Any]], duration: float,
+             settings: dict[Settings,Any]|None = None,
+             reservoir: ReservoirModel = ReservoirModel(),
+             pump: PumpModel = PumpModel(),
+             refill_pump: PumpModel = PumpModel(flow_per_duty=0.01),
+             camera: CameraModel = CameraModel(),
+             actuation_delay: float = SERIAL_WRITE_PAUSE,
+             settle_tolerance: float = DEFAULT_SETTLE_TOLERANCE,
+             seed: int|None = None) -> SimulationResults:
+    """Run the level sensing and PID control loop against the models for the given duration, for every combination of the values in grid (each one of BATCHED_SETTINGS) at once.
+    Settings not in grid are taken from settings, and then DEFAULT_SETTINGS. The refill cooldown is lengthened to the averaging window, as Pump does.
+    Both refill pumps are assumed to be assigned. Duties take effect actuation_delay seconds after the controller sets them"""
+    settings = {**DEFAULT_SETTINGS, **(settings or {})}
+    unknown = [setting for setting in grid.keys() if setting not in BATCHED_SETTINGS]
+    if len(unknown) > 0:
+        raise ValueError(f"Settings cannot differ between parameter sets: {', '.join(setting.value for setting in unknown)}")
+    parameters = parameter_grid(grid)
+    n = len(next(iter(parameters.values()))) if len(parameters) > 0 else 1
+    def batched(setting: Settings, dtype: type) -> np.ndarray:
+        return parameters[setting].astype(dtype) if setting in parameters else np.full(n, settings[setting], dtype=dtype)
+
+    sense_period = float(settings[Settings.SENSING_PERIOD])
+    window = float(settings[Settings.AVERAGE_WINDOW_WIDTH])
+    stabilisation_period = float(settings[Settings.LEVEL_STABILISATION_PERIOD])
+    base_duty = batched(Settings.BASE_CONTROL_DUTY, float)
+    refill_duty = batched(Settings.REFILL_DUTY, float)
+    refill_percentage = batched(Settings.REFILL_PERCENTAGE_TRIGGER, float)
+    refill_cooldown = np.maximum(batched(Settings.PID_REFILL_COOLDOWN, float), window)
+    refill_time = batched(Settings.REFILL_TIME, float)
+    refill_stop_on_full = batched(Settings.REFILL_STOP_ON_FULL, bool)
+    pid = BatchPID(pid_tunings(batched(Settings.PROPORTIONAL_GAIN, float), batched(Settings.INTEGRAL_GAIN, float), batched(Settings.DERIVATIVE_GAIN, float)),
+                   pid_output_limits(base_duty), PID_STARTING_OUTPUT)
+    rng = np.random.default_rng(seed)
+    wall_start = time.perf_counter()
+
+    # plant
+    anolyte = np.full(n, reservoir.anolyte_volume)
+    catholyte = np.full(n, reservoir.catholyte_volume)
+    zero = np.zeros(n)
+    flows = (zero, zero, zero, zero) # anolyte, catholyte, anolyte refill and catholyte refill pumps
+    pending: deque[tuple[float,tuple[np.ndarray,...]]] = deque() # flows waiting to take effect, by the time they do
+
+    # level sensor, as in LevelSensor._loop
+    readings_buffer = TimeAvg(window, data_size=4)
+    vol_init: np.ndarray|None = None
+
+    # PID controller, as in PIDRunner
+    refilling = np.zeros(n, dtype=bool)
+    refill_start = np.zeros(n)
+    refill_finish = np.full(n, -np.inf)
+    refill_count = np.zeros(n, dtype=int)
+    refill_duties = zero
+
+    # metrics
+    initial_difference = reservoir.anolyte_volume - reservoir.catholyte_volume
+    settled_since = np.where(abs(initial_difference) <= settle_tolerance, 0.0, np.nan)
+    overshoot = np.zeros(n)
+
+    def update_refills(start: np.ndarray, stop: np.ndarray, now: float):
+        nonlocal refilling, refill_start, refill_finish, refill_duties, refill_count
+        refilling = (refilling | start) & ~stop
+        refill_start = np.where(start, now, refill_start)
+        refill_finish = np.where(start, -np.inf, np.where(stop, now, refill_finish))
+        refill_count = refill_count + start
+        refill_duties = np.where(start, refill_duty, np.where(stop, 0.0, refill_duties))
+
+    steps = int(np.ceil(duration/sense_period))
+    for i in range(steps):
+        t = i*sense_period
+
+        # ---------- level sensing ----------
+        vol_an = camera.read(anolyte, rng)
+        vol_cath = camera.read(catholyte, rng)
+        if i*sense_period < stabilisation_period or vol_init is None:
+            net_vol_change = zero
+        else:
+            net_vol_change = vol_an + vol_cath - vol_init
+        readings_buffer.append(np.stack((vol_an, vol_cath, vol_an - vol_cath, net_vol_change)), t)
+        (avg_an, avg_cath, avg_diff, avg_change) = readings_buffer.calculate()
+        if i*sense_period < stabilisation_period:
+            vol_init = avg_an + avg_cath
+
+        # ---------- control ----------
+        now = t + camera.latency
+        # while refilling, the controller checks the time-based cutoff as soon as new levels are announced, and then again with them
+        (start, stop) = refill_conditions(None, None, refilling, now - refill_start, now - refill_finish, refill_percentage, refill_cooldown, refill_time, refill_stop_on_full)
+        update_refills(start & refilling, stop & refilling, now)
+        (start, stop) = refill_conditions(avg_an + avg_cath, avg_change, refilling, now - refill_start, now - refill_finish, refill_percentage, refill_cooldown, refill_time, refill_stop_on_full)
+        update_refills(start, stop, now)
+        control = np.round(pid(avg_diff, sense_period))
+        (anolyte_duty, catholyte_duty) = split_control(control, base_duty)
+        pending.append((now + actuation_delay, (pump.flow(anolyte_duty), pump.flow(catholyte_duty), refill_pump.flow(refill_duties), refill_pump.flow(refill_duties))))
+
+        # ---------- plant ----------
+        t_next = t + sense_period
+        while len(pending) > 0 and pending[0][0] < t_next:
+            (t_change, new_flows) = pending.popleft()
+            if t_change > t:
+                (anolyte, catholyte) = reservoir.advance(anolyte, catholyte, *flows, t_change - t)
+                t = t_change
+            flows = new_flows
+        (anolyte, catholyte) = reservoir.advance(anolyte, catholyte, *flows, t_next - t)
+
+        # ---------- metrics ----------
+        difference = anolyte - catholyte
+        settled = np.abs(difference) <= settle_tolerance
+        settled_since = np.where(settled, np.where(np.isnan(settled_since), t_next, settled_since), np.nan)
+        past_setpoint = np.abs(difference) if initial_difference == 0 else -np.sign(initial_difference)*difference
+        overshoot = np.maximum(overshoot, past_setpoint)
+
+    return SimulationResults(parameters, settled_since, overshoot, refill_count, steps*sense_period, time.perf_counter() - wall_start)
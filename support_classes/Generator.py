@@ -1,8 +1,8 @@
 from abc import ABC, abstractmethod
 import asyncio
 from .shared_state import SharedState
+from .scheduler import PeriodicScheduler, ScheduleStatistics
 from typing import TypeVar, Generic
-import time
 
 T = TypeVar("T")
 
@@ -17,6 +17,9 @@ class Generator(Generic[T],ABC):
         self.state = SharedState[T]()
         self.__flag = asyncio.Event()
         self.is_running = SharedState[bool](False)
+        self.schedule_statistics = SharedState[ScheduleStatistics]()
+        """Published every run of a loop that waits with _wait_for_deadline"""
+        self.__scheduler: PeriodicScheduler|None = None
     
     @abstractmethod
     async def _setup(self) -> None:
@@ -30,6 +33,8 @@ class Generator(Generic[T],ABC):
         self.__flag.clear()
         try:
             await self._setup()
+            if self.__scheduler is not None:
+                self.__scheduler.restart()
             self.is_running.set_value(True)
             while not self.__flag.is_set():
                 new_state = await self._loop()
@@ -40,13 +45,29 @@ class Generator(Generic[T],ABC):
             self.is_running.set_value(False)
             self.teardown()
 
-    async def _wait_while_checking(self,wait_duration: float, check_interval = 0.1):
-        t_start = time.time()
-        t = t_start
-        while t-t_start<wait_duration and not self.__flag.is_set():
-            await asyncio.sleep(check_interval)
-            t = time.time()
 
+    def _set_period(self, period: float):
+        """Run the loop at fixed deadlines, period seconds apart, by awaiting _wait_for_deadline at the start of each run. Can be changed while the loop runs"""
+        if self.__scheduler is None:
+            self.__scheduler = PeriodicScheduler(period)
+        else:
+            self.__scheduler.period = period
+
+    async def _wait_for_deadline(self) -> bool:
+        """Wait until the next run is due (see _set_period). Returns False without waiting any longer if the generator is stopped meanwhile"""
+        if self.__scheduler is None:
+            raise GeneratorException("No period has been set for the loop")
+        delay = self.__scheduler.delay()
+        if delay > 0:
+            try:
+                await asyncio.wait_for(self.__flag.wait(),delay)
+            except TimeoutError:
+                pass
+        if self.__flag.is_set():
+            return False
+        self.__scheduler.tick()
+        self.schedule_statistics.set_value(self.__scheduler.statistics())
+        return True
 
     @abstractmethod
     def teardown(self):
@@ -5,7 +5,8 @@ from .Generator import Generator, GeneratorException
 from .shared_state import SharedState, MPSharedState
 from .camera_interface import open_cv2_window, open_video_device, capture, CaptureException, Capture, PygameCapture, CV2Capture, FileCapture
 from .loggable import Loggable
-from .settings_interface import read_settings, modify_settings, Settings, DEFAULT_SETTINGS, PID_SETTINGS, LOGGING_SETTINGS, PID_PUMPS, LEVEL_SETTINGS, CV_SETTINGS, CAMERA_SETTINGS, CV2_BACKENDS, CaptureBackend, ImageFilterType
+from .settings_interface import read_settings, modify_settings, Settings, DEFAULT_SETTINGS, PID_SETTINGS, LOGGING_SETTINGS, PID_PUMPS, LEVEL_SETTINGS, CV_SETTINGS, CAMERA_SETTINGS, SPEED_SETTINGS, INTERLOCK_SETTINGS, CV2_BACKENDS, CaptureBackend, ImageFilterType
 from .file_interface import open_local, get_path
 from .pump_config import PumpNames, PumpConfig
-from .timer import Timer
\ No newline at end of file
+from .timer import Timer
+from .scheduler import PeriodicScheduler, ScheduleStatistics
\ No newline at end of file
@@ -0,0 +1,70 @@
+from dataclasses import dataclass
+from bisect import bisect_left
+import time
+
+JITTER_BIN_EDGES = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0)
+"""Upper edges (s) of the jitter histogram bins"""
+
+@dataclass(frozen=True)
+class ScheduleStatistics:
+    """How closely a periodic loop has kept to its deadlines since it was started"""
+    period: float
+    ticks: int
+    """Number of times the loop has run"""
+    missed_deadlines: int
+    """Deadlines that passed while the previous run was still going. They are skipped rather than run late, so the cadence is kept"""
+    mean_jitter: float
+    """Mean time (s) by which runs started after their deadline"""
+    max_jitter: float
+    jitter_bin_edges: tuple[float,...]
+    jitter_counts: tuple[int,...]
+    """Runs per jitter bin. There is one more count than there are edges: the last counts every run later than the last edge"""
+
+class PeriodicScheduler:
+    """Deadlines for a loop that runs once per period, on time.monotonic().
+    Each deadline is a whole number of periods after the first, rather than a period after the previous run finished, so the time taken by each run is compensated and the cadence does not drift however long the loop runs.
+    Does not wait itself: the caller waits for delay() and then calls tick() (see Generator._wait_for_deadline)"""
+
+    def __init__(self, period: float, bin_edges: tuple[float,...] = JITTER_BIN_EDGES) -> None:
+        self.period = period
+        """Seconds between deadlines. A new period applies from the next deadline on. Zero or less runs the loop back to back"""
+        self.__bin_edges = bin_edges
+        self.restart()
+
+    def restart(self):
+        """Forget the deadlines and statistics, so that the next run is due immediately"""
+        self.__deadline: float|None = None
+        self.__ticks = 0
+        self.__missed = 0
+        self.__total_jitter = 0.0
+        self.__max_jitter = 0.0
+        self.__counts = [0]*(len(self.__bin_edges)+1)
+
+    def delay(self) -> float:
+        """Seconds until the next deadline (zero if it has passed)"""
+        if self.__deadline is None:
+            return 0.0
+        return max(self.__deadline - time.monotonic(), 0.0)
+
+    def tick(self) -> float:
+        """Record that a run is starting now, and move on to the next deadline. Returns the jitter of this run"""
+        now = time.monotonic()
+        if self.__deadline is None:
+            self.__deadline = now
+        jitter = max(now - self.__deadline, 0.0)
+        self.__ticks += 1
+        self.__total_jitter += jitter
+        self.__max_jitter = max(self.__max_jitter, jitter)
+        self.__counts[bisect_left(self.__bin_edges, jitter)] += 1
+        if self.period > 0:
+            # every deadline that has already passed is skipped, rather than run in a burst to catch up
+            skipped = int(jitter // self.period)
+            self.__missed += skipped
+            self.__deadline += (skipped+1)*self.period
+        else:
+            self.__deadline = now
+        return jitter
+
+    def statistics(self) -> ScheduleStatistics:
+        mean_jitter = self.__total_jitter/self.__ticks if self.__ticks > 0 else 0.0
+        return ScheduleStatistics(self.period, self.__ticks, self.__missed, mean_jitter, self.__max_jitter, self.__bin_edges, tuple(self.__counts))
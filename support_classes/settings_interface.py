@@ -93,6 +93,20 @@ class Settings(StrEnum):
     IMAGE_FILTER = "image_filter"
     """The algorithm used to filter the level from fluid images"""
     FILECAPTURE_DIRECTORY = "filecapture_directory"
+    SPEED_POLL_PERIOD = "speed_poll_period"
+    """Minimum period between speed readings. Faster reports from the microcontroller are aggregated (or thinned out) over the period"""
+    SPEED_POLL_TIMEOUT = "speed_poll_timeout"
+    """Longest time to wait for a speed report before the reading is skipped"""
+    AGGREGATE_SPEEDS = "aggregate_speeds"
+    """True if every speed report in a poll period is folded into the reading, False if only the newest report is kept"""
+    SPEED_PER_DUTY = "speed_per_duty"
+    """Nominal pump speed (rpm) per unit of duty, against which pumps are checked for speeds that do not match their duty"""
+    INTERLOCK_MAX_SPEED = "interlock_max_speed"
+    """Speed (rpm) above which a pump is stopped immediately by the serial interface. None to disable"""
+    INTERLOCK_STALL_TIME = "interlock_stall_time"
+    """Time (s) a pump driven with a non-zero duty may stay stationary before it is stopped immediately. None to disable"""
+    INTERLOCK_TELEMETRY_TIMEOUT = "interlock_telemetry_timeout"
+    """Time (s) without speed reports after which every running pump is stopped immediately. None to disable"""
 
 __thispath = Path().absolute().parent
 DEFAULT_SETTINGS: dict[Settings, Any] = {
@@ -133,7 +147,14 @@ DEFAULT_SETTINGS: dict[Settings, Any] = {
     Settings.LOG_IMAGES: False,
     Settings.LOGGING_PERIOD: 5.0,
     Settings.IMAGE_FILTER: ImageFilterType.OTSU,
-    Settings.FILECAPTURE_DIRECTORY: None
+    Settings.FILECAPTURE_DIRECTORY: None,
+    Settings.SPEED_POLL_PERIOD: 0.5,
+    Settings.SPEED_POLL_TIMEOUT: 4.0,
+    Settings.AGGREGATE_SPEEDS: True,
+    Settings.SPEED_PER_DUTY: 12300/255,
+    Settings.INTERLOCK_MAX_SPEED: None,
+    Settings.INTERLOCK_STALL_TIME: None,
+    Settings.INTERLOCK_TELEMETRY_TIMEOUT: None
 }
 
 _LOG_DIRECTORIES = set([Settings.LEVEL_DIRECTORY,Settings.PID_DIRECTORY,Settings.SPEED_DIRECTORY,Settings.IMAGE_DIRECTORY])
@@ -145,6 +166,8 @@ CAMERA_SETTINGS = set([Settings.IMAGE_SAVE_PERIOD,Settings.IMAGE_RESCALE_FACTOR,
 CV_SETTINGS = set([Settings.LEVEL_STABILISATION_PERIOD,Settings.SENSING_PERIOD,Settings.AVERAGE_WINDOW_WIDTH])
 #TODO should log images and image directory be included here?
 LEVEL_SETTINGS = set([*CAMERA_SETTINGS,*CV_SETTINGS,Settings.LOG_IMAGES,Settings.IMAGE_DIRECTORY,Settings.FILECAPTURE_DIRECTORY,Settings.IMAGE_FILTER])
+INTERLOCK_SETTINGS = set([Settings.INTERLOCK_MAX_SPEED,Settings.INTERLOCK_STALL_TIME,Settings.INTERLOCK_TELEMETRY_TIMEOUT])
+SPEED_SETTINGS = set([Settings.SPEED_POLL_PERIOD,Settings.SPEED_POLL_TIMEOUT,Settings.AGGREGATE_SPEEDS,Settings.SPEED_PER_DUTY])
 _PATH_SETTINGS = set([*_LOG_DIRECTORIES,Settings.FILECAPTURE_DIRECTORY])
 
 def read_settings(*keys: Settings) -> dict[Settings,Any]:
@@ -10,6 +10,14 @@ class Timer:
         """Check if time greater than the pause period has elapsed since last reset"""
         return (time.time() - self.__previous_time) >= self.__pause_period
     
+    def remaining(self):
+        """Seconds until the pause period has elapsed since last reset (zero if it already has)"""
+        return max(self.__pause_period - (time.time() - self.__previous_time), 0.0)
+    
     def reset(self):
         """Reset the timer"""
-        self.__previous_time = time.time()
\ No newline at end of file
+        self.__previous_time = time.time()
+
+    def expire(self):
+        """Make the pause period elapse now"""
+        self.__previous_time = time.time() - self.__pause_period
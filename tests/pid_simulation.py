@@ -0,0 +1,62 @@
+import argparse
+import csv
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).absolute().parent.parent))
+
+from simulator import simulate, ReservoirModel, CameraModel
+from support_classes import Settings, DEFAULT_SETTINGS
+
+
+# Use this script to tune the PID controller and refill parameters offline
+# Every combination of the given values is simulated at once, against the reservoir, pump and camera models in simulator/models.py
+# Settings that are not given keep their default values
+def main():
+    parser = argparse.ArgumentParser(description="Simulate the level control loop for a grid of parameters")
+    parser.add_argument("--proportional", type=float, nargs="+", default=[DEFAULT_SETTINGS[Settings.PROPORTIONAL_GAIN]])
+    parser.add_argument("--integral", type=float, nargs="+", default=[DEFAULT_SETTINGS[Settings.INTEGRAL_GAIN]])
+    parser.add_argument("--derivative", type=float, nargs="+", default=[DEFAULT_SETTINGS[Settings.DERIVATIVE_GAIN]])
+    parser.add_argument("--refill-trigger", type=float, nargs="+", default=[DEFAULT_SETTINGS[Settings.REFILL_PERCENTAGE_TRIGGER]], help="refill percentage trigger")
+    parser.add_argument("--cooldown", type=float, nargs="+", default=[DEFAULT_SETTINGS[Settings.PID_REFILL_COOLDOWN]], help="refill cooldown in seconds")
+    parser.add_argument("--hours", type=float, default=24.0, help="simulated time")
+    parser.add_argument("--anolyte", type=float, default=ReservoirModel.anolyte_volume, help="initial anolyte volume in mL")
+    parser.add_argument("--catholyte", type=float, default=ReservoirModel.catholyte_volume, help="initial catholyte volume in mL")
+    parser.add_argument("--noise", type=float, default=CameraModel.noise, help="standard deviation of each volume reading in mL")
+    parser.add_argument("--latency", type=float, default=CameraModel.latency, help="seconds from image capture to control")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--top", type=int, default=10, help="number of parameter sets to print, fastest to settle first")
+    parser.add_argument("--csv", type=Path, help="also save every result to this file")
+    args = parser.parse_args()
+
+    grid = {
+        Settings.PROPORTIONAL_GAIN: args.proportional,
+        Settings.INTEGRAL_GAIN: args.integral,
+        Settings.DERIVATIVE_GAIN: args.derivative,
+        Settings.REFILL_PERCENTAGE_TRIGGER: args.refill_trigger,
+        Settings.PID_REFILL_COOLDOWN: args.cooldown,
+    }
+    results = simulate(grid, args.hours*3600,
+                       reservoir=ReservoirModel(anolyte_volume=args.anolyte, catholyte_volume=args.catholyte),
+                       camera=CameraModel(noise=args.noise, latency=args.latency),
+                       seed=args.seed)
+    print(f"Simulated {len(results)} parameter sets for {args.hours:g}h in {results.wall_time:.1f}s ({results.speedup:.0f}x real time)")
+
+    rows = results.rows()
+    # parameter sets that never settled go last
+    ranked = sorted(rows, key=lambda row: (row["settling_time"] != row["settling_time"], row["settling_time"], row["overshoot"]))
+    for row in ranked[:args.top]:
+        settled = "never settled" if row["settling_time"] != row["settling_time"] else f"settled after {row['settling_time']/60:.1f}min"
+        parameters = ", ".join(f"{setting.value}={row[setting.value]:g}" for setting in grid.keys())
+        print(f"{parameters}: {settled}, overshoot {row['overshoot']:.2f}mL, {row['refill_count']} refills")
+
+    if args.csv is not None:
+        with open(args.csv, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
+            writer.writeheader()
+            writer.writerows(rows)
+        print(f"Results saved to {args.csv}")
+
+
+if __name__ == "__main__":
+    main()
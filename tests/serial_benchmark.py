@@ -0,0 +1,802 @@
+import argparse
+import asyncio
+import importlib
+import json
+import platform
+import queue
+import random
+import statistics
+import struct
+import subprocess
+import sys
+import threading
+import time
+from dataclasses import dataclass, asdict
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).absolute().parent.parent))
+
+from serial_interface import DummyInterface, SerialInterface, PlaybackInterface, InterfaceException, WriteCommand, DUMMY_PORT
+from serial_interface.DummyInterface import DummySerial
+from serial_interface.SerialInterface import read_loop, SERIAL_WRITE_PAUSE
+from serial_interface.buffers import MessageRing
+from serial_interface.framing import LineFramer
+from serial_interface.scheduling import WriteScheduler
+from serial_interface.protocols import TextProtocol, BinaryProtocol
+from pump_control.async_serialreader import SerialReader
+from pump_control.speed_decoder import SpeedDecoder
+from serial_interface.framing import FrameType, frame_type, frame_payload
+from serial_interface.capabilities import CAPABILITY_QUERY
+from support_classes import PumpConfig, AsyncRunner
+
+# the package namespace shadows the module with the SerialInterface class, so fetch the module explicitly
+serial_module = importlib.import_module("serial_interface.SerialInterface")
+
+
+# Use this script to measure the performance of the serial stack
+# Latency is measured against the mocked DummyInterface:
+#   Write latency: time from SerialInterface.write to the bytes being handed to the serial object
+#   Read latency: time from a speed line becoming available on the serial object to SerialInterface.readbuffer returning it
+# Framing throughput is measured by pushing a large synthetic byte stream through read_loop
+# Confirmation latency: time from writing one command per pump to every command being reported on written_duties, with and without acknowledgements
+# Protocols are compared by the bytes needed for one speed report and the rate at which reports are decoded
+# Speed decoding: reports decoded per second at 26 pumps by SpeedDecoder, against the dictionary building decoders it replaced
+# Write scheduling is measured in simulated time: several sources issue duties faster than the write pause allows them to be sent
+# Read path throughput: speed lines per second (and CPU time per line) through read_loop and SerialReader._loop together
+# Workloads drive a SerialInterface end to end with scripted bursts of writes, against DummyInterface or the firmware emulator running in its own process:
+#   Command latency: time from a write being scheduled on the event loop thread (as Pump.manual_set_duty does) to its bytes being written to the port
+#   Queue depth: commands waiting in the write scheduler, sampled over time
+#   CPU per line: CPU time of this process per speed report received
+# Run with --json PATH to save every result, so that regressions can be tracked between versions
+# Run with --replay CAPTURE to instead play a capture recorded by SerialInterface(capture_path=...) through SerialReader as fast as possible.
+#   With --decoded PATH, every decoded reading is also saved as a JSON line, so that the output of two versions can be compared with diff
+
+BENCH_WRITE_PAUSE = 0.05
+"""Replacement for SERIAL_WRITE_PAUSE so that write samples can be collected quickly"""
+BENCH_REPORT_PERIOD = 0.2137
+"""Seconds between speed lines produced by the mocked serial port. Deliberately not a multiple of any loop period, so that the sampling phase drifts"""
+N_SAMPLES = 25
+FRAMING_LINES = 200_000
+"""Number of synthetic speed lines in the framing benchmark"""
+FRAMING_PUMPS = 6
+FRAMING_CHUNK_SIZE = 64
+"""Bytes that arrive between consecutive polls of the port in the framing benchmark (the size of an AVR serial buffer)"""
+PROTOCOL_PUMP_COUNTS = (6, 26)
+PROTOCOL_REPORTS = 20_000
+"""Number of speed reports decoded per protocol"""
+BAUD_BYTES_PER_SECOND = 9600/10
+"""Bytes per second at 9600 baud (8 data bits plus start and stop bits)"""
+SCHEDULING_DURATION = 600.0
+"""Simulated seconds in the write scheduling benchmark"""
+SCHEDULING_SOURCES = [
+    # (pumps written, period in seconds) for each source of write commands
+    (("a", "b"), 3.0), # PID controller
+    (("c", "d"), 10.0), # refill logic
+    (("a",), 7.0), # manual sets
+]
+DECODING_PUMPS = 26
+DECODING_REPORTS = 50_000
+"""Number of speed reports decoded per format and decoder"""
+READ_PATH_LINES = 50_000
+"""Number of speed lines pushed through read_loop and SerialReader._loop"""
+QUEUE_DEPTH_SAMPLE_PERIOD = 0.01
+"""Seconds between samples of the write scheduler's depth during a workload"""
+QUEUE_DEPTH_MAX_POINTS = 200
+"""The queue depth time series saved to JSON is thinned to at most this many points"""
+WORKLOAD_DRAIN_TIMEOUT = SERIAL_WRITE_PAUSE + 1.0
+"""Longest wait after the last burst for the remaining commands to be written"""
+
+
+@dataclass
+class Workload:
+    name: str
+    interface: str
+    """"dummy" for DummyInterface, or "emulator" for SerialInterface connected to the firmware emulator"""
+    num_pumps: int
+    report_period: float
+    """Seconds between speed reports, in the emulator's clock"""
+    burst_period: float
+    """Seconds between bursts of writes. Each burst sets a new duty on every pump, one write at a time"""
+    duration: float = 5.0
+    acknowledge_writes: bool = True
+    binary_protocol: bool = False
+    baudrate: int = 9600
+    clock_speed: float = 1.0
+
+
+WORKLOADS = [
+    Workload("dummy, 6 pumps, fast reports", "dummy", 6, report_period=0.05, burst_period=0.25),
+    Workload("emulator, 6 pumps, unacknowledged", "emulator", 6, report_period=1.0, burst_period=1.0, duration=8.0, acknowledge_writes=False),
+    Workload("emulator, 26 pumps, text, 115200 baud, 10x clock", "emulator", 26, report_period=0.1, burst_period=0.5, baudrate=115200, clock_speed=10.0),
+    Workload("emulator, 26 pumps, binary, 115200 baud, 10x clock", "emulator", 26, report_period=0.1, burst_period=0.5, binary_protocol=True, baudrate=115200, clock_speed=10.0),
+]
+
+
+class _BenchSerial(DummySerial):
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.write_times: list[float] = []
+        self.ready_time = time.time()
+        self.next_ready_time = self.ready_time + BENCH_REPORT_PERIOD
+
+    @property
+    def in_waiting(self) -> int:
+        # lines are produced on a fixed clock that is independent of when the port is read
+        if time.time() >= self.next_ready_time:
+            return len(self.output) - self.output_pointer
+        return 0
+
+    def _generate_output(self):
+        if hasattr(self, "next_ready_time"):
+            # the line that has just been consumed became available at next_ready_time
+            self.ready_time = self.next_ready_time
+            self.next_ready_time += BENCH_REPORT_PERIOD
+        return super()._generate_output()
+
+    def write(self, b: bytes):
+        self.write_times.append(time.time())
+        return super().write(b)
+
+
+class _BenchInterface(DummyInterface):
+
+    def __init__(self, num_pumps: int, port: str, **kwargs) -> None:
+        self.bench_serial: _BenchSerial|None = None
+        self.__bench_pumps = num_pumps
+        super().__init__(num_pumps, port, **kwargs)
+
+    def _serial_initialiser(self):
+        self.bench_serial = _BenchSerial(self.__bench_pumps, self.port)
+        return self.bench_serial
+
+
+class _StreamSerial:
+    """Serial lookalike that releases a pre-generated byte stream in fixed size chunks"""
+
+    def __init__(self, stream: bytes, chunk_size: int) -> None:
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.available_to = 0
+        self.pointer = 0
+
+    def arrive(self) -> bool:
+        """Make the next chunk available. Returns False when the stream is exhausted"""
+        if self.available_to >= len(self.stream):
+            return False
+        self.available_to = min(self.available_to + self.chunk_size, len(self.stream))
+        return True
+
+    @property
+    def in_waiting(self) -> int:
+        return self.available_to - self.pointer
+
+    def read(self, size: int = 1) -> bytes:
+        size = min(size, self.in_waiting)
+        out = self.stream[self.pointer:self.pointer+size]
+        self.pointer += size
+        return out
+
+    def reset_input_buffer(self):
+        self.pointer = self.available_to
+
+
+def _legacy_read_loop(serial_inst: _StreamSerial, read_queue: queue.Queue[str]):
+    """The byte-at-a-time read loop that was used before LineFramer, kept as a reference point"""
+    currentbytes = bytearray()
+    while serial_inst.in_waiting:
+        nextbyte = serial_inst.read()
+        if len(nextbyte) == 0:
+            break
+        elif nextbyte in (b"\n", b"\r"):
+            serial_inst.reset_input_buffer()
+            if read_queue.full():
+                read_queue.get()
+            read_queue.put(currentbytes.decode())
+            currentbytes = bytearray()
+        else:
+            currentbytes += nextbyte
+
+
+def _synthetic_stream(n_lines: int, n_pumps: int) -> tuple[bytes, list[str]]:
+    rng = random.Random(0)
+    lines = [",".join(str(rng.randint(0, 12300)) for _ in range(n_pumps)) for _ in range(n_lines)]
+    return ("\r\n".join(lines)+"\r\n").encode(), lines
+
+
+def benchmark_framing(n_lines: int = FRAMING_LINES, n_pumps: int = FRAMING_PUMPS, chunk_size: int = FRAMING_CHUNK_SIZE) -> dict[str, dict[str, float]]:
+    stream, expected = _synthetic_stream(n_lines, n_pumps)
+
+    def run(reader, read_queue, collect) -> tuple[float, list[str]]:
+        serial_inst = _StreamSerial(stream, chunk_size)
+        t_start = time.perf_counter()
+        while serial_inst.arrive():
+            reader(serial_inst, read_queue)
+        elapsed = time.perf_counter() - t_start
+        return elapsed, collect(read_queue)
+
+    expected_set = set(expected)
+    results = {}
+    framer = LineFramer()
+    # buffers large enough that every decoded line can be checked
+    for name, reader, read_queue, collect in (
+        ("legacy", _legacy_read_loop, queue.Queue(), lambda qu: list(qu.queue)),
+        ("framer", lambda ser, qu: read_loop(ser, qu, framer), MessageRing(n_lines), lambda ring: [message.message for message in ring.drain()]),
+    ):
+        elapsed, lines = run(reader, read_queue, collect)
+        results[name] = {
+            "seconds": elapsed,
+            "lines_per_second": len(lines)/elapsed,
+            "mb_per_second": len(stream)/elapsed/1e6,
+            "lines_out": len(lines),
+            "lines_expected": len(expected),
+            "lines_intact": sum(1 for line in lines if line in expected_set),
+        }
+    return results
+
+
+def _ensure_pumps():
+    try:
+        PumpConfig().pumps
+    except RuntimeError:
+        # pump names can only be generated once, so generate as many as possible. Shorter reports are padded with zeros by the decoders
+        PumpConfig().generate_pumps(PumpConfig.max_pumps)
+
+
+def benchmark_protocols(pump_counts: tuple[int, ...] = PROTOCOL_PUMP_COUNTS, n_reports: int = PROTOCOL_REPORTS) -> dict[str, dict[str, float]]:
+    rng = random.Random(0)
+    results = {}
+    _ensure_pumps()
+    for n_pumps in pump_counts:
+        reports = [[rng.randint(0, 12300) for _ in range(n_pumps)] for _ in range(n_reports)]
+        decoder = SpeedDecoder(PumpConfig().pumps)
+        def decode(message):
+            decoder.decode(message)
+            return decoder.reading()
+        for name, protocol in (("text", TextProtocol()), ("binary", BinaryProtocol())):
+            # messages as read_loop hands them to SerialReader: lines without their terminator, or whole frames
+            framer = protocol.new_framer()
+            messages = framer.feed(b"".join(protocol.encode_speeds(report) for report in reports))
+            n_bytes = sum(len(protocol.encode_speeds(report)) for report in reports[:1000])/1000
+            t_start = time.perf_counter()
+            for message in messages:
+                decode(message)
+            elapsed = time.perf_counter() - t_start
+            results[f"{name}, {n_pumps} pumps"] = {
+                "bytes_per_report": n_bytes,
+                "max_reports_per_second_at_9600_baud": BAUD_BYTES_PER_SECOND/n_bytes,
+                "decoded_per_second": len(messages)/elapsed,
+            }
+    return results
+
+
+def _legacy_extract_comma_separated(serial_text: str) -> dict:
+    """The comma separated decoder that was used before SpeedDecoder, kept as a reference point"""
+    new_speeds = list(map(float,serial_text.split(",")))
+    if len(new_speeds)<len(PumpConfig().pumps):
+        additional_speeds = [0.0]*(len(PumpConfig().pumps)-len(new_speeds))
+        new_speeds = [*new_speeds,*additional_speeds]
+    return dict(zip(PumpConfig().pumps,new_speeds))
+
+
+def _legacy_extract_binary(frame: bytes) -> dict:
+    """The binary decoder that was used before SpeedDecoder, kept as a reference point"""
+    if frame_type(frame) != FrameType.SPEEDS:
+        raise ValueError(f"Expected a speed frame, received frame type {frame_type(frame)}")
+    payload = frame_payload(frame)
+    new_speeds = [float(speed) for speed in struct.unpack(f"<{len(payload)//2}H",payload[:len(payload)//2*2])]
+    n_pumps = len(PumpConfig().pumps)
+    if len(new_speeds)<n_pumps:
+        new_speeds += [0.0]*(n_pumps-len(new_speeds))
+    return dict(zip(PumpConfig().pumps,new_speeds))
+
+
+def benchmark_speed_decoding(n_pumps: int = DECODING_PUMPS, n_reports: int = DECODING_REPORTS) -> dict[str, dict[str, float]]:
+    _ensure_pumps()
+    rng = random.Random(0)
+    reports = [[rng.randint(0, 12300) for _ in range(n_pumps)] for _ in range(n_reports)]
+    names = PumpConfig.allowable_values[:n_pumps]
+    binary = BinaryProtocol()
+    messages = {
+        "comma separated": [",".join(str(speed) for speed in report) for report in reports],
+        # the previous <name,value> decoder never worked (it discarded the stripped text), so it has no reference point
+        "name value": ["".join(f"<{name},{speed}>" for name, speed in zip(names, report)) for report in reports],
+        "binary": binary.new_framer().feed(b"".join(binary.encode_speeds(report) for report in reports)),
+    }
+    legacy = {"comma separated": _legacy_extract_comma_separated, "binary": _legacy_extract_binary}
+    decoder = SpeedDecoder(PumpConfig().pumps)
+    def decode_and_snapshot(message):
+        decoder.decode(message)
+        return decoder.reading()
+    results = {}
+    for fmt, fmt_messages in messages.items():
+        decoders = {"legacy": legacy.get(fmt), "decode": decoder.decode, "decode and snapshot": decode_and_snapshot}
+        for name, decode in decoders.items():
+            if decode is None:
+                continue
+            t_start = time.perf_counter()
+            for message in fmt_messages:
+                decode(message)
+            elapsed = time.perf_counter() - t_start
+            results[f"{fmt}, {name}"] = {"decoded_per_second": len(fmt_messages)/elapsed, "us_per_report": elapsed/len(fmt_messages)*1e6}
+    return results
+
+
+class _FifoScheduler:
+    """The plain FIFO that was used before WriteScheduler, kept as a reference point"""
+
+    def __init__(self) -> None:
+        self.queue = queue.Queue[WriteCommand]()
+        self.coalesced_count = 0
+
+    def put(self, command: WriteCommand):
+        self.queue.put(command)
+
+    def get(self) -> WriteCommand|None:
+        try:
+            return self.queue.get_nowait()
+        except queue.Empty:
+            return None
+
+
+def benchmark_scheduling(duration: float = SCHEDULING_DURATION, write_pause: float = SERIAL_WRITE_PAUSE) -> dict[str, dict[str, float]]:
+    rng = random.Random(0)
+    issued: list[tuple[float, WriteCommand]] = []
+    for pumps, period in SCHEDULING_SOURCES:
+        t = rng.uniform(0, period)
+        while t < duration:
+            issued += [(t, WriteCommand(pmp, rng.randint(0, 255))) for pmp in pumps]
+            t += period
+    issued.sort(key=lambda item: item[0])
+
+    results = {}
+    for name, scheduler in (("fifo", _FifoScheduler()), ("coalescing", WriteScheduler())):
+        # for each pump, the issue times of commands that have not been actuated yet, in issue order
+        unresolved: dict[str, list[tuple[float, WriteCommand]]] = {}
+        latencies: list[float] = []
+        i = 0
+        t_write = 0.0
+        while t_write < duration:
+            while i < len(issued) and issued[i][0] <= t_write:
+                t_issue, command = issued[i]
+                scheduler.put(command)
+                unresolved.setdefault(command.pump, []).append((t_issue, command))
+                i += 1
+            command = scheduler.get()
+            if command is not None:
+                # the sent command actuates itself and resolves every older command for the same pump
+                pending = unresolved[command.pump]
+                index = next(k for k, item in enumerate(pending) if item[1] is command)
+                latencies += [t_write - t_issue for t_issue, _ in pending[:index+1]]
+                del pending[:index+1]
+            t_write += write_pause
+        ordered = sorted(latencies)
+        results[name] = {
+            "commands_issued": i,
+            "commands_actuated": len(latencies),
+            "commands_unresolved": sum(len(pending) for pending in unresolved.values()),
+            "commands_coalesced": scheduler.coalesced_count,
+            "mean_latency_s": statistics.mean(ordered),
+            "p99_latency_s": ordered[int(0.99*(len(ordered)-1))],
+        }
+    return results
+
+
+class _RingInterface:
+    """Just enough of GenericInterface for SerialReader: readbatch drains the ring that read_loop fills"""
+
+    capabilities = None
+    """No banner, so the speed format is detected from the reports"""
+
+    def __init__(self, ring: MessageRing) -> None:
+        self.ring = ring
+
+    async def readbatch(self):
+        return self.ring.drain()
+
+    def applied_duties(self):
+        return {}
+
+
+def benchmark_read_path(n_lines: int = READ_PATH_LINES, n_pumps: int = FRAMING_PUMPS, chunk_size: int = FRAMING_CHUNK_SIZE, aggregate: bool = True) -> dict[str, float]:
+    _ensure_pumps()
+    stream, _ = _synthetic_stream(n_lines, n_pumps)
+    ring = MessageRing(n_lines)
+    # every batch is parsed as soon as it arrives, rather than after the poll period
+    reader = SerialReader(_RingInterface(ring), poll_period=0, aggregate=aggregate)
+    framer = LineFramer()
+
+    async def run() -> int:
+        await reader._setup()
+        serial_inst = _StreamSerial(stream, chunk_size)
+        n_readings = 0
+        while serial_inst.arrive():
+            read_loop(serial_inst, ring, framer)
+            if not ring.empty():
+                await reader._loop()
+                n_readings += 1
+        return n_readings
+
+    t_start, cpu_start = time.perf_counter(), time.process_time()
+    n_readings = asyncio.run(run())
+    elapsed, cpu = time.perf_counter() - t_start, time.process_time() - cpu_start
+    return {
+        "lines": n_lines,
+        "readings": n_readings,
+        "lines_per_second": n_lines/elapsed,
+        "cpu_us_per_line": cpu/n_lines*1e6,
+    }
+
+
+def replay_capture(capture: Path, decoded: Path|None = None) -> dict[str, float]:
+    _ensure_pumps()
+    interface = PlaybackInterface(capture, speed=None)
+    # every batch is parsed as soon as it is played, rather than after the poll period
+    reader = SerialReader(interface, poll_period=0)
+    n_messages = 0
+    readbatch = interface.readbatch
+    async def counting_readbatch():
+        nonlocal n_messages
+        messages = await readbatch()
+        n_messages += len(messages)
+        return messages
+    interface.readbatch = counting_readbatch
+
+    async def run(output) -> tuple[int, float]:
+        await interface.establish()
+        await reader._setup()
+        n_readings = 0
+        t_first = None
+        while True:
+            try:
+                reading = await reader._loop()
+            except InterfaceException:
+                # the end of the capture
+                break
+            if reading is None:
+                continue
+            n_readings += 1
+            # times are relative to the first reading, so that they match between runs
+            t_first = reader.reading_time if t_first is None else t_first
+            if output is not None:
+                output.write(json.dumps({"time": round(reader.reading_time - t_first, 6), "speeds": {pmp.value: speed for pmp, speed in reading.items()}}) + "\n")
+        return n_readings, 0.0 if t_first is None else reader.reading_time - t_first
+
+    t_start, cpu_start = time.perf_counter(), time.process_time()
+    output = open(decoded, "w") if decoded is not None else None
+    try:
+        n_readings, span = asyncio.run(run(output))
+    finally:
+        interface.close()
+        if output is not None:
+            output.close()
+    elapsed, cpu = time.perf_counter() - t_start, time.process_time() - cpu_start
+    return {
+        "messages": n_messages,
+        "readings": n_readings,
+        "recorded_seconds": span,
+        "elapsed_seconds": elapsed,
+        "messages_per_second": n_messages/elapsed,
+        "cpu_us_per_message": cpu/max(n_messages, 1)*1e6,
+    }
+
+
+class _BenchRunner(AsyncRunner):
+    """Event loop thread standing in for Pump, which calls the interface from its own loop"""
+
+    def _async_teardowns(self):
+        return []
+
+    def _sync_teardown(self):
+        pass
+
+
+def _record_writes(serial_inst, write_log: list[tuple[float, bytes]]):
+    """Log the time and bytes of every write to the serial object"""
+    write = serial_inst.write
+    def recording_write(data: bytes):
+        written = write(data)
+        write_log.append((time.monotonic(), bytes(data)))
+        return written
+    serial_inst.write = recording_write
+    return serial_inst
+
+
+class _RecordingDummyInterface(DummyInterface):
+
+    def __init__(self, *args, **kwargs) -> None:
+        self.write_log: list[tuple[float, bytes]] = []
+        super().__init__(*args, **kwargs)
+
+    def _serial_initialiser(self):
+        return _record_writes(super()._serial_initialiser(), self.write_log)
+
+
+class _RecordingPtyInterface(SerialInterface):
+    """SerialInterface for the emulator's pseudo terminal, which is not listed as a serial port"""
+
+    def __init__(self, port: str, **kwargs) -> None:
+        self.write_log: list[tuple[float, bytes]] = []
+        try:
+            super().__init__(port, **kwargs)
+        except InterfaceException:
+            pass
+
+    def _serial_initialiser(self):
+        return _record_writes(super()._serial_initialiser(), self.write_log)
+
+
+def _start_emulator(workload: Workload) -> tuple[subprocess.Popen, str]:
+    """Run the firmware emulator in its own process, so that its CPU time is not counted against the serial stack"""
+    args = [sys.executable, "-m", "microcontroller.emulator", "--pumps", str(workload.num_pumps), "--clock-speed", str(workload.clock_speed),
+            "--report-period", str(workload.report_period), "--baudrate", str(workload.baudrate), "--int-bits", "32"]
+    if workload.binary_protocol:
+        args.append("--binary")
+    if not workload.acknowledge_writes:
+        args.append("--no-ack")
+    process = subprocess.Popen(args, cwd=Path(__file__).absolute().parent.parent, stdout=subprocess.PIPE, text=True)
+    port = process.stdout.readline().strip()
+    if port == "":
+        process.kill()
+        raise RuntimeError("The firmware emulator did not start")
+    return process, port
+
+
+async def _receive_reports(interface, stop: threading.Event) -> list[float]:
+    """Read every speed report until stopped, returning the time each one waited between arriving and being read"""
+    waits = []
+    while not stop.is_set():
+        try:
+            messages = await asyncio.wait_for(interface.readbatch(), 0.5)
+        except TimeoutError:
+            continue
+        except InterfaceException:
+            break
+        now = time.monotonic()
+        waits += [now - message.timestamp for message in messages]
+    return waits
+
+
+def _command_latencies(issued: dict[str, list[tuple[float, int]]], write_log: list[tuple[float, bytes]], protocol) -> tuple[list[float], int]:
+    """Match written duties to the commands that were issued. A write resolves the command it carries and every older command for the same pump, which it superseded.
+    Returns the latencies and the number of commands that were never written"""
+    pending = {pump: list(commands) for pump, commands in issued.items()}
+    latencies = []
+    for t_write, data in write_log:
+        if data == CAPABILITY_QUERY:
+            # written while the interface was established, not a command
+            continue
+        for pump, duty in protocol.decode_duties(data):
+            commands = pending.get(pump, [])
+            matches = [k for k, (t_issue, issued_duty) in enumerate(commands) if issued_duty == duty and t_issue <= t_write]
+            if len(matches) == 0:
+                continue
+            latencies += [t_write - t_issue for t_issue, _ in commands[:matches[-1]+1]]
+            del commands[:matches[-1]+1]
+    return latencies, sum(len(commands) for commands in pending.values())
+
+
+def run_workload(workload: Workload) -> dict:
+    _ensure_pumps()
+    rng = random.Random(0)
+    serial_module.SERIAL_WRITE_PAUSE = SERIAL_WRITE_PAUSE
+    options = dict(baudrate=workload.baudrate, batch_writes=True, acknowledge_writes=workload.acknowledge_writes, binary_protocol=workload.binary_protocol)
+    emulator = None
+    if workload.interface == "emulator":
+        emulator, port = _start_emulator(workload)
+        interface = _RecordingPtyInterface(port, **options)
+    else:
+        interface = _RecordingDummyInterface(workload.num_pumps, DUMMY_PORT, report_period=workload.report_period, **options)
+    protocol = BinaryProtocol() if workload.binary_protocol else TextProtocol()
+    pumps = PumpConfig.allowable_values[:workload.num_pumps]
+    runner = _BenchRunner()
+    stop = threading.Event()
+    depth_samples: list[tuple[float, int]] = []
+    try:
+        runner.run_async(interface.establish()).result()
+        receiving = runner.run_async(_receive_reports(interface, stop))
+
+        t_start, cpu_start = time.monotonic(), time.process_time()
+        def sample_depth():
+            while not stop.is_set():
+                depth_samples.append((time.monotonic() - t_start, interface._write_scheduler.qsize()))
+                time.sleep(QUEUE_DEPTH_SAMPLE_PERIOD)
+        sampler = threading.Thread(target=sample_depth, daemon=True)
+        sampler.start()
+
+        # bursts of writes, each handed to the event loop as Pump.manual_set_duty does
+        issued: dict[str, list[tuple[float, int]]] = {pump: [] for pump in pumps}
+        t_burst = t_start
+        while t_burst < t_start + workload.duration:
+            time.sleep(max(t_burst - time.monotonic(), 0))
+            for pump in pumps:
+                duty = rng.randint(0, 255)
+                issued[pump].append((time.monotonic(), duty))
+                runner.run_sync(interface.write, args=(WriteCommand(pump, duty),))
+            t_burst += workload.burst_period
+        t_drain = time.monotonic()
+        while not interface._write_scheduler.empty() and time.monotonic() - t_drain < WORKLOAD_DRAIN_TIMEOUT:
+            time.sleep(QUEUE_DEPTH_SAMPLE_PERIOD)
+        elapsed, cpu = time.monotonic() - t_start, time.process_time() - cpu_start
+        stop.set()
+        sampler.join()
+        read_waits = receiving.result()
+    finally:
+        stop.set()
+        interface.close()
+        runner.stop_event_loop()
+        if emulator is not None:
+            emulator.terminate()
+            emulator.wait()
+
+    latencies, unresolved = _command_latencies(issued, interface.write_log, protocol)
+    depths = [depth for _, depth in depth_samples]
+    step = max(-(-len(depth_samples)//QUEUE_DEPTH_MAX_POINTS), 1)
+    return {
+        "workload": asdict(workload),
+        "reports_received": len(read_waits),
+        "reports_per_second": len(read_waits)/elapsed,
+        "report_read_wait": _percentiles(read_waits),
+        "command_latency": _percentiles(latencies),
+        "commands_issued": sum(len(commands) for commands in issued.values()),
+        "commands_unresolved": unresolved,
+        "commands_coalesced": interface.coalesced_writes,
+        "serial_writes": len(interface.write_log),
+        "queue_depth_mean": statistics.mean(depths) if depths else 0,
+        "queue_depth_max": max(depths, default=0),
+        "queue_depth_series": [[round(t, 3), depth] for t, depth in depth_samples[::step]],
+        "cpu_seconds": cpu,
+        "cpu_ms_per_report": cpu/len(read_waits)*1000 if read_waits else None,
+    }
+
+
+def _percentiles(samples: list[float]) -> dict[str, float]:
+    if len(samples) == 0:
+        return {"n": 0}
+    ms = sorted(s*1000 for s in samples)
+    return {
+        "n": len(ms),
+        "mean_ms": statistics.mean(ms),
+        "p50_ms": statistics.median(ms),
+        "p99_ms": ms[min(len(ms)-1, int(round(0.99*(len(ms)-1))))],
+        "max_ms": ms[-1],
+    }
+
+
+def _summarise(samples: list[float]) -> str:
+    return _format_percentiles(_percentiles(samples))
+
+
+def _format_percentiles(stats: dict[str, float]) -> str:
+    if stats["n"] == 0:
+        return "n=0"
+    return f"n={stats['n']} mean={stats['mean_ms']:.2f}ms p50={stats['p50_ms']:.2f}ms p99={stats['p99_ms']:.2f}ms max={stats['max_ms']:.2f}ms"
+
+
+async def measure_latency(num_pumps: int = 4) -> tuple[list[float], list[float]]:
+    serial_module.SERIAL_WRITE_PAUSE = BENCH_WRITE_PAUSE
+    interface = _BenchInterface(num_pumps, DUMMY_PORT)
+    await interface.establish()
+    # let the I/O thread settle before sampling
+    await asyncio.sleep(BENCH_REPORT_PERIOD)
+    try:
+        # read latency
+        read_latencies = []
+        while len(read_latencies) < N_SAMPLES:
+            await interface.readbuffer()
+            read_latencies.append(time.time() - interface.bench_serial.ready_time)
+
+        # write latency: wait for the pacing window to open before each write so only the I/O loop is measured
+        write_latencies = []
+        for i in range(N_SAMPLES):
+            await asyncio.sleep(BENCH_WRITE_PAUSE*3)
+            n_before = len(interface.bench_serial.write_times)
+            t_start = time.time()
+            interface.write(WriteCommand("a", i % 256))
+            while len(interface.bench_serial.write_times) == n_before:
+                await asyncio.sleep(0.001)
+            write_latencies.append(interface.bench_serial.write_times[-1] - t_start)
+        return read_latencies, write_latencies
+    finally:
+        interface.close()
+
+
+async def measure_confirmation(acknowledge_writes: bool, num_pumps: int = 4) -> list[float]:
+    serial_module.SERIAL_WRITE_PAUSE = BENCH_WRITE_PAUSE
+    interface = DummyInterface(num_pumps, DUMMY_PORT, acknowledge_writes=acknowledge_writes)
+    await interface.establish()
+    try:
+        latencies = []
+        for i in range(N_SAMPLES):
+            # start each sample with the pacing window open, as after an idle period
+            await asyncio.sleep(BENCH_WRITE_PAUSE*3)
+            t_start = time.time()
+            for pmp in PumpConfig.allowable_values[:num_pumps]:
+                interface.write(WriteCommand(pmp, i % 256))
+            for _ in range(num_pumps):
+                await asyncio.to_thread(interface.written_duties.get)
+            latencies.append(time.time() - t_start)
+        return latencies
+    finally:
+        interface.close()
+
+
+def _git_commit() -> str|None:
+    try:
+        result = subprocess.run(["git", "rev-parse", "HEAD"], cwd=Path(__file__).absolute().parent, capture_output=True, text=True)
+    except OSError:
+        return None
+    return result.stdout.strip() if result.returncode == 0 else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the serial stack")
+    parser.add_argument("--json", type=Path, help="also save every result to this file")
+    parser.add_argument("--replay", type=Path, help="only play this capture through SerialReader, as fast as possible")
+    parser.add_argument("--decoded", type=Path, help="with --replay, save every decoded reading to this file as JSON lines")
+    args = parser.parse_args()
+    results = {}
+
+    if args.replay is not None:
+        results["replay"] = replay_capture(args.replay, args.decoded)
+        result = results["replay"]
+        print(f"Replay: {result['messages']} messages ({result['recorded_seconds']:.0f}s recorded) in {result['elapsed_seconds']:.2f}s, "
+              f"{result['messages_per_second']:.0f} messages/s, {result['cpu_us_per_message']:.1f}us CPU per message, {result['readings']} readings")
+    else:
+        run_benchmarks(results)
+    _save_results(args.json, results)
+
+
+def run_benchmarks(results: dict):
+
+    read_latencies, write_latencies = asyncio.run(measure_latency())
+    print("Read latency:  " + _summarise(read_latencies))
+    print("Write latency: " + _summarise(write_latencies))
+    results["latency"] = {"read": _percentiles(read_latencies), "write": _percentiles(write_latencies)}
+    results["confirmation"] = {}
+    for acknowledge_writes in (False, True):
+        latencies = asyncio.run(measure_confirmation(acknowledge_writes))
+        name = "acknowledged" if acknowledge_writes else "timed"
+        print(f"Confirmation latency ({name}, write pause {BENCH_WRITE_PAUSE*1000:.0f}ms): " + _summarise(latencies))
+        results["confirmation"][name] = _percentiles(latencies)
+    results["framing"] = benchmark_framing()
+    for name, result in results["framing"].items():
+        print(f"Framing ({name}): {result['lines_per_second']:.0f} lines/s, {result['mb_per_second']:.2f} MB/s, {result['lines_intact']}/{result['lines_expected']} lines intact")
+    results["protocols"] = benchmark_protocols()
+    for name, result in results["protocols"].items():
+        print(f"Protocol ({name}): {result['bytes_per_report']:.1f} bytes per speed report, at most {result['max_reports_per_second_at_9600_baud']:.1f} reports/s at 9600 baud, {result['decoded_per_second']:.0f} reports decoded/s")
+    results["speed_decoding"] = benchmark_speed_decoding()
+    for name, result in results["speed_decoding"].items():
+        print(f"Speed decoding ({name}, {DECODING_PUMPS} pumps): {result['decoded_per_second']:.0f} reports/s, {result['us_per_report']:.1f}us per report")
+    results["scheduling"] = benchmark_scheduling()
+    for name, result in results["scheduling"].items():
+        print(f"Scheduling ({name}): command-to-actuation mean={result['mean_latency_s']:.1f}s p99={result['p99_latency_s']:.1f}s, {result['commands_coalesced']} coalesced, {result['commands_unresolved']}/{result['commands_issued']} never actuated")
+    results["read_path"] = benchmark_read_path()
+    print(f"Read path (aggregated): {results['read_path']['lines_per_second']:.0f} lines/s, {results['read_path']['cpu_us_per_line']:.1f}us CPU per line")
+    results["read_path_newest"] = benchmark_read_path(aggregate=False)
+    print(f"Read path (newest only): {results['read_path_newest']['lines_per_second']:.0f} lines/s, {results['read_path_newest']['cpu_us_per_line']:.1f}us CPU per line")
+    results["workloads"] = {}
+    for workload in WORKLOADS:
+        result = run_workload(workload)
+        results["workloads"][workload.name] = result
+        cpu = "n/a" if result["cpu_ms_per_report"] is None else f"{result['cpu_ms_per_report']:.2f}ms"
+        print(f"Workload ({workload.name}): {result['reports_per_second']:.1f} reports/s, command latency {_format_percentiles(result['command_latency'])}, "
+              f"queue depth mean={result['queue_depth_mean']:.1f} max={result['queue_depth_max']}, {cpu} CPU per report, {result['commands_unresolved']}/{result['commands_issued']} never written")
+
+
+def _save_results(path: Path|None, results: dict):
+    if path is not None:
+        report = {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "results": results,
+        }
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results saved to {path}")
+
+
+if __name__ == "__main__":
+    main()
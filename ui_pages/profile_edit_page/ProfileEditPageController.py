@@ -76,6 +76,19 @@ class ProfileEditPageController(NewProfilePageController):
         self.__profile = read_profile(profile, debug=debug)
         self.add_listener(MEvents.RequestProfile,self._update_profile)
 
+    def _extract_profile(self, event: MEvents.SaveAutoProfile|MEvents.SaveManualProfile|MEvents.GenerateCode):
+        profile = super()._extract_profile(event)
+        # options that cannot be edited on this page are carried over from the profile being edited
+        profile.batch_writes = self.__profile.batch_writes
+        profile.acknowledge_writes = self.__profile.acknowledge_writes
+        profile.binary_protocol = self.__profile.binary_protocol
+        profile.baudrate = self.__profile.baudrate
+        profile.report_period = self.__profile.report_period
+        profile.async_transport = self.__profile.async_transport
+        profile.broadcast_stop = self.__profile.broadcast_stop
+        profile.period_tachometer = self.__profile.period_tachometer
+        return profile
+
     def _update_profile(self, event: MEvents.RequestProfile):
         profile_event = self.__create_profile_event()
         self.notify_event(profile_event)
@@ -101,7 +114,8 @@ class ProfileEditPageController(NewProfilePageController):
 
     def _generate_code(self,event: MEvents.GenerateCode):
         try:
-            pwd = maybe_generate_code(event.name,event.pin_assignments)
+            # options that cannot be edited on this page are taken from the profile being edited, so the code matches what the computer expects
+            pwd = maybe_generate_code(event.name,event.pin_assignments,**self.__profile.codegen_options())
             ## open file explorer/finder/equivalent
             if platform.system() == "Windows":
                 subprocess.run(["explorer.exe", "/select,", str(pwd)])
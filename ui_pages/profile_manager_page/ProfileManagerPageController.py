@@ -1,5 +1,5 @@
 from ui_pages import ProfileEdit
-from microcontroller import read_profiles, overwrite_profiles, InvalidProfileException
+from microcontroller import read_profiles, overwrite_profiles, InvalidProfileException, MultiPortProfile
 from .PROFILE_MANAGER_EVENTS import PrEvents
 from support_classes import PumpConfig
 from ui_root import UIController
@@ -13,9 +13,16 @@ class ProfileManagerPageController(UIController):
         self.add_listener(PrEvents.RequestProfiles,self.__get_profiles)
         self.add_listener(PrEvents.Back,lambda event: self._back())
         self.add_listener(PrEvents.NewProfile,lambda event: self._next_page(ProfileEdit(None,PumpConfig.allowable_values)))
-        self.add_listener(PrEvents.EditProfile,lambda event: self._next_page(ProfileEdit(event.profile_name,PumpConfig.allowable_values)))
+        self.add_listener(PrEvents.EditProfile,self.__edit_profile)
         self.add_listener(PrEvents.DeleteProfile,self.__delete_profile)
 
+    def __edit_profile(self,event: PrEvents.EditProfile):
+        if any(p.profile_name == event.profile_name and isinstance(p,MultiPortProfile) for p in self.__current_profiles):
+            # the edit page only knows profiles with a single port, and would save this one as such
+            self.notify_event(PrEvents.Error(InvalidProfileException(f"{event.profile_name} uses several ports, so it can only be edited in the profiles file")))
+            return
+        self._next_page(ProfileEdit(event.profile_name,PumpConfig.allowable_values))
+
     def __delete_profile(self,event: PrEvents.DeleteProfile):
         profile_names = [p.profile_name for p in self.__current_profiles]
         if event.profile_name not in profile_names:
@@ -1,9 +1,9 @@
-from serial_interface import GenericInterface, InterfaceException, DummyInterface, SerialInterface
+from serial_interface import GenericInterface, InterfaceException, DummyInterface, SerialInterface, AsyncDummyInterface, AsyncSerialInterface, MultiSerialInterface
 from support_classes.settings_interface import Settings, modify_settings, read_setting
 from ui_root import UIRoot, UIController
 from pump_control import Pump, PumpState, ErrorState, ReadyState, LoadingState
 from .PROFILE_SELECT_EVENTS import PSEvents
-from microcontroller import MicrocontrollerProfile, read_profiles
+from microcontroller import MicrocontrollerProfile, MultiPortProfile, read_profiles
 from ui_pages import ProfileManager, PumpController
 
 
@@ -35,14 +35,21 @@ class ProfileSelectController(UIController):
             selected_port = profile.serial_port
             num_pumps = profile.num_pumps
 
+            interface_options = dict(baudrate=profile.baudrate,batch_writes=profile.batch_writes,acknowledge_writes=profile.acknowledge_writes,binary_protocol=profile.binary_protocol,broadcast_stop=profile.broadcast_stop)
             if self.__requires_debug(profile):
                 save_profile = False
                 if not self.debug:
                     raise ValueError("Invalid profile - debug mode only")
-                interface = DummyInterface(num_pumps,selected_port)
+                interface_class = AsyncDummyInterface if profile.async_transport else DummyInterface
+                interface = interface_class(num_pumps,selected_port,report_period=profile.report_period,**interface_options)
+            elif isinstance(profile,MultiPortProfile):
+                save_profile = True
+                # the pumps of every port are numbered together, so num_pumps is the total across the ports
+                interface = MultiSerialInterface(profile.ports,profile.pump_counts,**interface_options)
             else:
                 save_profile = True
-                interface = SerialInterface(selected_port)
+                interface_class = AsyncSerialInterface if profile.async_transport else SerialInterface
+                interface = interface_class(selected_port,**interface_options)
 
             pump = Pump(interface)
 
@@ -78,6 +85,12 @@ class ProfileSelectController(UIController):
     def __requires_debug(self, profile: str|MicrocontrollerProfile):
         if not isinstance(profile,MicrocontrollerProfile):
             profile = self.__get_profile_from_name(profile)
+        if isinstance(profile,MultiPortProfile):
+            # every port has to be a real one
+            for port in profile.ports:
+                if port not in GenericInterface.get_serial_ports(debug = False)[0]:
+                    raise InterfaceException(f"""Port "{port}" could not be found""")
+            return False
         port = profile.serial_port
         # if the port is not in the real serial port list, then it is a dummy port that requires debug mode for usage
         if port not in GenericInterface.get_serial_ports(debug = False)[0]:
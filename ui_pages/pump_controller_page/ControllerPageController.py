@@ -1,9 +1,9 @@
 from typing import Iterable
 from support_classes.settings_interface import CAMERA_SETTINGS, Settings
 from ui_root import UIRoot, UIController
-from pump_control import Pump, PumpState, ReadyState, ErrorState, PIDException, LevelException, ReadException
+from pump_control import Pump, PumpState, ReadyState, ErrorState, PIDException, LevelException, ReadException, SpeedStatistics
 from .CONTROLLER_EVENTS import CEvents, ProcessName
-from serial_interface import InterfaceException, WriteCommand
+from serial_interface import InterfaceException, WriteCommand, InterlockTrip
 from support_classes import GeneratorException, PumpNames, PumpConfig
 from .processes import PIDProcess, LevelProcess, DataProcess, BaseProcess
 
@@ -15,6 +15,7 @@ class ControllerPageController(UIController):
         super().__init__(root)
         self.pump = pump
         self.__polling_removal_callbacks = []
+        self.__faulty_pumps: frozenset[PumpNames] = frozenset()
         # important event checker - if the pump thread ends then it will need to be joined with main to signal it for garbage colelction
         # pump_join_remover = self._add_event(pump.join_event,pump.stop_event_loop,single_call=True)
         # self.__other_removal_callbacks.append(pump_join_remover)
@@ -49,6 +50,8 @@ class ControllerPageController(UIController):
         # General state poll bindings
         self._add_queue(pump.queue,self.__handle_pump_state)
         self._add_queue(pump.serial_writes,self.__handle_serial_write)
+        self._add_queue(pump.interlock_trips,self.__handle_interlock_trip)
+        self._add_state(pump.link_degraded,self.__handle_link_degraded)
 
         # begin reading the pump speeds
         self.__start_polling()
@@ -72,12 +75,24 @@ class ControllerPageController(UIController):
     def __handle_serial_write(self, new_write: WriteCommand):
         self.notify_event(CEvents.AutoDutySet(PumpConfig().pumps(new_write.pump), new_write.duty))
 
+    def __handle_interlock_trip(self, trip: InterlockTrip):
+        self.pump.interlock_tripped(trip)
+        descriptions = [f"Pump {pmp.upper()}: {reason}" for pmp, reason in zip(trip.pumps,trip.reasons)]
+        self.notify_event(CEvents.Error(ReadException("Interlock stopped "+", ".join(descriptions))))
+
+    def __handle_link_degraded(self, degraded: bool):
+        if degraded:
+            self.notify_event(CEvents.Error(InterfaceException("Serial connection lost, reconnecting...")))
+        else:
+            self.notify_event(CEvents.Ready())
+
     # SERIAL POLLING CALLBACKS
     def __start_polling(self):
         (state_running,state_speeds) = self.pump.start_polling()
         if len(self.__polling_removal_callbacks) == 0:
             self.__polling_removal_callbacks.append(self._add_state(state_running,self.__handlerunning_poller))
             self.__polling_removal_callbacks.append(self._add_state(state_speeds,self.__handlespeeds_poller))
+            self.__polling_removal_callbacks.append(self._add_state(self.pump.speed_statistics(),self.__handle_speed_statistics))
 
     def __close_poller(self):
         self.pump.stop_polling()
@@ -91,6 +106,19 @@ class ControllerPageController(UIController):
         for pmp in new_dict.keys():
             self.notify_event(CEvents.AutoSpeedSet(pmp,new_dict[pmp]))
 
+    def __handle_speed_statistics(self,statistics: SpeedStatistics):
+        # only report changes, so that a persistent fault does not flood the status
+        faulty = statistics.stalled | statistics.mismatched
+        new_faults = faulty - self.__faulty_pumps
+        self.__faulty_pumps = faulty
+        if len(new_faults) == 0:
+            return
+        descriptions = []
+        for pmp in sorted(new_faults):
+            fault = "stalled" if pmp in statistics.stalled else "speed does not match duty"
+            descriptions.append(f"Pump {pmp.value.upper()} {fault} (duty {statistics.duties.get(pmp,0)}, {statistics.mean[pmp]:.0f} rpm)")
+        self.notify_event(CEvents.Error(ReadException(", ".join(descriptions))))
+
     # SETTINGS MODIFICATION LOGIC
     def __handle_settings_changed(self, event: CEvents.SettingsModified):
         modifications = event.modifications